@@ -3,17 +3,27 @@ from __future__ import (print_function, unicode_literals, division,
 
 import io
 import os
+import subprocess
 import sys
-import time
 import threading
 
-from common import vprint, exe_check, ff, get_os, check_load, exe
+from common import vprint, ff, check_load, exe
+from common import exe_grep
 from common import check, wf
+from common import HIGH_PRIORITY
+from common import exe_caching, api_cache
 from common import ASSETS, SUPPORTED_OS_TYPES
 from common import UBUNTU
-from common import get_pkg_manager, APT, YUM
+from common import APT, YUM
+from facts import fact, which, service_active, host_facts
+from facts import SYSCTL, PROCESSES, NEIGHBORS, UNITS, DISTRO, PKG_MANAGER
+from facts import BINARIES, ROUTES, NETWORK
+from sysctl import parse_value, format_value
+from probe import probes, probe_cluster, LATENCY_WARNING, CLUSTER_IPS
+from routes import resolver
 from mtu import load_checks as mtu_checks
 from multipath import load_checks as multipath_checks
+from scheduler import CheckScheduler, DEFAULT_JOBS
 
 try:
     from tabulate import tabulate
@@ -28,15 +38,15 @@ NET_FIX = ("Check the network connection.  If this failure is intermittent "
            "fragmentation")
 
 
-@check("OS", "basic", "os", "local")
+@check("OS", "basic", "os", "local", facts=(DISTRO,))
 def check_os(config):
-    os = get_os()
+    os = fact(DISTRO)
     if os not in SUPPORTED_OS_TYPES:
         return ff("Unsupported Operating System. Supported operating systems: "
                   "{}".format(list(SUPPORTED_OS_TYPES)), "3C47368")
 
 
-@check("SYSCTL", "basic", "sysctl", "misc", "local")
+@check("SYSCTL", "basic", "sysctl", "misc", "local", facts=(SYSCTL,))
 def check_sysctl(config):
     vprint("Checking various sysctl settings")
     settings = sorted([
@@ -59,30 +69,29 @@ def check_sysctl(config):
         ("net.ipv4.tcp_max_syn_backlog", "8192", "2862CB28"),
         ("net.ipv4.tcp_tw_reuse", "1", "989229FC"),
         ("net.ipv4.tcp_synack_retries", "2", "55EF997B")])
+    sysctl = fact(SYSCTL)
     for setting, value, code in settings:
-        found = exe("sysctl --values {}".format(setting)).strip()
-        found = found.strip().strip("\"").split()
-        value = value.strip().strip("\"").split()
-        if len(found) == 1:
-            found = found[0]
-        if len(value) == 1:
-            value = value[0]
+        found = sysctl.get(setting)
+        value = parse_value(value)
         if found != value:
             ff("{}={} is not set. Found: {}".format(
-                setting, value, found), code)
+                setting, format_value(value), format_value(found)), code)
 
 
-@check("ISCSI", "basic", "iscsi", "local")
+@check("ISCSI", "basic", "iscsi", "local",
+       facts=(BINARIES, PKG_MANAGER, PROCESSES))
 def check_iscsi(config):
     vprint("Checking ISCSI settings")
-    if not exe_check("which iscsiadm"):
-        if get_pkg_manager() == APT:
+    if not which("iscsiadm"):
+        fix = None
+        pkg_manager = fact(PKG_MANAGER)
+        if pkg_manager == APT:
             fix = "apt-get install open-iscsi"
-        elif get_pkg_manager() == YUM:
+        elif pkg_manager == YUM:
             fix = "yum install iscsi-initiator-utils"
         ff("iscsiadm is not available, has open-iscsi been installed?",
            "EFBB085C", fix=fix)
-    if not exe_check("ps -ef | grep iscsid | grep -v grep"):
+    if not fact(PROCESSES).by_name("iscsid"):
         fix = "service iscsi start || systemctl start iscsid.service"
         ff("iscsid is not running.  Is the iscsid service running?",
            "EB22737E", fix=fix)
@@ -135,58 +144,52 @@ def check_udev(config):
            fix=fix)
 
 
-@check("ARP", "basic", "arp", "local")
+@check("ARP", "basic", "arp", "local", facts=(SYSCTL,))
 def check_arp(config):
     vprint("Checking ARP settings")
-    if not exe_check("sysctl --all 2>/dev/null | "
-                     "grep 'net.ipv4.conf.all.arp_announce = 2'",
-                     err=False):
+    sysctl = fact(SYSCTL)
+    if sysctl.get("net.ipv4.conf.all.arp_announce") != 2:
         fix = "sysctl net.ipv4.conf.all.arp_announce=2"
         ff("net.ipv4.conf.all.arp_announce != 2 in sysctl", "9000C3B6",
            fix=fix)
-    if not exe_check("sysctl --all 2>/dev/null | "
-                     "grep 'net.ipv4.conf.all.arp_ignore = 1'",
-                     err=False):
+    if sysctl.get("net.ipv4.conf.all.arp_ignore") != 1:
         fix = "sysctl net.ipv4.conf.all.arp_ignore=1"
         ff("net.ipv4.conf.all.arp_ignore != 1 in sysctl", "BDB4D5D8", fix=fix)
     gcf = "/proc/sys/net/ipv4/route/gc_interval"
-    gc = int(exe("cat {}".format(gcf)))
+    gc = sysctl.get("net.ipv4.route.gc_interval")
     if gc != 5:
         fix = "echo 5 > {}".format(gcf)
         ff("{} is currently set to {}".format(gcf, gc), "A06CD19F", fix=fix)
 
 
-@check("IRQ", "basic", "irq", "local")
+@check("IRQ", "basic", "irq", "local", facts=(BINARIES, UNITS))
 def check_irq(config):
     vprint("Checking irqbalance settings, (should be turned off)")
-    if not exe_check("which systemctl"):
-        if not exe_check("service irqbalance status | "
-                         "grep 'Active: active'",
-                         err=True):
+    if service_active("irqbalance"):
+        if not which("systemctl"):
             fix = "service irqbalance stop"
-            return ff("irqbalance is active", "B19D9FF1", fix=fix)
-    else:
-        if not exe_check("systemctl status irqbalance | "
-                         "grep 'Active: active'",
-                         err=True):
+        else:
             fix = "systemctl stop irqbalance && systemctl disable irqbalance"
-            return ff("irqbalance is active", "B19D9FF1", fix=fix)
+        return ff("irqbalance is active", "B19D9FF1", fix=fix)
 
 
-@check("CPUFREQ", "basic", "cpufreq", "local")
+@check("CPUFREQ", "basic", "cpufreq", "local", facts=(BINARIES, DISTRO))
 def check_cpufreq(config):
     vprint("Checking cpufreq settings")
-    if not exe_check("which cpupower"):
-        if get_os() == UBUNTU:
-            version = exe("uname -r").strip()
+    if not which("cpupower"):
+        if fact(DISTRO) == UBUNTU:
+            version = exe(["uname", "-r"], cache=True).strip()
             fix = "apt-get install linux-tools-{}".format(version)
         else:
             # RHEL puts this stuff in kernel-tools
             fix = "yum install kernel-tools"
         return ff("cpupower is not installed", "20CEE732", fix=fix)
-    if not exe_check("cpupower frequency-info --governors | "
-                     "grep performance",
-                     err=False):
+    try:
+        governors = exe_grep(["cpupower", "frequency-info", "--governors"],
+                             "performance", cache=True)
+    except subprocess.CalledProcessError:
+        governors = []
+    if not governors:
         fix = ("No-fix -- if this system is a VM governors might not be "
                "available and this check can be ignored")
         return ff("No 'performance' governor found for system", "333FBD45",
@@ -215,60 +218,97 @@ def check_block_devices(config):
             return ff("Scheduler is not set to noop", "47BB5083", fix=fix)
 
 
-@check("MGMT", "basic", "connection", "local")
+def _check_link(label, ip, down_uid, degraded_uid):
+    iface = fact(ROUTES).interface(ip)
+    if not iface:
+        return
+    links = fact(NETWORK).physical(iface)
+    down = [link.name for link in links if not link.up]
+    if links and len(down) == len(links):
+        ff("No link on {} carrying {} traffic to [{}] via {}".format(
+            ", ".join(down), label, ip, iface), down_uid,
+           fix="Check the cabling and switch port of {}".format(
+               ", ".join(down)))
+    elif down:
+        wf("Interface {} used for {} [{}] is degraded, {} has no "
+           "link".format(iface, label, ip, ", ".join(down)), degraded_uid)
+
+
+def _warn_latency(label, result, latency_uid, loss_uid):
+    if result.loss:
+        wf("Lost {}% of probes to {} [{}]".format(
+            result.loss, label, result.ip), loss_uid, fix=NET_FIX)
+    if result.p99 > LATENCY_WARNING:
+        wf("High latency to {} [{}], p99 {:.2f}ms avg {:.2f}ms exceeds "
+           "{}ms".format(label, result.ip, result.p99, result.avg,
+                         LATENCY_WARNING), latency_uid,
+           fix="Check the storage network for congestion or a degraded link")
+
+
+def _neighbor_reachable(config, ip):
+    """
+    Waits for ip's neighbor entry to be REACHABLE.  Every cluster ip is
+    watched together so the MGMT and VIP checks share one deadline
+    """
+    neighbors = fact(NEIGHBORS)
+    neighbors.watch([config[key] for key in CLUSTER_IPS if config.get(key)])
+    return neighbors.wait(ip)
+
+
+@check("MGMT", "basic", "connection", "local",
+       priority=HIGH_PRIORITY, facts=(NEIGHBORS, ROUTES, NETWORK),
+       cluster=True)
 def mgmt_check(config):
     mgmt = config["mgmt_ip"]
-    if not exe_check("ping -c 2 -W 1 {}".format(mgmt), err=False):
+    result = probe_cluster(config)[mgmt]
+    if not result.reachable:
         ff("Could not ping management ip {}".format(mgmt), "65FC68BB",
            fix=NET_FIX)
-    timeout = 5
-    while not exe_check(
-            "ip neigh show | grep {} | grep REACHABLE".format(mgmt)):
-        timeout -= 1
-        time.sleep(1)
-        if timeout < 0:
-            fix = "Check the connection to {}".format(mgmt)
-            wf("Arp state for mgmt [{}] is not 'REACHABLE'".format(mgmt),
-               "BF6A912A", fix=fix)
-            break
-
-
-@check("VIP1", "basic", "connection", "local")
+    else:
+        _warn_latency("mgmt", result, "5E0C2A71", "A2D9F4B6")
+    _check_link("mgmt", mgmt, "47C0E9B3", "F3A6185D")
+    if not _neighbor_reachable(config, mgmt):
+        fix = "Check the connection to {}".format(mgmt)
+        wf("Arp state for mgmt [{}] is not 'REACHABLE'".format(mgmt),
+           "BF6A912A", fix=fix)
+
+
+@check("VIP1", "basic", "connection", "local",
+       priority=HIGH_PRIORITY, facts=(NEIGHBORS, ROUTES, NETWORK),
+       cluster=True)
 def vip1_check(config):
     vip1 = config["vip1_ip"]
-    if not exe_check("ping -c 2 -W 1 {}".format(vip1), err=False):
+    result = probe_cluster(config)[vip1]
+    if not result.reachable:
         ff("Could not ping vip1 ip {}".format(vip1), "1827147B", fix=NET_FIX)
-    timeout = 5
-    while not exe_check(
-            "ip neigh show | grep {} | grep REACHABLE".format(vip1)):
-        timeout -= 1
-        time.sleep(1)
-        if timeout < 0:
-            wf("Arp state for vip1 [{}] is not 'REACHABLE'".format(vip1),
-               "3C33D70D")
-            break
-
-
-@check("VIP2", "basic", "connection", "local")
+    else:
+        _warn_latency("vip1", result, "C7B1E358", "7F24D0A9")
+    _check_link("vip1", vip1, "0B8E5F26", "6D2A94C1")
+    if not _neighbor_reachable(config, vip1):
+        wf("Arp state for vip1 [{}] is not 'REACHABLE'".format(vip1),
+           "3C33D70D")
+
+
+@check("VIP2", "basic", "connection", "local",
+       priority=HIGH_PRIORITY, facts=(NEIGHBORS, ROUTES, NETWORK),
+       cluster=True)
 def vip2_check(config):
     vip2 = config.get("vip2_ip")
     if not vip2:
         wf("No vip2_ip found", "16EB208B")
         return
-    if vip2 and not exe_check("ping -c 2 -W 1 {}".format(vip2), err=False):
+    result = probe_cluster(config)[vip2]
+    if not result.reachable:
         ff("Could not ping vip2 ip {}".format(vip2), "3D76CE5A", fix=NET_FIX)
-    timeout = 5
-    while not exe_check(
-            "ip neigh show | grep {} | grep REACHABLE".format(vip2)):
-        timeout -= 1
-        time.sleep(1)
-        if timeout < 0:
-            wf("Arp state for vip2 [{}] is not 'REACHABLE'".format(vip2),
-               "4F6B8D91")
-            break
-
-
-@check("CALLHOME", "basic", "setup", "local")
+    else:
+        _warn_latency("vip2", result, "92E6AB1F", "D18F5C03")
+    _check_link("vip2", vip2, "A85C3F70", "2E9D07B4")
+    if not _neighbor_reachable(config, vip2):
+        wf("Arp state for vip2 [{}] is not 'REACHABLE'".format(vip2),
+           "4F6B8D91")
+
+
+@check("CALLHOME", "basic", "setup", "local", cluster=True)
 def callhome_check(config):
     api = config["api"]
     if not api.system.get()['callhome_enabled']:
@@ -301,25 +341,46 @@ def load_plugin_checks(plugins):
         check_list.extend(plugs[plugin].load_checks())
 
 
-def run_checks(config, plugins=None, tags=None, not_tags=None):
+def _connect(config):
+    try:
+        config.connect()
+    except Exception as e:
+        # Remembered by the config, every cluster check that reads it then
+        # fails and is reported by the scheduler
+        vprint("Could not connect to the cluster: {}".format(e))
+
+
+def run_checks(config, plugins=None, tags=None, not_tags=None,
+               jobs=DEFAULT_JOBS, timeout=None):
     if plugins:
         load_plugin_checks(plugins)
-    threads = []
 
     # Filter checks to be executed based on tags passed in
     checks = check_list
     if tags:
-        checks = filter(lambda x: any([t in x._tags for t in tags]),
-                        checks)
+        checks = [ck for ck in checks if any([t in ck._tags for t in tags])]
     if not_tags:
-        checks = filter(lambda x: not any([t in x._tags for t in not_tags]),
-                        checks)
-    for ck in checks:
-        thread = threading.Thread(target=ck, args=(config,))
-        threads.append(thread)
-        thread.start()
-    for thread in threads:
-        thread.join()
+        checks = [ck for ck in checks
+                  if not any([t in ck._tags for t in not_tags])]
+    with exe_caching() as cache:
+        host_facts.reset()
+        probes.reset()
+        resolver.reset()
+        connecting = None
+        if hasattr(config, "reset"):
+            config.reset()
+        if hasattr(config, "connect") and any(ck._cluster for ck in checks):
+            # Connect to the cluster while facts are gathered
+            connecting = threading.Thread(target=_connect, args=(config,),
+                                          name="ddct-connect")
+            connecting.daemon = True
+            connecting.start()
+        host_facts.gather([f for ck in checks for f in ck._facts])
+        if connecting is not None:
+            connecting.join()
+        CheckScheduler(jobs=jobs, timeout=timeout).run(checks, config)
+    vprint("Command cache: {}".format(cache.stats()))
+    vprint("API cache: {}".format(api_cache.stats()))
 
 
 def print_tags(config, plugins=None):
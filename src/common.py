@@ -3,15 +3,20 @@ from __future__ import (print_function, unicode_literals, division,
 
 import functools
 import glob
+import hashlib
 import importlib
 import inspect
 import io
 import json
 import os
+import errno
 import re
+import signal
 import subprocess
 import socket
 import textwrap
+import threading
+import time
 try:
     from StringIO import StringIO
 except ImportError:
@@ -22,13 +27,11 @@ from contextlib import contextmanager
 try:
     from dfs_sdk import scaffold, ApiError
     import distro
-    import ipaddress
     import paramiko
     import requests
     from tabulate import tabulate
 except ImportError:
     distro = None
-    ipaddress = None
     tabulate = None
     paramiko = None
     scaffold = None
@@ -48,6 +51,12 @@ UUID4_STR_RE = re.compile(r"[a-f0-9]{8}-?[a-f0-9]{4}-?4[a-f0-9]{3}-?[89ab]"
 INVISIBLE = re.compile(r"\x1b\[\d+[;\d]*m|\x1b\[\d*\;\d*\;\d*m")
 TMP_DIR = '/tmp/.ddct/'
 FIXES_FILE = os.path.join(TMP_DIR, 'fixes_run')
+TAG_CACHE_DIR = os.path.join(TMP_DIR, 'tags')
+# Seconds cached release tags are used before revalidating with GitHub
+TAG_CACHE_TTL = 6 * 60 * 60
+TAG_REQUEST_TIMEOUT = 10
+RELEASE_MANIFEST_ENV = "DDCT_RELEASE_MANIFEST"
+GITHUB_REPO_RE = re.compile(r"/repos/(?P<repo>[^/]+/[^/]+)/tags")
 
 UBUNTU = "ubuntu"
 DEBIAN = "debian"
@@ -64,23 +73,175 @@ ZYP = "zypper"
 SUPPORTED_OS_TYPES = {UBUNTU, DEBIAN, CENTOS7, CENTOS6, RHEL, SLES}
 
 
-def get_config():
-    api = scaffold.get_api(strict=False)
-    config = scaffold.get_config()
-    config['api'] = api
+class LazyConfig(dict):
+    """
+    UDC config dict that only connects to the cluster the first time one of
+    the CLUSTER_KEYS (api, vip1_ip, vip2_ip) is read, so checks and commands
+    that never talk to the cluster don't wait on it.
+
+    A failed connection is remembered and re-raised to every later reader
+    until reset() is called at the start of the next run, so checks don't
+    each wait out the connect timeout against an unreachable cluster
+    """
+
+    CLUSTER_KEYS = ("api", "vip1_ip", "vip2_ip")
+
+    def __init__(self, config, connect):
+        super(LazyConfig, self).__init__(config)
+        self._connect = connect
+        self._lock = threading.Lock()
+        self._error = None
+        self.connected = False
+
+    @property
+    def error(self):
+        """The remembered connection failure, None if there wasn't one"""
+        return self._error
+
+    def reset(self):
+        """Forgets a failed connection so the next read retries it"""
+        with self._lock:
+            self._error = None
+
+    def connect(self):
+        with self._lock:
+            if self.connected:
+                return
+            if self._error is not None:
+                raise self._error
+            try:
+                self.update(self._connect())
+            except Exception as e:
+                self._error = e
+                raise
+            self.connected = True
+
+    def __getitem__(self, key):
+        if key in self.CLUSTER_KEYS:
+            self.connect()
+        return super(LazyConfig, self).__getitem__(key)
+
+    def __contains__(self, key):
+        if key in self.CLUSTER_KEYS:
+            self.connect()
+        return super(LazyConfig, self).__contains__(key)
+
+    def get(self, key, default=None):
+        if key in self.CLUSTER_KEYS:
+            self.connect()
+        return super(LazyConfig, self).get(key, default)
+
+
+def _connect_cluster():
+    api = CachingApi(scaffold.get_api(strict=False))
     access_paths = api.system.network.access_vip.get()['network_paths']
-    config['vip1_ip'] = access_paths[0]['ip']
+    result = {'api': api, 'vip1_ip': access_paths[0]['ip']}
     if len(access_paths) > 1:
-        config['vip2_ip'] = access_paths[1]['ip']
-    return config
+        result['vip2_ip'] = access_paths[1]['ip']
+    return result
+
+
+def get_config():
+    return LazyConfig(scaffold.get_config(), _connect_cluster)
+
+
+def _read_release_manifest(tag_url):
+    # {"Datera/cinder-driver": ["v2019.6.4.1", ...],
+    #  "Datera/glance-driver": "v2019.2.14.0"}
+    match = GITHUB_REPO_RE.search(tag_url)
+    repo = match.group("repo") if match else tag_url
+    with io.open(RELEASE_MANIFEST, 'r') as f:
+        try:
+            manifest = json.loads(f.read())
+        except ValueError as e:
+            raise EnvironmentError("Release manifest {} is not valid JSON: "
+                                   "{}".format(RELEASE_MANIFEST, e))
+    if not isinstance(manifest, dict):
+        raise EnvironmentError("Release manifest {} must be a JSON object"
+                               "".format(RELEASE_MANIFEST))
+    tags = manifest.get(repo, manifest.get(tag_url))
+    if tags is None:
+        raise EnvironmentError("No releases for {} in release manifest {}"
+                               "".format(repo, RELEASE_MANIFEST))
+    if not isinstance(tags, list):
+        tags = [tags]
+    return tags
+
+
+def _write_tag_cache(path, entry):
+    try:
+        os.makedirs(TAG_CACHE_DIR)
+    except OSError as e:
+        if e.errno != errno.EEXIST:
+            raise
+    tmp = "{}.{}".format(path, os.getpid())
+    with io.open(tmp, 'w') as f:
+        f.write(str(json.dumps(entry)))
+    os.rename(tmp, path)
+
+
+def fetch_release_tags(tag_url):
+    """
+    Returns the release tag names for a GitHub tags url.
+
+    When a release manifest is set (--release-manifest or
+    DDCT_RELEASE_MANIFEST) tags are only read from it.  Otherwise tags are
+    cached under TMP_DIR for TAG_CACHE_TTL seconds, then revalidated with
+    If-None-Match so an unchanged tag list doesn't count against GitHub's
+    rate limit.  If GitHub can't be reached the stale cache is used
+    """
+    if RELEASE_MANIFEST:
+        return _read_release_manifest(tag_url)
+    path = os.path.join(TAG_CACHE_DIR, hashlib.sha1(
+        tag_url.encode("utf-8")).hexdigest() + ".json")
+    entry = None
+    try:
+        with io.open(path, 'r') as f:
+            entry = json.loads(f.read())
+    except (IOError, OSError, ValueError):
+        pass
+    if not isinstance(entry, dict) or not isinstance(
+            entry.get("fetched"), (int, float)) or not isinstance(
+                entry.get("tags"), list):
+        entry = None
+    if entry and time.time() - entry["fetched"] < TAG_CACHE_TTL:
+        return entry["tags"]
+    headers = {}
+    if entry and entry.get("etag"):
+        headers["If-None-Match"] = entry["etag"]
+    try:
+        resp = requests.get(tag_url, headers=headers,
+                            timeout=TAG_REQUEST_TIMEOUT)
+        if resp.status_code == 304 and entry:
+            entry["fetched"] = time.time()
+        else:
+            resp.raise_for_status()
+            entry = {"url": tag_url,
+                     "etag": resp.headers.get("ETag"),
+                     "fetched": time.time(),
+                     "tags": [tag['name'] for tag in resp.json()]}
+    except (requests.RequestException, ValueError) as e:
+        if not entry:
+            raise EnvironmentError("Could not fetch release tags from {}: {}"
+                                   "".format(tag_url, e))
+        vprint("Could not refresh release tags from {}, using cached tags: "
+               "{}".format(tag_url, e))
+        return entry["tags"]
+    try:
+        _write_tag_cache(path, entry)
+    except (IOError, OSError) as e:
+        vprint("Could not cache release tags: {}".format(e))
+    return entry["tags"]
 
 
 def get_latest_driver_version(tag_url):
     found = []
     weighted_found = []
-    tags = requests.get(tag_url).json()
+    tags = fetch_release_tags(tag_url)
     for tag in tags:
-        tag = tag['name'].strip("v")
+        if not hasattr(tag, "strip"):
+            continue
+        tag = tag.strip("v")
         if TAG_RE.match(tag):
             found.append(tag)
     for f in found:
@@ -91,9 +252,18 @@ def get_latest_driver_version(tag_url):
             value = int(M) * 10000 + int(m) * 100 + int(p)
         except ValueError:
             # Date format: YYYY.M.d.n
-            Y, M, d, n = f.split(".")
-            value = int(Y) * 1000000 + int(M) * 10000 + int(d) * 100 + int(n)
+            try:
+                Y, M, d, n = f.split(".")
+                value = (int(Y) * 1000000 + int(M) * 10000 + int(d) * 100 +
+                         int(n))
+            except ValueError:
+                vprint("Skipping release tag in unknown format: v{}".format(
+                    f))
+                continue
         weighted_found.append((value, "v" + f))
+    if not weighted_found:
+        raise EnvironmentError("No release tags in a known version format "
+                               "found for {}".format(tag_url))
     return sorted(weighted_found)[-1][1]
 
 
@@ -120,11 +290,14 @@ PLUGIN_LOC = os.path.join(os.path.dirname(__file__), "plugins")
 VERBOSE = False
 WARNINGS = True
 WRAPTXT = True
+# Pinned release manifest used instead of GitHub, see fetch_release_tags
+RELEASE_MANIFEST = os.environ.get(RELEASE_MANIFEST_ENV)
 
 
 SUCCESS = apply_color("Success", color="green")
 FAILURE = apply_color("FAIL", color="red")
 WARNING = apply_color("WARN", color="yellow")
+TIMEOUT = apply_color("TIMEOUT", color="magenta")
 # FIX = apply_color("FIX {}", color="cyan")
 FIX = "FIX {}"
 # ISSUE = apply_color("ISSUE {}", color="magenta")
@@ -140,8 +313,10 @@ FIX_GLOB = "fix_*.py"
 INSTALL_RE = re.compile(r".*install_(.*)\.py")
 INSTALL_GLOB = "install_*.py"
 
-IP_ROUTE_RE = re.compile(
-    r"^(?P<net>[\w|\.|:|/]+).*dev\s(?P<iface>[\w|\.|:]+).*?$")
+DEFAULT_PRIORITY = 50
+HIGH_PRIORITY = 10
+# Seconds a check is allowed to run before it is cancelled
+DEFAULT_CHECK_TIMEOUT = 120
 
 
 def _wraptxt(txt, fill):
@@ -162,8 +337,10 @@ class Report(object):
         self.failure = {}
         self.failure_id = {}
         self.failure_by_id = {}
+        self.timeout = {}
         self.tags = {}
         self.host_state = {}
+        self.probes = []
 
     @staticmethod
     def format_fix(fix, uid):
@@ -175,7 +352,8 @@ class Report(object):
         return "{}: {}".format(ISSUE, issue).format(uid)
 
     def add_success(self, name, tags):
-        if name not in self.failure and name not in self.warning:
+        if (name not in self.failure and name not in self.warning and
+                name not in self.timeout):
             self.success.append(name)
             if name not in tags:
                 self.tags[name] = set()
@@ -213,6 +391,16 @@ class Report(object):
         for tag in tags:
             self.tags[name].add(tag)
 
+    def add_timeout(self, name, timeout, tags):
+        self.timeout[name] = "Check did not complete within {}s".format(
+            timeout)
+        if name in self.success:
+            self.success.remove(name)
+        if name not in self.tags:
+            self.tags[name] = set()
+        for tag in tags:
+            self.tags[name].add(tag)
+
     def add_host_state(self, key, value):
         if not self.hostname:
             self.hostname = socket.gethostname()
@@ -220,6 +408,9 @@ class Report(object):
             self.host_state = self.hostname
         self.host_state[key] = value
 
+    def add_probe(self, stats):
+        self.probes.append(stats)
+
     def generate(self):
         if not self.hostname:
             self.hostname = socket.gethostname()
@@ -269,8 +460,15 @@ class Report(object):
                       "\n".join(failures),
                       "\n".join(sorted(self.tags[name]))])
 
+        t = []
+        for name, reason in sorted(self.timeout.items()):
+            t.append([name,
+                      TIMEOUT,
+                      _wraptxt(reason, wrap),
+                      "\n".join(sorted(self.tags[name]))])
+
         r1 = tabulate(
-            f + w + s,
+            t + f + w + s,
             headers=["Test", "Status", "Reasons", "Tags"],
             tablefmt="grid")
 
@@ -297,6 +495,17 @@ class Report(object):
             result = "\n".join(("HOST: {}".format(self.hostname), r1, r2))
         else:
             result = r1
+        if self.probes:
+            r3 = tabulate(
+                [(p["ip"], p["size"], "{}/{}".format(p["received"], p["sent"]),
+                  "{}%".format(p["loss"]), p["min"], p["avg"], p["p99"],
+                  p["jitter"])
+                 for p in sorted(self.probes,
+                                 key=lambda p: (p["ip"], p["size"]))],
+                headers=["Probe", "Size", "Replies", "Loss", "Min (ms)",
+                         "Avg (ms)", "P99 (ms)", "Jitter (ms)"],
+                tablefmt="grid")
+            result = "\n".join((result, r3))
         return result
 
     def gen_json(self):
@@ -306,6 +515,8 @@ class Report(object):
                 "success": self.success,
                 "warnings": self.warning_by_id,
                 "failures": self.failure_by_id,
+                "timeouts": self.timeout,
+                "probes": self.probes,
                 "tags": {k: list(v) for k, v in self.tags.items()},
                 "host_state": self.host_state}
 
@@ -350,13 +561,147 @@ def save_run_fixes():
         f.write(j)
 
 
-def check(test_name, *tags):
+class CheckTimeout(Exception):
+    pass
+
+
+class CheckExecution(object):
+    """
+    Tracks the child processes started by a single run of a check so the
+    check can be cancelled if it runs past its deadline
+    """
+
+    def __init__(self, timeout=None):
+        self.timeout = timeout
+        self.deadline = None
+        if timeout is not None:
+            self.deadline = time.time() + timeout
+        self.cancelled = False
+        self.procs = set()
+        self.lock = threading.Lock()
+
+    def register(self, proc):
+        with self.lock:
+            if not self.cancelled:
+                self.procs.add(proc)
+                return
+        _kill(proc)
+        raise CheckTimeout("Check was cancelled")
+
+    def remaining(self):
+        """Seconds left until the deadline, None if there is no timeout"""
+        if self.deadline is None:
+            return None
+        return max(0, self.deadline - time.time())
+
+    def unregister(self, proc):
+        with self.lock:
+            self.procs.discard(proc)
+
+    def cancel(self):
+        with self.lock:
+            self.cancelled = True
+            procs, self.procs = self.procs, set()
+        for proc in procs:
+            _kill(proc)
+
+
+def _kill(proc):
+    # Child processes are started in their own process group so shell
+    # pipelines are killed along with the shell itself
+    try:
+        os.killpg(proc.pid, signal.SIGKILL)
+    except OSError:
+        pass
+
+
+class CheckContext(object):
+    """
+    The name, tags and execution of the check running on the current thread.
+    Set up by the @check decorator and read by sf/ff/wf
+    """
+
+    def __init__(self, name, tags, execution=None):
+        self.name = name
+        self.tags = tags
+        self.execution = execution
+
+    @property
+    def cancelled(self):
+        return self.execution is not None and self.execution.cancelled
+
+
+_local = threading.local()
+
+
+def current_context():
+    return getattr(_local, "context", None)
+
+
+@contextmanager
+def check_context(ctx):
+    old = current_context()
+    _local.context = ctx
+    try:
+        yield ctx
+    finally:
+        _local.context = old
+
+
+def current_execution():
+    ctx = current_context()
+    if ctx is not None:
+        return ctx.execution
+    return getattr(_local, "execution", None)
+
+
+def set_execution(execution):
+    _local.execution = execution
+
+
+def in_check_context(func):
+    """
+    Wraps func so it runs under the calling thread's check context.  Use
+    this when a check hands work off to a helper thread that calls
+    ff/wf or exe
+
+    Usage:
+        threading.Thread(target=in_check_context(my_helper)).start()
+    """
+    ctx = current_context()
+
+    @functools.wraps(func)
+    def _wrapper(*args, **kwargs):
+        with check_context(ctx):
+            return func(*args, **kwargs)
+    return _wrapper
+
+
+def check(test_name, *tags, **kwargs):
     """
     Decorator to be used for checks that automatically calls sf() at the
     end of the check.
 
-    NOTE: This should always be the outermost decorator due to
-          non-kosher behavior that *should* make our lives easier
+    Accepts an optional "priority" keyword argument.  Checks with a lower
+    priority value are handed to the worker pool first, so long running
+    checks (network probes, etc) should use HIGH_PRIORITY to keep them from
+    being scheduled last.
+
+    Accepts an optional "timeout" keyword argument, the number of seconds
+    the check may run before it is cancelled and reported as TIMEOUT.
+    Defaults to DEFAULT_CHECK_TIMEOUT and can be overridden for every check
+    with '--check-timeout'.
+
+    Accepts an optional "facts" keyword argument, a tuple of fact names from
+    facts.py the check reads.  Declared facts are gathered concurrently
+    before any check is run.
+
+    Accepts an optional "cluster" keyword argument, True if the check talks
+    to the Datera cluster (config['api'], config['vip1_ip'], etc).  The
+    cluster connection is only set up when a selected check declares it.
+
+    NOTE: This should always be the outermost decorator so the check
+          context is in place for everything the check calls
 
     Usage:
         @check("Test Name")
@@ -372,15 +717,28 @@ def check(test_name, *tags):
                 ff(name, "We Failed!")
             sf(name)
     """
+    priority = kwargs.pop("priority", DEFAULT_PRIORITY)
+    timeout = kwargs.pop("timeout", DEFAULT_CHECK_TIMEOUT)
+    facts = tuple(kwargs.pop("facts", ()))
+    cluster = kwargs.pop("cluster", False)
+    if kwargs:
+        raise TypeError("Unexpected check arguments: {}".format(
+            ", ".join(kwargs)))
+
     def _outer(func):
         @functools.wraps(func)
         def _inner_check_func(*args, **kwargs):
-            tname = test_name  # noqa
-            ttags = tags  # noqa
-            result = func(*args, **kwargs)
-            sf()
+            ctx = CheckContext(test_name, tags, current_execution())
+            with check_context(ctx):
+                result = func(*args, **kwargs)
+                sf()
             return result
+        _inner_check_func._name = test_name
         _inner_check_func._tags = tags
+        _inner_check_func._priority = priority
+        _inner_check_func._timeout = timeout
+        _inner_check_func._facts = facts
+        _inner_check_func._cluster = cluster
         return _inner_check_func
     return _outer
 
@@ -444,9 +802,9 @@ def parse_mconf(data):
 
 
 def get_pkg_manager():
-    if exe_check("which apt-get > /dev/null 2>&1", err=False):
+    if exe_check(["which", "apt-get"], err=False, cache=True):
         return APT
-    if exe_check("which yum > /dev/null 2>&1", err=False):
+    if exe_check(["which", "yum"], err=False, cache=True):
         return YUM
 
 
@@ -461,46 +819,67 @@ def get_os():
     return did
 
 
-def _lookup_vars():
-    name = None
-    for frame in inspect.stack():
-        if frame[3] == "_inner_check_func":
-            name = frame[0].f_locals['test_name']
-            tags = frame[0].f_locals['tags']
-            break
-    if not name:
-        raise ValueError("Couldn't find test_name in frame stack")
-    return name, tags
+def _lookup_context():
+    ctx = current_context()
+    if ctx is None:
+        raise ValueError("No check context found, sf/ff/wf must be called "
+                         "from within a @check decorated function")
+    return ctx
 
 
 # Success Func
 def sf():
-    name, tags = _lookup_vars()
-    report.add_success(name, tags)
+    ctx = _lookup_context()
+    if ctx.cancelled:
+        return
+    report.add_success(ctx.name, ctx.tags)
 
 
 # Fail Func
 def ff(reasons, uid, fix=None):
-    name, tags = _lookup_vars()
+    ctx = _lookup_context()
+    if ctx.cancelled:
+        return
     if type(reasons) not in (list, tuple):
-        report.add_failure(name, reasons, uid, tags, fix=fix)
+        report.add_failure(ctx.name, reasons, uid, ctx.tags, fix=fix)
         return
-    report.add_failure(name, "\n".join(reasons), uid, tags, fix=fix)
+    report.add_failure(ctx.name, "\n".join(reasons), uid, ctx.tags, fix=fix)
 
 
 # Warn Func
 def wf(reasons, uid, fix=None):
-    name, tags = _lookup_vars()
+    ctx = _lookup_context()
+    if ctx.cancelled:
+        return
     if type(reasons) not in (list, tuple):
-        report.add_warning(name, reasons, uid, tags, fix=fix)
+        report.add_warning(ctx.name, reasons, uid, ctx.tags, fix=fix)
         return
-    report.add_warning(name, "\n".join(reasons), uid, tags, fix=fix)
+    report.add_warning(ctx.name, "\n".join(reasons), uid, ctx.tags, fix=fix)
+
+
+# Timeout Func
+def tf(name, tags, timeout):
+    report.add_timeout(name, timeout, tags)
+
+
+# Cluster Connection Failure Func
+def cf(name, tags, error):
+    report.add_failure(
+        name, "Could not connect to the cluster: {}".format(error),
+        "4B7E0D93", tags,
+        fix="Check the credentials and management IP in the CONFIG printed "
+            "at start up and that the cluster is reachable from this host")
 
 
 def hs(k, v):
     report.add_host_state(k, v)
 
 
+# Probe Stats Func
+def ps(stats):
+    report.add_probe(stats)
+
+
 def gen_report(outfile=None, quiet=False, ojson=False, push_data=False):
 
     def _writer(results, out):
@@ -583,14 +962,292 @@ def verbose():
         VERBOSE = old
 
 
-def exe(cmd):
-    vprint("Running cmd:", cmd)
-    return subprocess.check_output(cmd, shell=True).decode("utf-8")
+class ExeCache(object):
+    """
+    Run-scoped cache for commands run through exe().
+
+    While enabled, identical commands that are already running share the
+    running process instead of spawning their own (single-flight) and the
+    result, including a non-zero exit, is reused for the rest of the run.
+    Only idempotent, read-only commands whose output can't change during
+    a run should opt in with exe(cmd, cache=True).
+
+    A caller waiting on another check's command gives up with CheckTimeout
+    once its own check's deadline passes
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.enabled = False
+        self.results = {}
+        self.pending = {}
+        self.hits = 0
+        self.misses = 0
+        self.spawns = 0
+        self.spawn_time = 0.0
+
+    def reset(self, enabled=False):
+        with self.lock:
+            self.enabled = enabled
+            self.results = {}
+            self.hits = 0
+            self.misses = 0
+            self.spawns = 0
+            self.spawn_time = 0.0
+
+    def record_spawn(self, elapsed):
+        with self.lock:
+            self.spawns += 1
+            self.spawn_time += elapsed
+
+    def run(self, cmd, func):
+        while True:
+            with self.lock:
+                if cmd in self.results:
+                    self.hits += 1
+                    out, error = self.results[cmd]
+                    break
+                event = self.pending.get(cmd)
+                leader = event is None
+                if leader:
+                    self.misses += 1
+                    event = self.pending[cmd] = threading.Event()
+            if not leader:
+                execution = current_execution()
+                remaining = execution.remaining() if execution else None
+                if not event.wait(remaining):
+                    raise CheckTimeout("Timed out waiting for {}".format(
+                        cmd))
+                continue
+            out, error = None, None
+            try:
+                out = func(cmd)
+            except subprocess.CalledProcessError as e:
+                error = e
+            finally:
+                with self.lock:
+                    # Cancelled commands are left for the next caller to run
+                    if out is not None or error is not None:
+                        self.results[cmd] = (out, error)
+                    del self.pending[cmd]
+                event.set()
+            break
+        if error is not None:
+            raise error
+        return out
+
+    def stats(self):
+        with self.lock:
+            return {"hits": self.hits,
+                    "misses": self.misses,
+                    "spawns": self.spawns,
+                    "spawn_time": round(self.spawn_time, 3)}
+
+
+exe_cache = ExeCache()
+
+
+@contextmanager
+def exe_caching():
+    exe_cache.reset(enabled=True)
+    try:
+        yield exe_cache
+    finally:
+        exe_cache.enabled = False
+
+
+class ApiCache(object):
+    """
+    Cache for cluster API reads made through a CachingApi.
+
+    Concurrent reads of the same endpoint share one request (single-flight)
+    and the result is reused until expire() is called, or for ttl seconds
+    when a ttl is set so daemon mode can reuse results across iterations.
+    Errors are not cached
+    """
+
+    def __init__(self, ttl=None):
+        self.lock = threading.Lock()
+        self.ttl = ttl
+        self.results = {}
+        self.pending = {}
+        self.hits = 0
+        self.misses = 0
+
+    def expire(self):
+        """Drops every result, or only those older than the ttl if set"""
+        with self.lock:
+            if self.ttl is None:
+                self.results = {}
+            else:
+                now = time.time()
+                self.results = {key: value
+                                for key, value in self.results.items()
+                                if now - value[0] < self.ttl}
+            self.hits = 0
+            self.misses = 0
+
+    def get(self, key, func):
+        while True:
+            with self.lock:
+                cached = self.results.get(key)
+                if cached is not None and (
+                        self.ttl is None or
+                        time.time() - cached[0] < self.ttl):
+                    self.hits += 1
+                    return cached[1]
+                event = self.pending.get(key)
+                leader = event is None
+                if leader:
+                    self.misses += 1
+                    event = self.pending[key] = threading.Event()
+            if not leader:
+                event.wait()
+                continue
+            try:
+                result = func()
+                with self.lock:
+                    self.results[key] = (time.time(), result)
+                return result
+            finally:
+                with self.lock:
+                    del self.pending[key]
+                event.set()
+
+    def stats(self):
+        with self.lock:
+            return {"hits": self.hits,
+                    "misses": self.misses,
+                    "ttl": self.ttl}
+
+
+api_cache = ApiCache()
+
+
+class CachingApi(object):
+    """
+    Wraps a dfs_sdk api object so every endpoint's .get() goes through an
+    ApiCache, keyed by the endpoint's attribute path and the arguments.
+
+        api = CachingApi(scaffold.get_api())
+        api.system.network.get()  # --> cached under ("system", "network")
 
+    Everything other than .get() (create, upload, etc) goes straight to the
+    api.  Reads that must see fresh state can use api.uncached
+    """
 
-def exe_check(cmd, err=False):
+    def __init__(self, target, cache=None, path=()):
+        self._target = target
+        self._cache = cache if cache is not None else api_cache
+        self._path = path
+
+    @property
+    def uncached(self):
+        return self._target
+
+    def __getattr__(self, name):
+        attr = getattr(self._target, name)
+        if name == "get" and callable(attr):
+            return functools.partial(self._get, attr)
+        if inspect.isroutine(attr) or isinstance(
+                attr, (str, bytes, int, float, bool, list, dict, tuple,
+                       type(None))):
+            return attr
+        return CachingApi(attr, self._cache, self._path + (name,))
+
+    def _get(self, func, *args, **kwargs):
+        key = (self._path, args, tuple(sorted(kwargs.items())))
+        return self._cache.get(key, lambda: func(*args, **kwargs))
+
+    def __repr__(self):
+        return "CachingApi({})".format(".".join(self._path) or "api")
+
+
+def _popen(cmd, shell, execution):
+    kwargs = {"stdout": subprocess.PIPE}
+    if not shell:
+        # stderr of argv commands is only shown in verbose mode
+        kwargs["stderr"] = subprocess.PIPE
+    if execution is not None:
+        kwargs["preexec_fn"] = os.setpgrp
     try:
-        vprint(exe(cmd))
+        return subprocess.Popen(cmd, shell=shell, **kwargs)
+    except OSError as e:
+        if e.errno == errno.ENOENT:
+            # Match what the shell reports for a missing binary
+            raise subprocess.CalledProcessError(127, cmd, output=b"")
+        raise
+
+
+def _spawn(cmd):
+    shell = not isinstance(cmd, (list, tuple))
+    vprint("Running cmd:", cmd if shell else " ".join(cmd))
+    execution = current_execution()
+    start = time.time()
+    try:
+        proc = _popen(cmd, shell, execution)
+        if execution is not None:
+            execution.register(proc)
+        try:
+            out, err = proc.communicate()
+        finally:
+            if execution is not None:
+                execution.unregister(proc)
+    finally:
+        exe_cache.record_spawn(time.time() - start)
+    if err:
+        vprint(err.decode("utf-8", "replace"))
+    if execution is not None and execution.cancelled:
+        raise CheckTimeout("Check was cancelled while running: {}".format(
+            cmd))
+    if proc.returncode:
+        raise subprocess.CalledProcessError(proc.returncode, cmd, output=out)
+    return out.decode("utf-8")
+
+
+def exe(cmd, cache=False):
+    """
+    Runs cmd and returns its stdout, raising CalledProcessError on a
+    non-zero exit.
+
+    cmd is either a shell command string or an argv list/tuple.  Prefer
+    argv and filtering the output in Python (see exe_lines, exe_grep and
+    exe_match) over shell pipelines, every pipeline stage is another
+    process.
+
+    Pass cache=True for idempotent, read-only commands to share their
+    result with the rest of the check run (see ExeCache)
+    """
+    if cache and exe_cache.enabled:
+        key = cmd if not isinstance(cmd, list) else tuple(cmd)
+        return exe_cache.run(key, _spawn)
+    return _spawn(cmd)
+
+
+def exe_lines(cmd, cache=False):
+    return exe(cmd, cache=cache).splitlines()
+
+
+def exe_grep(cmd, pattern, cache=False):
+    """Output lines of cmd matching the regex pattern, like 'cmd | grep'"""
+    regex = re.compile(pattern)
+    return [line for line in exe_lines(cmd, cache=cache)
+            if regex.search(line)]
+
+
+def exe_match(cmd, pattern, cache=False):
+    """First regex match of pattern against the output lines of cmd"""
+    regex = re.compile(pattern)
+    for line in exe_lines(cmd, cache=cache):
+        match = regex.match(line)
+        if match:
+            return match
+    return None
+
+
+def exe_check(cmd, err=False, cache=False):
+    try:
+        vprint(exe(cmd, cache=cache))
         if err:
             return False
         return True
@@ -637,17 +1294,3 @@ def cluster_cmd(cmd, config, fail_ok=False):
 def is_l3(config):
     api = config['api']
     return api.system.get()['l3_enabled']
-
-
-def parse_route_table():
-    results = []
-    data = exe("ip route show")
-    for line in data.splitlines():
-        match = IP_ROUTE_RE.match(line)
-        if match:
-            try:
-                net = ipaddress.ip_network(str(match.group("net")))
-            except ValueError:
-                continue
-            results.append((net, match.group("iface")))
-    return results
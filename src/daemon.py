@@ -9,7 +9,7 @@ import time
 from io import StringIO
 
 from checkers import run_checks
-from common import gen_report, reset_checks, strip_invisible
+from common import gen_report, reset_checks, strip_invisible, api_cache
 
 INVISIBLE = 0
 VISIBLE = 1
@@ -90,13 +90,16 @@ def daemon(stdscr, config, args):
     win = WinWrap(curses.newpad(2000, 2000), 1, 1)
     key = 0
     # interval = args.interval
+    api_cache.ttl = args.api_cache_ttl
     while key not in (ord('q'), ord('Q')):
         win.addln("Running Checks...", BLACK)
         win.clrtoeol()
         win.refresh(0, 0, 0, 0, my-1, mx-1)
         reset_checks()
+        api_cache.expire()
         run_checks(config, plugins=args.use_plugins, tags=args.tags,
-                   not_tags=args.not_tags)
+                   not_tags=args.not_tags, jobs=args.jobs,
+                   timeout=args.check_timeout)
         s = StringIO.StringIO()
         gen_report(outfile=s, quiet=args.quiet, ojson=args.json)
 
@@ -124,6 +127,8 @@ def daemon(stdscr, config, args):
                         cp = GREEN
                     elif "WARN" in part:
                         cp = YELLOW
+                    elif "TIMEOUT" in part:
+                        cp = MAGENTA
                     elif "ISSUE" in part:
                         length = 15
                         prefix = part[:length]
@@ -14,10 +14,12 @@ import sys
 
 
 import common
+import k8s_client
 from common import gen_report, read_report, get_config
 from common import check_plugin_table, fix_plugin_table, install_plugin_table
 from checkers import run_checks, print_tags
 from daemon import daemon
+from scheduler import DEFAULT_JOBS
 from fixers import run_fixes, print_fixes
 from installers import run_installers
 
@@ -79,6 +81,28 @@ This only needs to be done once.
 WCS = ".wcs"
 
 
+def positive_int(value):
+    try:
+        result = int(value)
+    except ValueError:
+        result = 0
+    if result < 1:
+        raise argparse.ArgumentTypeError(
+            "must be a positive integer, got {}".format(value))
+    return result
+
+
+def positive_float(value):
+    try:
+        result = float(value)
+    except ValueError:
+        result = 0
+    if not result > 0:
+        raise argparse.ArgumentTypeError(
+            "must be a positive number, got {}".format(value))
+    return result
+
+
 def version(args):
     if args.history:
         print(VERSION_HISTORY)
@@ -102,6 +126,9 @@ def checker(args):
     common.VERBOSE = args.verbose
     common.WARNINGS = not args.disable_warnings
     common.WRAPTXT = not args.no_wrap
+    if args.release_manifest:
+        common.RELEASE_MANIFEST = args.release_manifest
+    k8s_client.ENABLED = not args.no_k8s_api
 
     if args.list_plugins:
         check_plugin_table()
@@ -128,7 +155,8 @@ def checker(args):
         curses.wrapper(daemon, config, args)
     else:
         run_checks(config, plugins=args.use_plugins, tags=args.tags,
-                   not_tags=args.not_tags)
+                   not_tags=args.not_tags, jobs=args.jobs,
+                   timeout=args.check_timeout)
         if args.host_state:
             get_host_state(config)
         gen_report(outfile=args.out,
@@ -254,11 +282,34 @@ if __name__ == "__main__":
     check_parser.add_argument("-i", "--interval", type=float, default=60 * 5,
                               help="Interval in seconds that checks should "
                                    "be run in daemon mode.")
+    check_parser.add_argument("--api-cache-ttl", type=float, default=None,
+                              help="Seconds cluster API reads are reused "
+                                   "across daemon mode iterations.  By "
+                                   "default they are re-read every run")
     check_parser.add_argument("-p", "--push-data", action="store_true",
                               help="Push report data to cluster for inclusion "
                                    "in callhome")
     check_parser.add_argument("-k", "--host-state", action="store_true",
                               help="Enable host-state output during check")
+    check_parser.add_argument("--jobs", type=positive_int,
+                              default=DEFAULT_JOBS,
+                              help="Maximum number of checks to run "
+                                   "concurrently")
+    check_parser.add_argument("--check-timeout", type=positive_float,
+                              default=None,
+                              help="Seconds each check may run before it is "
+                                   "cancelled and reported as TIMEOUT.  "
+                                   "Overrides the timeout set by each check")
+    check_parser.add_argument("--release-manifest",
+                              help="JSON file mapping driver repos (eg. "
+                                   "'Datera/cinder-driver') to their "
+                                   "release tags.  Used instead of GitHub "
+                                   "for driver version checks, can also be "
+                                   "set with DDCT_RELEASE_MANIFEST")
+    check_parser.add_argument("--no-k8s-api", action="store_true",
+                              help="Always use kubectl for kubernetes "
+                                   "checks instead of querying the "
+                                   "kubernetes API directly")
     check_parser.add_argument("--csi-yaml",
                               help="CSI yaml file to use with k8s_csi plugin"
                                    " checks")
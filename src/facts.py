@@ -0,0 +1,212 @@
+from __future__ import (print_function, unicode_literals, division,
+                        absolute_import)
+
+import os
+import threading
+import time
+
+from common import vprint, get_os
+from common import CheckExecution, CheckTimeout, set_execution
+from common import APT, YUM
+from k8s import KubeSnapshot
+from k8s_client import get_client
+from neigh import NeighborWatcher
+from netinv import NetworkInventory
+from procs import ProcessIndex
+from routes import RouteIndex
+from sysctl import read_sysctl
+from systemd import query_units
+
+# Fact names, checks declare the facts they read via
+# @check(..., facts=(SYSCTL, PROCESSES))
+SYSCTL = "sysctl"
+PROCESSES = "processes"
+ROUTES = "routes"
+NEIGHBORS = "neighbors"
+UNITS = "units"
+DISTRO = "distro"
+PKG_MANAGER = "pkg_manager"
+BINARIES = "binaries"
+NETWORK = "network"
+K8S = "k8s"
+
+# Seconds allowed for gathering all facts at the start of a run
+FACT_TIMEOUT = 30
+
+# Units whose state is collected up front for the UNITS fact, anything else
+# is queried on first lookup
+SERVICES = ("irqbalance", "multipathd", "iscsid", "kubelet")
+
+# Binaries resolved up front for the BINARIES fact, anything else is
+# resolved on first lookup
+KNOWN_BINARIES = ("iscsiadm", "multipath", "systemctl", "cpupower",
+                  "kubectl", "apt-get", "yum", "mkfs", "fio", "docker")
+
+
+def _find_binary(name):
+    for path in os.environ.get("PATH", os.defpath).split(os.pathsep):
+        full = os.path.join(path, name)
+        if os.path.isfile(full) and os.access(full, os.X_OK):
+            return full
+    return None
+
+
+def _collect_binaries():
+    return {name: _find_binary(name) for name in KNOWN_BINARIES}
+
+
+def _collect_units():
+    return query_units(SERVICES, systemctl=bool(which("systemctl")))
+
+
+def _collect_k8s():
+    # Not every host checked is a kubernetes node
+    kubectl = bool(which("kubectl"))
+    if not kubectl and get_client() is None:
+        return None
+    return KubeSnapshot.scan(kubectl=kubectl)
+
+
+def _collect_pkg_manager():
+    if which("apt-get"):
+        return APT
+    if which("yum"):
+        return YUM
+
+
+COLLECTORS = {SYSCTL: read_sysctl,
+              PROCESSES: ProcessIndex.scan,
+              ROUTES: RouteIndex.scan,
+              NEIGHBORS: NeighborWatcher,
+              UNITS: _collect_units,
+              DISTRO: get_os,
+              PKG_MANAGER: _collect_pkg_manager,
+              BINARIES: _collect_binaries,
+              NETWORK: NetworkInventory.scan,
+              K8S: _collect_k8s}
+
+
+class HostFacts(object):
+    """
+    Run-scoped store of host facts.
+
+    Each fact is collected at most once per run, no matter how many checks
+    ask for it at the same time.  The first caller collects the fact and
+    every other caller waits for its result.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._facts = {}
+        self._pending = {}
+        self._binaries = {}
+        self._units = {}
+
+    def reset(self):
+        with self._lock:
+            self._facts = {}
+            self._binaries = {}
+            self._units = {}
+
+    def get(self, name):
+        while True:
+            with self._lock:
+                if name in self._facts:
+                    value, error = self._facts[name]
+                    break
+                event = self._pending.get(name)
+                leader = event is None
+                if leader:
+                    event = self._pending[name] = threading.Event()
+            if not leader:
+                event.wait()
+                continue
+            value, error = None, None
+            try:
+                value = COLLECTORS[name]()
+            except Exception as e:
+                error = e
+            with self._lock:
+                # Cancelled collections are retried by the next caller
+                if not isinstance(error, CheckTimeout):
+                    self._facts[name] = (value, error)
+                del self._pending[name]
+            event.set()
+            break
+        if error is not None:
+            raise error
+        return value
+
+    def gather(self, names, timeout=FACT_TIMEOUT):
+        """
+        Collects all the named facts concurrently.  Collection that is still
+        running once the timeout expires is cancelled and will be retried by
+        the first check that reads the fact
+        """
+        start = time.time()
+        running = []
+        for name in set(names):
+            execution = CheckExecution(timeout=timeout)
+            thread = threading.Thread(target=self._gather_one,
+                                      args=(name, execution),
+                                      name="ddct-fact-{}".format(name))
+            thread.daemon = True
+            thread.start()
+            running.append((name, thread, execution))
+        for name, thread, execution in running:
+            thread.join(max(0, start + timeout - time.time()))
+            if thread.is_alive():
+                vprint("Gathering fact {} timed out, cancelling".format(name))
+                execution.cancel()
+        vprint("Gathered facts {} in {}s".format(
+            ", ".join(sorted(set(names))), round(time.time() - start, 2)))
+
+    def _gather_one(self, name, execution):
+        set_execution(execution)
+        try:
+            self.get(name)
+        except Exception as e:
+            vprint("Could not gather fact {}: {}".format(name, e))
+
+    def which(self, binary):
+        binaries = self.get(BINARIES)
+        if binary in binaries:
+            return binaries[binary]
+        with self._lock:
+            if binary in self._binaries:
+                return self._binaries[binary]
+        # Searched outside the lock, get() takes it too
+        path = _find_binary(binary)
+        with self._lock:
+            return self._binaries.setdefault(binary, path)
+
+    def unit(self, name):
+        units = self.get(UNITS)
+        if name in units:
+            return units[name]
+        with self._lock:
+            if name in self._units:
+                return self._units[name]
+        # Queried outside the lock, which() reads the BINARIES fact
+        state = query_units([name], systemctl=bool(self.which("systemctl")))
+        with self._lock:
+            return self._units.setdefault(name, state[name])
+
+
+host_facts = HostFacts()
+
+
+def fact(name):
+    return host_facts.get(name)
+
+
+def which(binary):
+    return host_facts.which(binary)
+
+
+def unit(name):
+    return host_facts.unit(name)
+
+
+def service_active(name):
+    return unit(name).active
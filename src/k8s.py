@@ -0,0 +1,171 @@
+from __future__ import (print_function, unicode_literals, division,
+                        absolute_import)
+
+import json
+import re
+import socket
+import subprocess
+
+from common import vprint, exe
+from k8s_client import api_call
+
+# --all-namespaces rather than -A, which needs kubectl 1.14+
+GET_CMD = ["kubectl", "get", "pods,daemonsets,statefulsets",
+           "--all-namespaces", "-o", "json"]
+VERSION_CMD = ["kubectl", "version", "-o", "json"]
+
+POD = "Pod"
+DAEMONSET = "DaemonSet"
+STATEFULSET = "StatefulSet"
+
+RESOURCES = ("pods", "daemonsets", "statefulsets")
+
+# Managed clusters report minor versions like "13+"
+VERSION_NUM_RE = re.compile(r"^(\d+)")
+
+
+def _version(info):
+    if not info:
+        return None
+    try:
+        return tuple(int(VERSION_NUM_RE.match(info[key]).group(1))
+                     for key in ("major", "minor"))
+    except (KeyError, AttributeError, TypeError):
+        return None
+
+
+class Pod(object):
+
+    def __init__(self, item):
+        meta = item.get("metadata", {})
+        status = item.get("status", {})
+        self.name = meta.get("name")
+        self.namespace = meta.get("namespace")
+        self.labels = meta.get("labels") or {}
+        # (kind, name) of the controller that owns the pod
+        self.owner = None
+        for ref in meta.get("ownerReferences") or []:
+            if ref.get("controller"):
+                self.owner = (ref.get("kind"), ref.get("name"))
+        self.node = item.get("spec", {}).get("nodeName")
+        self.phase = status.get("phase")
+        self.ready = any(
+            cond.get("type") == "Ready" and cond.get("status") == "True"
+            for cond in status.get("conditions") or [])
+        self.restarts = sum(cs.get("restartCount", 0)
+                            for cs in status.get("containerStatuses") or [])
+
+    def __repr__(self):
+        return "Pod({}/{}, {}, node={})".format(
+            self.namespace, self.name, self.phase, self.node)
+
+
+class Workload(object):
+    """A DaemonSet or StatefulSet and the readiness counts from its status"""
+
+    def __init__(self, item):
+        meta = item.get("metadata", {})
+        status = item.get("status", {})
+        self.kind = item.get("kind")
+        self.name = meta.get("name")
+        self.namespace = meta.get("namespace")
+        if self.kind == DAEMONSET:
+            self.desired = status.get("desiredNumberScheduled", 0)
+            self.ready = status.get("numberReady", 0)
+            self.misscheduled = status.get("numberMisscheduled", 0)
+        else:
+            self.desired = item.get("spec", {}).get("replicas", 1)
+            self.ready = status.get("readyReplicas", 0)
+            self.misscheduled = 0
+
+    @property
+    def healthy(self):
+        return self.ready >= self.desired and not self.misscheduled
+
+    def __repr__(self):
+        return "{}({}/{}, {}/{} ready)".format(
+            self.kind, self.namespace, self.name, self.ready, self.desired)
+
+
+class KubeSnapshot(object):
+    """
+    Pods, DaemonSets and StatefulSets of every namespace plus the client
+    and server versions, read with one 'kubectl get' and one
+    'kubectl version' so checks don't pay kubectl's start up cost for
+    every lookup.
+
+    The Kubernetes API is queried directly instead when k8s_client can
+    connect, the client version is unknown then
+    """
+
+    def __init__(self, version, items):
+        self.client_version = _version(version.get("clientVersion"))
+        self.server_version = _version(version.get("serverVersion"))
+        self.pods = []
+        self.workloads = {}
+        for item in items:
+            kind = item.get("kind")
+            if kind == POD:
+                self.pods.append(Pod(item))
+            elif kind in (DAEMONSET, STATEFULSET):
+                workload = Workload(item)
+                self.workloads[(kind, workload.namespace,
+                                workload.name)] = workload
+
+    @classmethod
+    def _scan_api(cls, client):
+        items = []
+        for resource in RESOURCES:
+            items.extend(client.list(resource))
+        return cls(client.version(), items)
+
+    @classmethod
+    def scan(cls, kubectl=True):
+        """
+        Reads the cluster state through the API, or kubectl if the API
+        can't be used.  kubectl is False when it isn't installed, then
+        EnvironmentError is raised instead of falling back to it
+        """
+        snap = api_call(cls._scan_api)
+        if snap is not None:
+            return snap
+        if not kubectl:
+            raise EnvironmentError("The kubernetes API could not be queried "
+                                   "and kubectl is not installed")
+        try:
+            version = json.loads(exe(VERSION_CMD, cache=True))
+        except subprocess.CalledProcessError as e:
+            # The client version is still printed when the server can't be
+            # reached
+            vprint("Could not read kubernetes server version: {}".format(e))
+            version = json.loads(e.output.decode("utf-8") or "{}")
+        return cls(version, json.loads(exe(GET_CMD)).get("items", []))
+
+    def workload(self, kind, namespace, name):
+        return self.workloads.get((kind, namespace, name))
+
+    def find_pods(self, namespace=None, prefix=None, owner=None):
+        """
+        Pods in namespace whose name starts with prefix and/or that are
+        owned by owner, a Workload
+        """
+        return [pod for pod in self.pods
+                if (namespace is None or pod.namespace == namespace) and
+                (prefix is None or pod.name.startswith(prefix)) and
+                (owner is None or pod.owner == (owner.kind, owner.name) and
+                 pod.namespace == owner.namespace)]
+
+    def local_node(self):
+        """
+        Name of the node this host is, or None if no pod is scheduled on a
+        node matching the hostname
+        """
+        names = set()
+        for name in (socket.gethostname(), socket.getfqdn()):
+            names.add(name)
+            names.add(name.split(".")[0])
+        for pod in self.pods:
+            if pod.node and (pod.node in names or
+                             pod.node.split(".")[0] in names):
+                return pod.node
+        return None
@@ -0,0 +1,226 @@
+from __future__ import (print_function, unicode_literals, division,
+                        absolute_import)
+
+import atexit
+import base64
+import io
+import os
+import shutil
+import tempfile
+import threading
+
+try:
+    import requests
+    import ruamel.yaml as yaml
+except ImportError:
+    requests = None
+    yaml = None
+
+from common import vprint
+
+# Set to False (--no-k8s-api) to always use kubectl
+ENABLED = True
+
+KUBECONFIG = os.path.join(os.path.expanduser("~"), ".kube", "config")
+SERVICE_ACCOUNT = "/var/run/secrets/kubernetes.io/serviceaccount"
+REQUEST_TIMEOUT = 10
+
+# Resource --> (API path prefix, kind of its items)
+RESOURCES = {"pods": ("/api/v1", "Pod"),
+             "secrets": ("/api/v1", "Secret"),
+             "daemonsets": ("/apis/apps/v1", "DaemonSet"),
+             "statefulsets": ("/apis/apps/v1", "StatefulSet")}
+
+_lock = threading.Lock()
+_client = None
+_loaded = False
+# Private directory holding certificates and keys decoded from kubeconfig
+# *-data fields, removed when the process exits
+_data_dir = None
+
+
+class KubeClient(object):
+    """
+    Minimal Kubernetes API client answering the queries the k8s checks
+    make with kubectl.  One pooled requests.Session is kept for the whole
+    run, so TLS is negotiated once instead of once per kubectl call
+    """
+
+    def __init__(self, server, token=None, cert=None, verify=True,
+                 auth=None):
+        self.server = server.rstrip("/")
+        self.session = requests.Session()
+        self.session.verify = verify
+        self.session.cert = cert
+        self.session.auth = auth
+        if token:
+            self.session.headers["Authorization"] = "Bearer {}".format(token)
+        self.session.headers["Accept"] = "application/json"
+
+    def get(self, path):
+        resp = self.session.get(self.server + path, timeout=REQUEST_TIMEOUT)
+        resp.raise_for_status()
+        return resp.json()
+
+    def version(self):
+        """Server version, same layout as 'kubectl version -o json'"""
+        return {"serverVersion": self.get("/version")}
+
+    def list(self, resource, namespace=None):
+        """
+        Items of resource (pods, daemonsets, etc) in namespace, or every
+        namespace.  Each item has its kind set, like 'kubectl get a,b' does
+        """
+        prefix, kind = RESOURCES[resource]
+        if namespace:
+            path = "{}/namespaces/{}/{}".format(prefix, namespace, resource)
+        else:
+            path = "{}/{}".format(prefix, resource)
+        items = self.get(path).get("items") or []
+        for item in items:
+            item.setdefault("kind", kind)
+        return items
+
+    def secret(self, namespace, name):
+        return self.get("/api/v1/namespaces/{}/secrets/{}".format(
+            namespace, name))
+
+
+def _remove_data_dir():
+    global _data_dir
+    if _data_dir is not None:
+        shutil.rmtree(_data_dir, ignore_errors=True)
+        _data_dir = None
+
+
+def _data_file(data):
+    """
+    Writes base64 *-data from a kubeconfig to a file in a private temp
+    directory that is removed at exit, requests only takes paths
+    """
+    global _data_dir
+    if _data_dir is None:
+        # mkdtemp creates the directory readable by us only
+        _data_dir = tempfile.mkdtemp(prefix="ddct-kube-")
+        atexit.register(_remove_data_dir)
+    fd, path = tempfile.mkstemp(dir=_data_dir)
+    with io.open(fd, 'wb') as f:
+        f.write(base64.b64decode(data))
+    return path
+
+
+def _read(path):
+    with io.open(path, 'r') as f:
+        return f.read().strip()
+
+
+def _named(entries, name):
+    for entry in entries or []:
+        if entry.get("name") == name:
+            return entry
+    raise ValueError("{} not found in kubeconfig".format(name))
+
+
+def _from_kubeconfig(path):
+    with io.open(path, 'r') as f:
+        # safe_load() was removed in ruamel.yaml 0.18
+        conf = yaml.YAML(typ="safe", pure=True).load(f.read())
+    context = _named(conf.get("contexts"), conf.get("current-context"))
+    context = context.get("context") or {}
+    cluster = _named(conf.get("clusters"), context.get("cluster"))["cluster"]
+    user = _named(conf.get("users"), context.get("user")).get("user") or {}
+    if "exec" in user or "auth-provider" in user:
+        # Credential plugins are left to kubectl
+        raise ValueError("kubeconfig user uses a credential plugin")
+
+    verify = True
+    if cluster.get("insecure-skip-tls-verify"):
+        verify = False
+    elif cluster.get("certificate-authority-data"):
+        verify = _data_file(cluster["certificate-authority-data"])
+    elif cluster.get("certificate-authority"):
+        verify = cluster["certificate-authority"]
+
+    cert = None
+    if user.get("client-certificate-data"):
+        cert = (_data_file(user["client-certificate-data"]),
+                _data_file(user["client-key-data"]))
+    elif user.get("client-certificate"):
+        cert = (user["client-certificate"], user["client-key"])
+
+    token = user.get("token")
+    if not token and user.get("tokenFile"):
+        token = _read(user["tokenFile"])
+    auth = None
+    if user.get("username"):
+        auth = (user["username"], user.get("password", ""))
+    return KubeClient(cluster["server"], token=token, cert=cert,
+                      verify=verify, auth=auth)
+
+
+def _in_cluster():
+    host = os.environ.get("KUBERNETES_SERVICE_HOST")
+    port = os.environ.get("KUBERNETES_SERVICE_PORT", "443")
+    if not host or not os.path.isdir(SERVICE_ACCOUNT):
+        return None
+    if ":" in host:
+        host = "[{}]".format(host)
+    return KubeClient("https://{}:{}".format(host, port),
+                      token=_read(os.path.join(SERVICE_ACCOUNT, "token")),
+                      verify=os.path.join(SERVICE_ACCOUNT, "ca.crt"))
+
+
+def load_client():
+    """
+    Builds a KubeClient from the current kubeconfig context ($KUBECONFIG
+    or ~/.kube/config) or the pod's service account.  Returns None if
+    neither can be used
+    """
+    if requests is None or yaml is None:
+        return None
+    paths = [p for p in os.environ.get("KUBECONFIG", "").split(os.pathsep)
+             if p] or [KUBECONFIG]
+    for path in paths:
+        if not os.path.isfile(path):
+            continue
+        try:
+            return _from_kubeconfig(path)
+        except (IOError, OSError, ValueError, KeyError, TypeError,
+                AttributeError, yaml.YAMLError) as e:
+            vprint("Could not use kubeconfig {}: {}".format(path, e))
+            return None
+    try:
+        return _in_cluster()
+    except (IOError, OSError) as e:
+        vprint("Could not use service account: {}".format(e))
+        return None
+
+
+def get_client():
+    """
+    The KubeClient for this process, the kubeconfig is only read once.
+    Returns None when disabled or unavailable, callers use kubectl then
+    """
+    global _client, _loaded
+    if not ENABLED:
+        return None
+    with _lock:
+        if not _loaded:
+            _client = load_client()
+            _loaded = True
+        return _client
+
+
+def api_call(func, *args):
+    """
+    Runs func(client, *args) returning None, instead of raising, if there
+    is no client or the call fails so the caller can fall back to kubectl
+    """
+    client = get_client()
+    if client is None:
+        return None
+    try:
+        return func(client, *args)
+    except (requests.RequestException, ValueError) as e:
+        vprint("Kubernetes API call failed, using kubectl: {}".format(e))
+        return None
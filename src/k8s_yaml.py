@@ -1,40 +1,183 @@
 from __future__ import (print_function, unicode_literals, division,
                         absolute_import)
 
+import base64
+import hashlib
 import io
+import json
+import re
+import subprocess
+import threading
 import ruamel.yaml as yaml
 
 from common import exe
+from k8s_client import KubeClient, api_call
 
+# Secrets are looked up here unless the manifest sets a namespace
+DEFAULT_NAMESPACE = "kube-system"
 
-def _get_from_secret(entry):
-    name = entry['valueFrom']['secretKeyRef']['name']
-    k = entry['valueFrom']['secretKeyRef']['key']
-    value = exe("kubectl get secrets --namespace kube-system {} --template "
-                "{{{{.data.{}}}}} | base64 --decode".format(name, k))
-    return value
+# kind --> name of the Datera container in it
+TARGETS = {"DaemonSet": ("nodes", "dat-csi-plugin-node"),
+           "StatefulSet": ("controller", "dat-csi-plugin-controller")}
 
+KIND_RE = re.compile(r"""^kind:\s*["']?(\w+)""")
+DOC_START_RE = re.compile(r"^---(\s|$)")
+DOC_END_RE = re.compile(r"^\.\.\.\s*$")
+HASH_CHUNK = 1024 * 1024
 
-def _process_entries(entries):
+# sha1 of a manifest --> containers found in it, for daemon mode
+_parsed = {}
+_parsed_lock = threading.Lock()
+
+
+def _secret_refs(containers):
+    """(namespace, secret) --> keys referenced by the containers' env"""
+    refs = {}
+    for namespace, env in containers.values():
+        for entry in env:
+            ref = (entry.get('valueFrom') or {}).get('secretKeyRef')
+            if ref and ref.get('name') and ref.get('key'):
+                refs.setdefault((namespace, ref['name']), set()).add(
+                    ref['key'])
+    return refs
+
+
+def _get_secrets(refs):
+    """
+    Fetches every referenced secret once as JSON and decodes the keys that
+    are referenced.  Returns ((namespace, secret) --> {key: value}, errors),
+    secrets that couldn't be read are left out and described in errors
+    """
+    secrets = {}
+    errors = []
+    for (namespace, name), keys in refs.items():
+        try:
+            data = api_call(KubeClient.secret, namespace, name)
+            if data is None:
+                data = json.loads(exe(["kubectl", "get", "secret", name,
+                                       "--namespace", namespace, "-o",
+                                       "json"]))
+            data = data.get('data') or {}
+            secrets[(namespace, name)] = {
+                key: base64.b64decode(data[key]).decode("utf-8")
+                for key in keys if key in data}
+        except (subprocess.CalledProcessError, EnvironmentError,
+                ValueError, TypeError, AttributeError) as e:
+            errors.append("Could not read secret {} in namespace {}: "
+                          "{}".format(name, namespace, e))
+    return secrets, errors
+
+
+def _process_entries(namespace, entries, secrets):
     d = {}
     for entry in entries:
         if 'valueFrom' in entry:
-            d[entry['name']] = _get_from_secret(entry)
+            # fieldRef, configMapKeyRef etc. can't be resolved from here
+            ref = (entry.get('valueFrom') or {}).get('secretKeyRef') or {}
+            d[entry['name']] = secrets.get(
+                (namespace, ref.get('name')), {}).get(ref.get('key'), "")
         else:
-            d[entry['name']] = entry['value']
+            d[entry['name']] = entry.get('value', "")
     return d
 
 
-def get_k8s_yaml(yaml_file):
-    found = {}
+def _documents(f):
+    """Lazily splits a multi-document YAML stream into lists of lines"""
+    doc = []
+    for line in f:
+        if DOC_START_RE.match(line) or DOC_END_RE.match(line):
+            if doc:
+                yield doc
+            # '--- {...}' puts content on the separator line
+            rest = line[3:].strip() if line.startswith("---") else ""
+            doc = [rest + "\n"] if rest else []
+            continue
+        doc.append(line)
+    if doc:
+        yield doc
+
+
+def _peek_kind(doc):
+    """
+    kind of a block style document from its top level keys, without
+    parsing it.  None for JSON, flow style and other documents it can't
+    tell from a 'kind:' line
+    """
+    for line in doc:
+        match = KIND_RE.match(line)
+        if match:
+            return match.group(1)
+    return None
+
+
+def _safe_load(text):
+    # safe_load() was removed in ruamel.yaml 0.18
+    return yaml.YAML(typ="safe", pure=True).load(text)
+
+
+def _objects(d):
+    """The object in a parsed document, or the items of a kind: List"""
+    if not isinstance(d, dict):
+        return []
+    if d.get('kind') == 'List':
+        return [item for item in d.get('items') or []
+                if isinstance(item, dict)]
+    return [d]
+
+
+def _find_containers(yaml_file):
+    """
+    name --> (namespace, env) of the Datera containers in yaml_file.
+
+    Block style documents whose kind isn't DaemonSet or StatefulSet (CRDs,
+    RBAC, etc) are skipped without being parsed, documents whose kind
+    can't be peeked (JSON, flow style) are parsed.  Reading stops once both
+    containers are found
+    """
+    containers = {}
     with io.open(yaml_file) as f:
-        for d in list(yaml.safe_load_all(f.read())):
-            if d.get('kind') == 'DaemonSet':
-                for cont in d['spec']['template']['spec']['containers']:
-                    if cont.get('name') == 'dat-csi-plugin-node':
-                        found['nodes'] = _process_entries(cont['env'])
-            if d.get('kind') == 'StatefulSet':
+        for doc in _documents(f):
+            kind = _peek_kind(doc)
+            if kind is not None and kind not in TARGETS:
+                continue
+            for d in _objects(_safe_load("".join(doc))):
+                target = TARGETS.get(d.get('kind'))
+                if not target:
+                    continue
+                key, container = target
+                namespace = (d.get('metadata') or {}).get(
+                    'namespace', DEFAULT_NAMESPACE)
                 for cont in d['spec']['template']['spec']['containers']:
-                    if cont.get('name') == 'dat-csi-plugin-controller':
-                        found['controller'] = _process_entries(cont['env'])
-    return found
+                    if cont.get('name') == container:
+                        containers[key] = (namespace, cont.get('env') or [])
+            if len(containers) == len(TARGETS):
+                break
+    return containers
+
+
+def _file_hash(path):
+    digest = hashlib.sha1()
+    with io.open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def get_k8s_yaml(yaml_file):
+    """
+    Returns (containers, errors), the env of the node and controller
+    containers keyed by "nodes"/"controller" and a message for every
+    secret that could not be read
+    """
+    digest = _file_hash(yaml_file)
+    with _parsed_lock:
+        containers = _parsed.get(digest)
+    if containers is None:
+        containers = _find_containers(yaml_file)
+        with _parsed_lock:
+            _parsed[digest] = containers
+    # Secrets are always read fresh, they can change without the manifest
+    secrets, errors = _get_secrets(_secret_refs(containers))
+    found = {name: _process_entries(namespace, env, secrets)
+             for name, (namespace, env) in containers.items()}
+    return found, errors
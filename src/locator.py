@@ -0,0 +1,301 @@
+from __future__ import (print_function, unicode_literals, division,
+                        absolute_import)
+
+import io
+import json
+import os
+import re
+import subprocess
+import threading
+import time
+
+try:
+    from configparser import RawConfigParser, Error as ConfigError
+except ImportError:
+    from ConfigParser import RawConfigParser, Error as ConfigError
+
+from common import vprint, exe, TMP_DIR
+from facts import which
+
+# Python 2/3 compatibility
+try:
+    str = unicode
+except NameError:
+    pass
+
+LOCATIONS_FILE = os.path.join(TMP_DIR, "locations.json")
+PROC_MOUNTS = "/proc/mounts"
+
+# Remote and pseudo filesystems are never walked
+SKIP_FSTYPES = {"nfs", "nfs4", "cifs", "smb3", "smbfs", "ncpfs", "afs",
+                "ceph", "glusterfs", "fuse.glusterfs", "fuse.sshfs",
+                "fuse.s3fs", "lustre", "gpfs", "9p", "davfs", "proc",
+                "sysfs", "devtmpfs", "devpts", "tmpfs", "cgroup", "cgroup2",
+                "securityfs", "debugfs", "tracefs", "pstore", "bpf",
+                "configfs", "fusectl", "mqueue", "hugetlbfs", "autofs",
+                "binfmt_misc", "rpc_pipefs", "nsfs", "selinuxfs", "efivarfs",
+                "squashfs", "overlay"}
+# Container image and runtime stores, only ever hold copies
+SKIP_DIRS = {"/proc", "/sys", "/dev", "/run", "/var/lib/docker",
+             "/var/lib/containers", "/var/lib/containerd", "/var/lib/kubelet",
+             "/var/lib/lxc", "/snap"}
+# Searched first, in this order, before the rest of /
+WALK_ROOTS = ("/usr", "/opt", "/")
+WALK_MAX_DEPTH = 10
+WALK_TIMEOUT = 30
+
+# <name>-<version>[-pyX.Y].dist-info|egg-info, pip and setuptools write these
+# next to the package directory, develop installs next to the source tree
+METADATA_RE = re.compile(
+    r"^(?P<name>[^-]+)-(?P<version>[^-]+)(-py[\d\.]+)?\."
+    r"(?P<kind>dist-info|egg-info)$")
+METADATA_VERSION_RE = re.compile(r"^Version:\s*(\S+)\s*$", re.MULTILINE)
+
+SYS_PATH_CMD = "import sys, json; print(json.dumps(sys.path))"
+DEFAULT_INTERPRETERS = ("python", "python2", "python3")
+
+_lock = threading.Lock()
+
+
+def _skipped_mounts():
+    skipped = set()
+    try:
+        with io.open(PROC_MOUNTS, 'r') as f:
+            for line in f:
+                parts = line.split()
+                if len(parts) < 3:
+                    continue
+                # Spaces etc. in mount points are octal escaped
+                mount = parts[1].replace("\\040", " ")
+                if parts[2] in SKIP_FSTYPES and mount != "/":
+                    skipped.add(mount)
+    except (IOError, OSError):
+        pass
+    return skipped
+
+
+def _interpreter(binary):
+    """Interpreter from the shebang of a python console script"""
+    path = which(binary)
+    if not path:
+        return None
+    try:
+        with io.open(path, 'rb') as f:
+            line = f.readline(256).decode("utf-8", "replace")
+    except (IOError, OSError):
+        return None
+    if not line.startswith("#!"):
+        return None
+    tokens = line[2:].split()
+    if not tokens:
+        return None
+    if os.path.basename(tokens[0]) == "env" and len(tokens) > 1:
+        return which(tokens[1])
+    return tokens[0]
+
+
+def interpreter_paths(binaries):
+    """
+    sys.path of the interpreters running binaries (eg. cinder-volume),
+    followed by the default python interpreters
+    """
+    interpreters = [_interpreter(binary) for binary in binaries]
+    interpreters.extend(which(name) for name in DEFAULT_INTERPRETERS)
+    paths = []
+    seen = set()
+    for interpreter in interpreters:
+        if not interpreter or interpreter in seen:
+            continue
+        seen.add(interpreter)
+        try:
+            found = json.loads(exe([interpreter, "-c", SYS_PATH_CMD],
+                                   cache=True))
+        except (subprocess.CalledProcessError, ValueError) as e:
+            vprint("Could not read sys.path of {}: {}".format(
+                interpreter, e))
+            continue
+        paths.extend(path for path in found
+                     if path and path not in paths)
+    return paths
+
+
+def walk_for(relative, exclude=(), deadline=None):
+    """
+    Walks the local filesystems for a file ending in relative, returns
+    the full path.  Remote and pseudo filesystems are skipped and the walk
+    is bounded by WALK_MAX_DEPTH and WALK_TIMEOUT
+    """
+    deadline = deadline or time.time() + WALK_TIMEOUT
+    skipped = _skipped_mounts() | SKIP_DIRS
+    name = os.path.basename(relative)
+    suffix = os.sep + relative
+    walked = set()
+    for root in WALK_ROOTS:
+        base_depth = root.rstrip(os.sep).count(os.sep)
+        for dirpath, dirnames, filenames in os.walk(root):
+            if time.time() > deadline:
+                vprint("Gave up searching for {} after {}s".format(
+                    relative, WALK_TIMEOUT))
+                return None
+            if (dirpath.count(os.sep) - base_depth) >= WALK_MAX_DEPTH:
+                dirnames[:] = []
+            else:
+                dirnames[:] = [
+                    d for d in dirnames
+                    if os.path.join(dirpath, d) not in skipped and
+                    os.path.join(dirpath, d) not in walked]
+            if name in filenames:
+                path = os.path.join(dirpath, name)
+                if path.endswith(suffix) and not any(
+                        ex in path for ex in exclude):
+                    return path
+        walked.add(root)
+    return None
+
+
+def _load_locations():
+    try:
+        with io.open(LOCATIONS_FILE, 'r') as f:
+            return json.loads(f.read())
+    except (IOError, OSError, ValueError):
+        return {}
+
+
+def _save_locations(locations):
+    try:
+        if not os.path.isdir(TMP_DIR):
+            os.makedirs(TMP_DIR)
+        tmp = "{}.{}".format(LOCATIONS_FILE, os.getpid())
+        with io.open(tmp, 'w') as f:
+            f.write(str(json.dumps(locations)))
+        os.rename(tmp, LOCATIONS_FILE)
+    except (IOError, OSError) as e:
+        vprint("Could not cache install locations: {}".format(e))
+
+
+def _mtime(path):
+    try:
+        return os.stat(path).st_mtime
+    except OSError:
+        return None
+
+
+def locate_package(package, marker, binaries=(), exclude=()):
+    """
+    Finds the install directory of a python package, eg. "cinder".
+
+    The last location found is cached under TMP_DIR and reused while the
+    directory's mtime is unchanged.  Otherwise the package is looked up in
+    the sys.path of the interpreters behind binaries and the default python
+    interpreters, then by walking the local filesystems for marker, a file
+    path relative to the package directory.  Paths containing any of the
+    exclude strings (eg. driver source checkouts) are ignored.
+
+    Returns the package directory or None
+    """
+    with _lock:
+        cached = _load_locations().get(package)
+    if cached and cached.get("mtime") is not None and (
+            _mtime(cached["path"]) == cached["mtime"]):
+        return cached["path"]
+    found = None
+    for path in interpreter_paths(binaries):
+        candidate = os.path.join(path, package)
+        if os.path.isfile(os.path.join(candidate, "__init__.py")) and not any(
+                ex in candidate for ex in exclude):
+            found = candidate
+            break
+    if not found:
+        vprint("{} not found on any python path, searching for {}".format(
+            package, marker))
+        path = walk_for(os.path.join(package, marker), exclude=exclude)
+        if path:
+            found = path[:-len(os.sep + marker)]
+    if found:
+        with _lock:
+            locations = _load_locations()
+            locations[package] = {"path": found, "mtime": _mtime(found)}
+            _save_locations(locations)
+    return found
+
+
+def _dist_key(name):
+    return name.replace("-", "_").lower()
+
+
+def _version_key(version):
+    return [int(part) if part.isdigit() else -1
+            for part in re.split(r"[.+-]", version)]
+
+
+class Distribution(object):
+    """Installed distribution metadata directory (dist-info or egg-info)"""
+
+    def __init__(self, name, version, path):
+        self.name = name
+        self.version = version
+        self.path = path
+
+    def entry_points(self):
+        """
+        Parses entry_points.txt, returns a dict of
+        group --> {name: "module:attr"}.  Empty if the distribution has no
+        entry points
+        """
+        parser = RawConfigParser()
+        # Entry point names are case sensitive
+        parser.optionxform = str
+        try:
+            with io.open(os.path.join(self.path, "entry_points.txt"),
+                         'r') as f:
+                if hasattr(parser, "read_file"):
+                    parser.read_file(f)
+                else:
+                    parser.readfp(f)
+        except (IOError, OSError, ConfigError) as e:
+            vprint("Could not read entry points of {}: {}".format(
+                self.path, e))
+            return {}
+        return {group: dict((k, v.strip()) for k, v in parser.items(group))
+                for group in parser.sections()}
+
+    def __repr__(self):
+        return "Distribution({}, {}, {})".format(
+            self.name, self.version, self.path)
+
+
+def _read_version(path):
+    for name in ("METADATA", "PKG-INFO"):
+        try:
+            with io.open(os.path.join(path, name), 'r') as f:
+                match = METADATA_VERSION_RE.search(f.read())
+        except (IOError, OSError):
+            continue
+        if match:
+            return match.group(1)
+    return None
+
+
+def find_distributions(package_dir, dist):
+    """
+    Metadata directories for dist installed alongside package_dir, the
+    directory returned by locate_package.  Several versions can be left
+    side by side by upgrades, the newest is returned first
+    """
+    site = os.path.dirname(package_dir.rstrip(os.sep))
+    try:
+        entries = os.listdir(site)
+    except OSError:
+        return []
+    found = []
+    for entry in entries:
+        match = METADATA_RE.match(entry)
+        if not match or _dist_key(match.group("name")) != _dist_key(dist):
+            continue
+        path = os.path.join(site, entry)
+        if not os.path.isdir(path):
+            continue
+        version = _read_version(path) or match.group("version")
+        found.append(Distribution(match.group("name"), version, path))
+    found.sort(key=lambda d: _version_key(d.version), reverse=True)
+    return found
@@ -1,16 +1,16 @@
 from __future__ import (print_function, unicode_literals, division,
                         absolute_import)
 
-import re
-import subprocess
+from common import vprint, ff, check, is_l3
+from common import wf, HIGH_PRIORITY
+from facts import fact, ROUTES, NETWORK
+from probe import probe_cluster, pmtu_cluster
 
-from common import vprint, exe, exe_check, ff, check, parse_route_table, is_l3
-from common import wf
+# Bytes of ICMP payload used to check that fragmentation works
+LARGE_PROBE = 32000
 
-import ipaddress
-import socket
-
-MTU_RE = re.compile(r"^.*mtu (\d+) .*$")
+PMTU_FIX = ("Make sure every switch and router port between this host and "
+            "the cluster is configured for the same (jumbo) MTU")
 
 # Python 2/3 compatibility
 try:
@@ -25,16 +25,7 @@ iface_dict = {"MGMT": "mgt1",
 
 
 def get_interface_for_ip(ip):
-    try:
-        ipobj = ipaddress.ip_address(str(ip))
-    except ValueError:
-        ip = socket.gethostbyname(ip)
-        ipobj = ipaddress.ip_address(str(ip))
-    rt = parse_route_table()
-    for net, iface in rt:
-        if ipobj in net:
-            return iface
-    None
+    return fact(ROUTES).interface(ip)
 
 
 def check_mtu_normal(name, ip, config):
@@ -44,15 +35,26 @@ def check_mtu_normal(name, ip, config):
     if not sif:
         return ff("Couldn't find interface with network matching ip {}"
                   "".format(ip), "710BFC7E")
-    try:
-        match = MTU_RE.match(exe("ip ad show {} | grep mtu".format(sif)))
-    except subprocess.CalledProcessError:
-        return ff("Couldn't find client {} interface MTU".format(name),
-                  "CBF8CC4C")
-    if not match:
+    inventory = fact(NETWORK)
+    iface = inventory.get(sif)
+    if not iface or not iface.mtu:
         return ff("Couldn't find client {} interface MTU".format(name),
                   "CBF8CC4C")
-    local_mtu = match.groups(1)[0]
+    local_mtu = iface.mtu
+    # A vlan or bond only carries what its physical slaves can
+    for phys in inventory.physical(sif):
+        if phys.name == sif:
+            continue
+        if phys.mtu is None:
+            vprint("Couldn't read the MTU of {}, skipping it".format(
+                phys.name))
+        elif phys.mtu < local_mtu:
+            ff("Physical interface {} under {} has MTU {}, smaller than the "
+               "{} MTU of {}".format(phys.name, sif, phys.mtu, sif,
+                                     local_mtu), "9C41D2E7")
+        if not phys.up:
+            wf("Physical interface {} under {} is down [{}]".format(
+                phys.name, sif, phys.operstate), "E07B36A5")
 
     cluster_mtu = None
     api = config['api']
@@ -71,10 +73,24 @@ def check_mtu_normal(name, ip, config):
     if str(local_mtu) != str(cluster_mtu):
         ff("Local interface {} MTU does not match cluster {} interface MTU "
            "[{} != {}]".format(sif, cname, local_mtu, cluster_mtu), "D7F667BC")
-    # Ping check
-    if not exe_check("ping -s 32000 -c 2 -W 1 {}".format(ip)):
-        ff("Could not ping interface with large (32k) packet size, packet "
-           "fragmentation may not be working correctly", "A4CA0D72")
+    # Path MTU check
+    path = pmtu_cluster(config)[ip]
+    vprint("{} MTU: local {}, cluster {}, path {}".format(
+        name, local_mtu, cluster_mtu, path.mtu))
+    if path.mtu is None:
+        return ff("Could not ping interface [{}] with fragmentation "
+                  "disabled".format(ip), "6A0E93C4", fix=PMTU_FIX)
+    expected = min(int(local_mtu), int(cluster_mtu))
+    if path.mtu < expected:
+        reason = ("Path MTU to {} is {}, smaller than local interface {} MTU "
+                  "{} and cluster {} interface MTU {}.  Packets larger than "
+                  "{} bytes are dropped when fragmentation is disabled"
+                  "".format(ip, path.mtu, sif, local_mtu, cname, cluster_mtu,
+                            path.mtu))
+        if path.hop:
+            reason += ", hop {} reports a next-hop MTU of {}".format(
+                *path.hop)
+        ff(reason, "B25D7E48", fix=PMTU_FIX)
 
 
 def check_mtu_l3(ip, config):
@@ -88,42 +104,45 @@ def check_mtu_l3(ip, config):
         return ff("Couldn't find interface with network matching ip {}"
                   "".format(ip), "710BFC7E")
     # Ping check
-    if not exe_check("ping -s 32000 -c 2 -W 1 {}".format(ip)):
-        if not exe_check("ping -c 2 -W 1 {}".format(ip)):
+    if not probe_cluster(config, size=LARGE_PROBE)[ip].reachable:
+        if not probe_cluster(config)[ip].reachable:
             return ff("Could not ping interface [{}]".format(ip), "EC2D3621")
         ff("Could not ping interface [{}] with large (32k) packet size, packet"
            "fragmentation may not be working correctly.".format(ip),
            "A4CA0D72")
 
 
-@check("MGMT MTU", "connection", "local")
+@check("MGMT MTU", "connection", "local", priority=HIGH_PRIORITY,
+       facts=(ROUTES, NETWORK), cluster=True)
 def check_mgmt(config):
     vprint("Checking mgmt interface mtu match")
     mgmt = config['mgmt_ip']
-    if is_l3:
+    if is_l3(config):
         check_mtu_l3(mgmt, config)
     else:
         check_mtu_normal("MGMT", mgmt, config)
 
 
-@check("VIP1 MTU", "connection", "local")
+@check("VIP1 MTU", "connection", "local", priority=HIGH_PRIORITY,
+       facts=(ROUTES, NETWORK), cluster=True)
 def check_vip1(config):
     vprint("Checking vip1 interface mtu match")
     vip1 = config['vip1_ip']
-    if is_l3:
+    if is_l3(config):
         check_mtu_l3(vip1, config)
     else:
         check_mtu_normal("VIP1", vip1, config)
 
 
-@check("VIP2 MTU", "connection", "local")
+@check("VIP2 MTU", "connection", "local", priority=HIGH_PRIORITY,
+       facts=(ROUTES, NETWORK), cluster=True)
 def check_vip2(config):
     vprint("Checking vip2 interface mtu match")
     vip2 = config.get('vip2_ip')
     if not vip2:
         wf("No vip2_ip found", "416B534D")
         return
-    if is_l3:
+    if is_l3(config):
         check_mtu_l3(vip2, config)
     else:
         check_mtu_normal("VIP2", vip2, config)
@@ -2,9 +2,11 @@ from __future__ import (print_function, unicode_literals, division,
                         absolute_import)
 import io
 import os
+import threading
 
-from common import vprint, parse_mconf, check, exe_check, ff, wf, get_os
+from common import vprint, parse_mconf, check, ff, wf
 from common import ASSETS, UBUNTU, CENTOS6, CENTOS7, SLES
+from facts import fact, which, service_active, BINARIES, UNITS, DISTRO
 
 
 CENTOS6_CONF = os.path.join(ASSETS, "centos6.mconf")
@@ -16,101 +18,238 @@ CONFS = {CENTOS6: CENTOS6_CONF,
          CENTOS7: CENTOS7_CONF,
          UBUNTU: UBUNTU_CONF,
          SLES: SLES_CONF}
+MULTIPATH_CONF = "/etc/multipath.conf"
 
+MISSING_SECTION = "missing section"
+MISSING_DEVICE = "missing device"
+MISSING = "missing"
+DIFFERS = "differs"
+EXTRA = "extra"
 
-@check("Multipath", "basic", "multipath", "local")
+
+class Difference(object):
+
+    def __init__(self, kind, section, device=None, attr=None, have=None,
+                 want=None):
+        self.kind = kind
+        self.section = section
+        # (vendor, product) of the device block, None for section attributes
+        self.device = device
+        self.attr = attr
+        self.have = have
+        self.want = want
+
+    @property
+    def where(self):
+        if self.device is None:
+            return self.section
+        return "{} device {} {}".format(self.section, *self.device)
+
+    def __str__(self):
+        if self.kind in (MISSING_SECTION, MISSING_DEVICE):
+            return "Missing {}".format(self.where)
+        if self.kind == MISSING:
+            return "{} missing '{}', want \"{}\"".format(
+                self.where, self.attr, self.want)
+        if self.kind == DIFFERS:
+            return "{} '{}' is \"{}\", want \"{}\"".format(
+                self.where, self.attr, self.have, self.want)
+        return "{} has '{}' \"{}\" not in the Datera template".format(
+            self.where, self.attr, self.have)
+
+
+class MultipathConf(object):
+    """
+    multipath.conf indexed by section and, for sections made of device
+    blocks (devices, blacklist, blacklist_exceptions), by (vendor, product).
+
+    Attribute values are compared with quotes stripped and whitespace
+    collapsed, so 'vendor "DATERA"' and 'vendor DATERA' are the same
+    """
+
+    def __init__(self, mconf):
+        # section --> {attr: value}
+        self.sections = {}
+        # section --> {(vendor, product): {attr: value}}
+        self.devices = {}
+        for name, body in mconf:
+            if not isinstance(body, list):
+                # Top level attributes aren't valid, multipathd ignores them
+                continue
+            attrs = self.sections.setdefault(name, {})
+            devices = self.devices.setdefault(name, {})
+            for key, value in body:
+                if isinstance(value, list):
+                    if key != "device":
+                        continue
+                    device = {k: " ".join(v.split()) for k, v in value
+                              if not isinstance(v, list)}
+                    devices[(device.get("vendor"),
+                             device.get("product"))] = device
+                else:
+                    attrs[key] = " ".join(value.split())
+
+    @classmethod
+    def parse(cls, path):
+        with io.open(path, 'r') as f:
+            return cls(parse_mconf(f.read()))
+
+    def has_section(self, section):
+        return section in self.sections
+
+    def device(self, section, vendor, product):
+        return self.devices.get(section, {}).get((vendor, product))
+
+    def find_devices(self, section, vendor=None, product=None):
+        """Devices in section with the given vendor or product"""
+        return [(key, attrs) for key, attrs in
+                sorted(self.devices.get(section, {}).items(), key=str)
+                if (vendor is not None and key[0] == vendor) or (
+                    product is not None and key[1] == product)]
+
+    @staticmethod
+    def _diff_attrs(have, want, section, device=None):
+        diffs = []
+        for attr in sorted(set(have) | set(want)):
+            if attr not in have:
+                diffs.append(Difference(MISSING, section, device, attr,
+                                        want=want[attr]))
+            elif attr not in want:
+                diffs.append(Difference(EXTRA, section, device, attr,
+                                        have=have[attr]))
+            elif have[attr] != want[attr]:
+                diffs.append(Difference(DIFFERS, section, device, attr,
+                                        have=have[attr], want=want[attr]))
+        return diffs
+
+    def diff(self, template):
+        """
+        Every difference between this config and template, a MultipathConf
+        of the recommended settings.  Sections and devices template doesn't
+        mention are left alone (other vendors' arrays, etc)
+        """
+        diffs = []
+        for section in sorted(template.sections):
+            if not self.has_section(section):
+                diffs.append(Difference(MISSING_SECTION, section))
+                continue
+            diffs.extend(self._diff_attrs(
+                self.sections[section], template.sections[section], section))
+            for key, want in sorted(template.devices[section].items(),
+                                    key=str):
+                have = self.device(section, *key)
+                if have is None:
+                    diffs.append(Difference(MISSING_DEVICE, section, key))
+                    continue
+                diffs.extend(self._diff_attrs(have, want, section, key))
+        return diffs
+
+
+class _MconfCache(object):
+    """Parsed multipath.conf files, reused while their mtime is unchanged"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.files = {}
+
+    def load(self, path):
+        mtime = os.stat(path).st_mtime
+        with self.lock:
+            cached = self.files.get(path)
+            if cached is not None and cached[0] == mtime:
+                return cached[1]
+            mconf = MultipathConf.parse(path)
+            self.files[path] = (mtime, mconf)
+            return mconf
+
+
+mconfs = _MconfCache()
+
+
+def load_mconf(path):
+    return mconfs.load(path)
+
+
+@check("Multipath", "basic", "multipath", "local", facts=(BINARIES, UNITS))
 def check_multipath(config):
     vprint("Checking multipath settings")
-    if not exe_check("which multipath", err=False):
+    if not which("multipath"):
         ff("Multipath binary could not be found, is it installed?",
            "2D18685C")
-    if not exe_check("which systemctl"):
-        if not exe_check("service multipathd status | grep 'Active: active'",
-                         err=False):
+    if not service_active("multipathd"):
+        if not which("systemctl"):
             fix = "service multipathd start"
-            ff("multipathd not enabled", "541C10BF", fix=fix)
-    else:
-        if not exe_check("systemctl status multipathd | grep 'Active: active'",
-                         err=False):
+        else:
             fix = "systemctl start multipathd"
-            ff("multipathd not enabled", "541C10BF", fix=fix)
+        ff("multipathd not enabled", "541C10BF", fix=fix)
+
 
+def _report_missing_device(mconf, diff, fix):
+    vendor, product = diff.device
+    if diff.section == "devices":
+        if mconf.find_devices("devices", vendor=vendor):
+            return ff("Datera 'product' entry should be \"{}\"".format(
+                product), "A9DF3F8C", fix=fix)
+        return ff("No DATERA device section found", "99B9D136", fix=fix)
+    if diff.section == "blacklist_exceptions":
+        if mconf.find_devices(diff.section, product=product):
+            return ff("Datera blacklist_exceptions vendor entry malformed",
+                      "9990F32F", fix=fix)
+        if mconf.find_devices(diff.section, vendor=vendor):
+            return ff("Datera blacklist_exceptions product entry malformed",
+                      "642753A0", fix=fix)
+        return ff("No Datera blacklist_exceptions section found",
+                  "09E37E51", fix=fix)
+    ff("{} not found in {}".format(diff.where, MULTIPATH_CONF), "4F7A2C83",
+       fix=fix)
 
-@check("Multipath Conf", "basic", "multipath", "local")
+
+@check("Multipath Conf", "basic", "multipath", "local", facts=(DISTRO,))
 def check_multipath_conf(config):
-    dist = get_os()
+    dist = fact(DISTRO)
     vfile = CONFS.get(dist)
     if not vfile:
         wf("No supported multipath.conf file for: {}".format(dist), "381CE248")
-    mfile = "/etc/multipath.conf"
-    if not os.path.exists(mfile):
+    if not os.path.exists(MULTIPATH_CONF):
         if not vfile:
             fix = "copy a multipath.conf file from the Datera Deployment Guide"
         else:
-            fix = "copy {} to /etc/multipath.conf".format(vfile)
+            fix = "copy {} to {}".format(vfile, MULTIPATH_CONF)
         return ff("/etc/multipath.conf file not found", "1D506D89", fix=fix)
-    with io.open(mfile, 'r') as f:
-        mconf = parse_mconf(f.read())
-
-    # Check defaults section
-    defaults = filter(lambda x: x[0] == 'defaults', mconf)
-    fix = ("check the example multipath.conf file from Datera deployment"
-           "guide")
-    if not defaults:
-        ff("Missing defaults section", "1D8C438C", fix=fix)
-
-    else:
-        defaults = defaults[0]
-        ct = False
-        for d in defaults[1]:
-            if 'checker_timeout' in d:
-                ct = True
-        if not ct:
-            ff("defaults section missing 'checker_timeout'",
-               "70191A9A", fix=fix)
-
-    # Check devices section
-    devices = filter(lambda x: x[0] == 'devices', mconf)
-    if not devices:
-        ff("Missing devices section", "797A6031", fix=fix)
-    else:
-        devices = devices[0][1]
-        dat_block = None
-        for _, device in devices:
-            ddict = {}
-            for entry in device:
-                ddict[entry[0]] = entry[1]
-            if ddict['vendor'] == 'DATERA':
-                dat_block = ddict
-        if not dat_block:
-            return ff("No DATERA device section found", "99B9D136", fix=fix)
-
-        if not dat_block['product'] == "IBLOCK":
-            ff("Datera 'product' entry should be \"IBLOCK\"", "A9DF3F8C",
-               fix=fix)
-
-    # Blacklist exceptions
-    be = filter(lambda x: x[0] == 'blacklist_exceptions', mconf)
-    if not be:
-        ff("Missing blacklist_exceptions section", "B8C8A19C")
-    else:
-        be = be[0][1]
-        dat_block = None
-        for _, device in be:
-            bdict = {}
-            for entry in device:
-                bdict[entry[0]] = entry[1]
-            if bdict['vendor'] == 'DATERA.*':
-                dat_block = bdict
-        if not dat_block:
-            ff("No Datera blacklist_exceptions section found",
-               "09E37E51", fix=fix)
-        if dat_block['vendor'] != 'DATERA.*':
-            ff("Datera blacklist_exceptions vendor entry malformed",
-               "9990F32F", fix=fix)
-        if dat_block['product'] != 'IBLOCK.*':
-            ff("Datera blacklist_exceptions product entry malformed",
-               "642753A0", fix=fix)
+    # Without a template for this distro all we can check is that the
+    # Datera sections and device blocks are there
+    attrs = vfile is not None
+    vfile = vfile or CENTOS7_CONF
+    mconf = load_mconf(MULTIPATH_CONF)
+    template = load_mconf(vfile)
+    fix = ("compare with {} or the example multipath.conf file from the "
+           "Datera deployment guide".format(vfile))
+
+    missing_sections = {"defaults": "1D8C438C",
+                        "devices": "797A6031",
+                        "blacklist_exceptions": "B8C8A19C"}
+    for diff in mconf.diff(template):
+        if diff.kind == MISSING_SECTION:
+            ff("Missing {} section".format(diff.section),
+               missing_sections.get(diff.section, "D6E1905B"), fix=fix)
+        elif diff.kind == MISSING_DEVICE:
+            _report_missing_device(mconf, diff, fix)
+        elif not attrs:
+            continue
+        elif diff.kind == MISSING:
+            if diff.section == "defaults" and diff.attr == "checker_timeout":
+                ff("defaults section missing 'checker_timeout'",
+                   "70191A9A", fix=fix)
+            else:
+                ff(str(diff), "5E2B7C19", fix=fix)
+        elif diff.kind == DIFFERS:
+            wf(str(diff), "C03A8E6D", fix=fix)
+        elif diff.device is not None:
+            # Extra attributes in a Datera device block override the
+            # recommended settings, extra defaults are usually site policy
+            wf(str(diff), "8B41F0E2", fix=fix)
+        else:
+            vprint(str(diff))
 
 
 def load_checks():
@@ -0,0 +1,220 @@
+from __future__ import (print_function, unicode_literals, division,
+                        absolute_import)
+
+import io
+import json
+import socket
+import struct
+import subprocess
+import threading
+import time
+
+from common import vprint, exe
+from routes import resolve
+
+# Python 2/3 compatibility
+try:
+    str = unicode
+except NameError:
+    pass
+
+PROC_ARP = "/proc/net/arp"
+ATF_COM = 0x02
+
+REACHABLE = "REACHABLE"
+
+NETLINK_ROUTE = 0
+RTM_NEWNEIGH = 28
+RTM_GETNEIGH = 30
+NLMSG_ERROR = 2
+NLMSG_DONE = 3
+NLM_F_REQUEST = 0x01
+NLM_F_DUMP = 0x300
+NDA_DST = 1
+NLMSG_HDR = struct.Struct("=IHHII")
+NDMSG = struct.Struct("=BBHiHBB")
+RTATTR = struct.Struct("=HH")
+
+NUD_STATES = ((0x01, "INCOMPLETE"),
+              (0x02, "REACHABLE"),
+              (0x04, "STALE"),
+              (0x08, "DELAY"),
+              (0x10, "PROBE"),
+              (0x20, "FAILED"),
+              (0x40, "NOARP"),
+              (0x80, "PERMANENT"))
+
+# Seconds to wait for every watched neighbor to become reachable
+DEFAULT_TIMEOUT = 5
+POLL_INTERVAL = 0.2
+
+
+def _align(length):
+    return (length + 3) & ~3
+
+
+def _nud_state(state):
+    for bit, name in NUD_STATES:
+        if state & bit:
+            return name
+    return "NONE"
+
+
+def _read_netlink():
+    sock = socket.socket(socket.AF_NETLINK, socket.SOCK_RAW, NETLINK_ROUTE)
+    try:
+        sock.bind((0, 0))
+        sock.send(NLMSG_HDR.pack(NLMSG_HDR.size + NDMSG.size, RTM_GETNEIGH,
+                                 NLM_F_REQUEST | NLM_F_DUMP, 1, 0) +
+                  NDMSG.pack(socket.AF_UNSPEC, 0, 0, 0, 0, 0, 0))
+        result = {}
+        while True:
+            data = sock.recv(65536)
+            offset = 0
+            while offset + NLMSG_HDR.size <= len(data):
+                length, mtype, _, _, _ = NLMSG_HDR.unpack_from(data, offset)
+                if mtype == NLMSG_DONE:
+                    return result
+                if mtype == NLMSG_ERROR:
+                    raise OSError("Netlink neighbor dump failed")
+                if mtype == RTM_NEWNEIGH:
+                    body = offset + NLMSG_HDR.size
+                    family, _, _, _, state, _, _ = NDMSG.unpack_from(
+                        data, body)
+                    attr = body + NDMSG.size
+                    while attr + RTATTR.size <= offset + length:
+                        alen, atype = RTATTR.unpack_from(data, attr)
+                        if alen < RTATTR.size:
+                            break
+                        if atype == NDA_DST:
+                            addr = socket.inet_ntop(
+                                family, data[attr + RTATTR.size:attr + alen])
+                            result[addr] = _nud_state(state)
+                        attr += _align(alen)
+                offset += _align(length)
+    finally:
+        sock.close()
+
+
+def _read_ip_json():
+    result = {}
+    for entry in json.loads(exe(["ip", "-j", "neigh", "show"])):
+        states = entry.get("state") or ["NONE"]
+        result[entry["dst"]] = states[0]
+    return result
+
+
+def _read_proc_arp():
+    # /proc/net/arp has no NUD state and no IPv6 entries, complete entries
+    # are the closest thing to REACHABLE it can report
+    result = {}
+    with io.open(PROC_ARP, 'r') as f:
+        next(f)
+        for line in f:
+            parts = line.split()
+            if len(parts) >= 3:
+                flags = int(parts[2], 16)
+                result[parts[0]] = REACHABLE if flags & ATF_COM else "NONE"
+    return result
+
+
+def read_neighbors():
+    """
+    Returns the IPv4 and IPv6 neighbor tables as a dict of ip --> NUD state
+    (REACHABLE, STALE, etc).  Dumps the table over netlink, falling back to
+    'ip -j neigh show' and then /proc/net/arp
+    """
+    for reader in (_read_netlink, _read_ip_json):
+        try:
+            return reader()
+        except (OSError, ValueError, subprocess.CalledProcessError) as e:
+            vprint("Could not read neighbor table with {}: {}".format(
+                reader.__name__, e))
+    return _read_proc_arp()
+
+
+def normalize(ip):
+    addr = resolve(ip)
+    return str(addr) if addr is not None else None
+
+
+class NeighborWatcher(object):
+    """
+    Watches the neighbor state of every IP that checks are waiting on.
+
+    IPs are registered with watch(), or by waiting on them, and every
+    watched IP shares one deadline started by the first registration.  A
+    single poller thread reads the neighbor table for all waiters until
+    every watched IP is REACHABLE or the deadline passes.  A waiter that
+    arrives once the poller has stopped restarts it for a fresh read, so it
+    never returns a state read before it started waiting
+    """
+
+    def __init__(self, timeout=DEFAULT_TIMEOUT, interval=POLL_INTERVAL):
+        self.timeout = timeout
+        self.interval = interval
+        self.cond = threading.Condition()
+        self.states = read_neighbors()
+        self.watched = set()
+        self.deadline = None
+        # Number of neighbor table reads so far
+        self.reads = 0
+        self.waiting = 0
+        self.poller = None
+
+    def state(self, ip):
+        with self.cond:
+            return self.states.get(normalize(ip))
+
+    def watch(self, ips):
+        """Registers ips, starting the shared deadline if it isn't yet"""
+        ips = [normalize(ip) for ip in ips]
+        with self.cond:
+            self._watch(ips)
+
+    def _watch(self, ips):
+        self.watched.update(ip for ip in ips if ip is not None)
+        if self.deadline is None:
+            self.deadline = time.time() + self.timeout
+        if self.poller is None:
+            self.poller = threading.Thread(target=self._poll,
+                                           name="ddct-neigh")
+            self.poller.daemon = True
+            self.poller.start()
+
+    def _resolved(self):
+        return time.time() >= self.deadline or all(
+            self.states.get(ip) == REACHABLE for ip in self.watched)
+
+    def wait(self, ip):
+        """
+        True once ip is REACHABLE, False if it isn't by the shared deadline
+        """
+        ip = normalize(ip)
+        with self.cond:
+            started = self.reads
+            self.waiting += 1
+            try:
+                self._watch([ip])
+                # States read before we started can predate the caller's
+                # own traffic to ip, wait for a fresh read
+                while self.reads == started or (
+                        self.states.get(ip) != REACHABLE and
+                        time.time() < self.deadline):
+                    self.cond.wait(max(self.deadline - time.time(),
+                                       self.interval))
+                return self.states.get(ip) == REACHABLE
+            finally:
+                self.waiting -= 1
+
+    def _poll(self):
+        while True:
+            states = read_neighbors()
+            with self.cond:
+                self.states = states
+                self.reads += 1
+                self.cond.notify_all()
+                if not self.waiting or self._resolved():
+                    self.poller = None
+                    return
+                self.cond.wait(self.interval)
@@ -0,0 +1,177 @@
+from __future__ import (print_function, unicode_literals, division,
+                        absolute_import)
+
+import io
+import os
+
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+SYS_CLASS_NET = "/sys/class/net"
+# /sys/class/net/<if>/type for loopback devices (ARPHRD_LOOPBACK)
+ARPHRD_LOOPBACK = 772
+
+PHYSICAL = "physical"
+BOND = "bond"
+VLAN = "vlan"
+BRIDGE = "bridge"
+LOOPBACK = "loopback"
+VIRTUAL = "virtual"
+
+
+def _read(path):
+    try:
+        with io.open(path, 'r') as f:
+            return f.read().strip()
+    except (IOError, OSError):
+        # speed, duplex and carrier can't be read while the link is down
+        return None
+
+
+def _read_int(path):
+    try:
+        return int(_read(path))
+    except (TypeError, ValueError):
+        return None
+
+
+class Interface(object):
+
+    def __init__(self, name, kind, mtu=None, operstate=None, carrier=None,
+                 speed=None, duplex=None, address=None, lower=None,
+                 master=None, addresses=None):
+        self.name = name
+        self.kind = kind
+        self.mtu = mtu
+        self.operstate = operstate
+        self.carrier = carrier
+        # Mb/s, None when unknown
+        self.speed = speed
+        self.duplex = duplex
+        self.address = address
+        # Devices this one sits on: vlan parent, bond slaves, bridge ports
+        self.lower = lower or []
+        self.master = master
+        # (address, netmask) of every address family, in psutil order
+        self.addresses = addresses or []
+
+    @property
+    def up(self):
+        # Drivers that don't track operstate report "unknown"
+        if self.operstate == "unknown":
+            return self.carrier == 1
+        return self.operstate == "up"
+
+    def __repr__(self):
+        return "Interface({}, {}, mtu={}, {})".format(
+            self.name, self.kind, self.mtu, self.operstate)
+
+
+def _kind(path):
+    uevent = _read(os.path.join(path, "uevent")) or ""
+    devtype = None
+    for line in uevent.splitlines():
+        if line.startswith("DEVTYPE="):
+            devtype = line.partition("=")[2]
+    if os.path.isdir(os.path.join(path, "bonding")) or devtype == "bond":
+        return BOND
+    if os.path.isdir(os.path.join(path, "bridge")) or devtype == "bridge":
+        return BRIDGE
+    if devtype == "vlan":
+        return VLAN
+    if _read_int(os.path.join(path, "type")) == ARPHRD_LOOPBACK:
+        return LOOPBACK
+    if os.path.exists(os.path.join(path, "device")):
+        return PHYSICAL
+    return VIRTUAL
+
+
+def _lower(path, kind):
+    lower = sorted(entry[len("lower_"):] for entry in os.listdir(path)
+                   if entry.startswith("lower_"))
+    if lower:
+        return lower
+    # Older kernels without adjacency links
+    if kind == BOND:
+        return sorted((_read(os.path.join(path, "bonding", "slaves")) or
+                       "").split())
+    if kind == BRIDGE and os.path.isdir(os.path.join(path, "brif")):
+        return sorted(os.listdir(os.path.join(path, "brif")))
+    return []
+
+
+def _master(path):
+    master = os.path.join(path, "master")
+    if os.path.islink(master):
+        return os.path.basename(os.readlink(master))
+    return None
+
+
+def read_interface(name, root=SYS_CLASS_NET):
+    path = os.path.join(root, name)
+    kind = _kind(path)
+    speed = _read_int(os.path.join(path, "speed"))
+    return Interface(name, kind,
+                     mtu=_read_int(os.path.join(path, "mtu")),
+                     operstate=_read(os.path.join(path, "operstate")),
+                     carrier=_read_int(os.path.join(path, "carrier")),
+                     speed=speed if speed and speed > 0 else None,
+                     duplex=_read(os.path.join(path, "duplex")),
+                     address=_read(os.path.join(path, "address")),
+                     lower=_lower(path, kind),
+                     master=_master(path))
+
+
+class NetworkInventory(object):
+    """
+    Every network interface on the host read from /sys/class/net in one
+    pass, with the bond, vlan and bridge hierarchy between them resolved
+    """
+
+    def __init__(self, interfaces):
+        self.interfaces = interfaces
+
+    @classmethod
+    def scan(cls, root=SYS_CLASS_NET):
+        interfaces = {}
+        for name in os.listdir(root):
+            try:
+                interfaces[name] = read_interface(name, root)
+            except (IOError, OSError):
+                # Interface was removed while we were reading it
+                continue
+        if psutil is not None:
+            for name, addrs in psutil.net_if_addrs().items():
+                if name in interfaces:
+                    interfaces[name].addresses = [
+                        (addr.address, addr.netmask) for addr in addrs]
+        return cls(interfaces)
+
+    def get(self, name):
+        return self.interfaces.get(name)
+
+    def lower(self, name):
+        """Every device below name, nearest first"""
+        result = []
+        pending = list(self.interfaces[name].lower) if (
+            name in self.interfaces) else []
+        while pending:
+            lname = pending.pop(0)
+            if lname in self.interfaces and lname not in result:
+                result.append(lname)
+                pending.extend(self.interfaces[lname].lower)
+        return [self.interfaces[lname] for lname in result]
+
+    def physical(self, name):
+        """
+        Physical interfaces carrying name's traffic, eg. the slaves of the
+        bond under a vlan.  A physical interface is its own physical device
+        """
+        iface = self.get(name)
+        if iface is None:
+            return []
+        if iface.kind == PHYSICAL:
+            return [iface]
+        return [lower for lower in self.lower(name) if lower.kind == PHYSICAL]
@@ -0,0 +1,151 @@
+from __future__ import (print_function, unicode_literals, division,
+                        absolute_import)
+
+import io
+import os
+import threading
+from collections import OrderedDict
+
+DEFAULT = "DEFAULT"
+
+# Same values oslo.config accepts for BoolOpt
+TRUE_VALUES = ("true", "1", "yes", "on")
+
+
+class ConfigFile(object):
+    """
+    An OpenStack service config file (cinder.conf, glance-api.conf, etc)
+    parsed the way oslo.config reads it.
+
+    Section names and keys are case sensitive, a repeated key keeps every
+    value (MultiStrOpt) and the last one wins for single valued lookups.
+    Unlike ConfigParser, [DEFAULT] values are not inherited by the other
+    sections
+    """
+
+    def __init__(self, path, sections):
+        self.path = path
+        self.sections = sections
+
+    @classmethod
+    def parse(cls, path):
+        sections = OrderedDict()
+        current = None
+        key = None
+        with io.open(path, 'r') as f:
+            for line in f:
+                stripped = line.strip()
+                if not stripped or stripped[0] in "#;":
+                    key = None
+                    continue
+                # Indented lines continue the previous value
+                if line[0].isspace() and key is not None:
+                    values = current[key]
+                    values[-1] = "\n".join((values[-1], stripped)).strip()
+                    continue
+                if stripped.startswith("[") and stripped.endswith("]"):
+                    current = sections.setdefault(stripped[1:-1].strip(),
+                                                  OrderedDict())
+                    key = None
+                    continue
+                if current is None:
+                    # Options before the first section header are ignored
+                    # by oslo.config as well
+                    continue
+                sep = min(i for i in (stripped.find("="), stripped.find(":"),
+                                      len(stripped)) if i >= 0)
+                key = stripped[:sep].strip()
+                value = stripped[sep + 1:].strip()
+                if len(value) > 1 and value[0] == value[-1] and (
+                        value[0] in "\"'"):
+                    value = value[1:-1]
+                current.setdefault(key, []).append(value)
+        return cls(path, sections)
+
+    def has_section(self, section):
+        return section in self.sections
+
+    def section(self, section):
+        """Single valued view of section, empty if it doesn't exist"""
+        return {key: values[-1] for key, values in
+                self.sections.get(section, {}).items()}
+
+    def get(self, section, key, default=None):
+        values = self.sections.get(section, {}).get(key)
+        return values[-1] if values else default
+
+    def getall(self, section, key):
+        return list(self.sections.get(section, {}).get(key, []))
+
+    def getlist(self, section, key):
+        """ListOpt, comma separated"""
+        value = self.get(section, key)
+        if not value:
+            return []
+        return [item.strip() for item in value.split(",") if item.strip()]
+
+    def getbool(self, section, key, default=False):
+        value = self.get(section, key)
+        if value is None:
+            return default
+        return value.lower() in TRUE_VALUES
+
+    def enabled_backends(self):
+        """
+        Backend names from [DEFAULT] enabled_backends, in order.
+
+        Cinder lists section names (enabled_backends = lvm,datera) while
+        glance multi-store maps them to a store type
+        (enabled_backends = fast:rbd, dat:datera), so each item is returned
+        as (name, type), type being None for cinder style entries
+        """
+        backends = []
+        for item in self.getlist(DEFAULT, "enabled_backends"):
+            name, _, btype = item.partition(":")
+            backends.append((name.strip(), btype.strip() or None))
+        return backends
+
+    def backends(self, match):
+        """
+        (name, section) for every enabled backend section that match, a
+        predicate taking (name, type, section), returns true for
+        """
+        found = []
+        for name, btype in self.enabled_backends():
+            section = self.section(name)
+            if match(name, btype, section):
+                found.append((name, section))
+        return found
+
+
+class ConfigCache(object):
+    """
+    Parsed config files keyed by path, reused for as long as the file's
+    mtime and size are unchanged so every check shares one parse
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.files = {}
+
+    def load(self, path):
+        st = os.stat(path)
+        key = (st.st_mtime, st.st_size)
+        with self.lock:
+            cached = self.files.get(path)
+            if cached is not None and cached[0] == key:
+                return cached[1]
+            conf = ConfigFile.parse(path)
+            self.files[path] = (key, conf)
+            return conf
+
+
+configs = ConfigCache()
+
+
+def load(path):
+    """
+    Returns the ConfigFile for path, raises IOError/OSError if it can't be
+    read
+    """
+    return configs.load(path)
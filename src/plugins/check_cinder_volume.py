@@ -4,10 +4,11 @@ from __future__ import (print_function, unicode_literals, division,
 import io
 import os
 import re
-import subprocess
 
-from common import vprint, exe, ff, wf, check, get_latest_driver_version
+from common import vprint, ff, wf, check, get_latest_driver_version
 from common import UUID4_STR_RE
+from locator import locate_package
+import osconf
 
 ETC = "/etc/cinder/cinder.conf"
 PACKAGE_INSTALL = "/usr/lib/python2.7/dist-packages/cinder"
@@ -16,11 +17,13 @@ SITE_PACKAGE_INSTALL = "/usr/lib/python2.7/site-packages/cinder"
 SITE_PACKAGE_INSTALL_2 = "/usr/local/lib/python2.7/site-packages/cinder"
 DEVSTACK_INSTALL = "/opt/stack/cinder/cinder"
 TAGS = "https://api.github.com/repos/Datera/cinder-driver/tags"
+MANIFEST_FIX = ("Allow access to api.github.com or pass a pinned release "
+                "manifest with --release-manifest")
 
 VERSION_RE = re.compile(r"^\s+VERSION = ['\"]([\d\.]+)['\"]\s*$")
 
-ETC_DEFAULT_RE = re.compile(r"^\[DEFAULT\]\s*$")
-ETC_SECTION_RE = re.compile(r"^\[[Dd]atera\]\s*$")
+# Datera driver, relative to the cinder package
+DRIVER = "volume/drivers/datera/datera_iscsi.py"
 LOCATIONS = [PACKAGE_INSTALL, PACKAGE_INSTALL_2, SITE_PACKAGE_INSTALL,
              SITE_PACKAGE_INSTALL_2, DEVSTACK_INSTALL]
 
@@ -29,27 +32,26 @@ def detect_cinder_install():
     for path in LOCATIONS:
         if os.path.isdir(path):
             return path
-    else:
-        result = None
-        try:
-            vprint("Normal cinder install not found, searching for driver")
-            result = exe("sudo find / -name datera_iscsi.py")
-            if not result or result.isspace() or "cinder-driver" in result:
-                raise ValueError("Cinder installation not found")
-            return result.strip().replace(
-                "/volume/drivers/datera/datera_iscsi.py", "")
-        except (subprocess.CalledProcessError, ValueError):
-            raise EnvironmentError(
-                "Cinder installation not found. Usual locations: {}"
-                "".format(LOCATIONS))
+    vprint("Normal cinder install not found, searching for driver")
+    loc = locate_package("cinder", DRIVER, binaries=("cinder-volume",),
+                         exclude=("cinder-driver",))
+    if not loc:
+        raise EnvironmentError(
+            "Cinder installation not found. Usual locations: {}"
+            "".format(LOCATIONS))
+    return loc
 
 
 @check("Cinder Volume", "driver", "plugin", "local")
 def check_cinder_volume_driver(config):
-    version = get_latest_driver_version(TAGS)
+    try:
+        version = get_latest_driver_version(TAGS)
+    except EnvironmentError as e:
+        return wf("Could not determine the latest driver version: {}"
+                  "".format(e), "4D9A1C52", fix=MANIFEST_FIX)
     need_version = version.strip("v")
     loc = detect_cinder_install()
-    dfile = os.path.join(loc, "volume/drivers/datera/datera_iscsi.py")
+    dfile = os.path.join(loc, DRIVER)
     if not os.path.exists(dfile):
         errloc = os.path.join(loc, "volume/drivers")
         return ff("Couldn't detect Datera Cinder driver install at "
@@ -69,108 +71,88 @@ def check_cinder_volume_driver(config):
                   "{}".format(version, need_version), "5B6EFC71")
 
 
+def datera_backends(conf):
+    """
+    (name, section) of every Datera backend in cinder.conf.  Multi-backend
+    setups list them in enabled_backends, older single backend setups only
+    have a [datera] section
+    """
+    backends = conf.backends(
+        lambda name, btype, section: "datera" in section.get(
+            "volume_driver", "") or name.lower() == "datera")
+    if not backends:
+        for name in ("datera", "Datera"):
+            if conf.has_section(name):
+                return [(name, conf.section(name))]
+    return backends
+
+
 @check("Cinder Image Cache Conf", "driver", "plugin", "config", "image",
        "local")
 def check_cinder_image_cache_conf(config):
-    with io.open(ETC, 'r') as f:
-        section = None
-        for line in f:
-            section = ETC_SECTION_RE.match(line)
-            if section:
-                break
-        if not section:
-            return ff("[datera] section missing from "
-                      "/etc/cinder/cinder.conf", "525BAAB0")
-        cache_check = False
-        vtype_check = False
-        for line in f:
-            if 'datera_enable_image_cache' in line and 'True' in line:
-                cache_check = True
-            if ('datera_image_cache_volume_type_id' in line and
-                    UUID4_STR_RE.search(line)):
-                vtype_check = True
-        if not cache_check:
-            ff("datera_enable_image_cache not set in cinder.conf", "C5B86514")
-        if not vtype_check:
+    conf = osconf.load(ETC)
+    backends = datera_backends(conf)
+    if not backends:
+        return ff("[datera] section missing from "
+                  "/etc/cinder/cinder.conf", "525BAAB0")
+    for name, section in backends:
+        if not conf.getbool(name, "datera_enable_image_cache"):
+            ff("datera_enable_image_cache not set in cinder.conf [{}]"
+               "".format(name), "C5B86514")
+        if not UUID4_STR_RE.search(
+                section.get("datera_image_cache_volume_type_id", "")):
             ff("datera_image_cache_volume_type_id is not set to a valid volume"
-               " type id in cinder.conf", "B845D5B1")
+               " type id in cinder.conf [{}]".format(name), "B845D5B1")
 
 
 @check("Cinder Volume Conf", "driver", "plugin", "config", "local")
 def check_cinder_volume_conf(config):
-    section = None
-    with io.open(ETC, 'r') as f:
-        for line in f:
-            default = ETC_DEFAULT_RE.match(line)
-            if default:
-                break
-        if not default:
-            ff("[DEFAULT] section missing from /etc/cinder/cinder.conf",
-               "7B98CFA1")
-        for line in f:
-            section = ETC_SECTION_RE.match(line)
-            if section:
-                break
-            if line.startswith("enabled_backends"):
-                if "datera" not in line:
-                    ff("datera is not set under enabled_backends "
-                       "in /etc/cinder/cinder.conf", "A4402034")
-            if line.startswith("default_volume_type"):
-                if "datera" not in line:
-                    wf("datera is not set as default_volume_type in"
-                       " /etc/cinder/cinder.conf", "C2B8C696")
-
-        if not section:
-            return ff("[datera] section missing from "
-                      "/etc/cinder/cinder.conf", "525BAAB0")
-        dsection = []
-        section_match = re.compile(r"^\[.*\]")
-        for line in f:
-            if section_match.match(line):
-                break
-            dsection.append(line)
-
-    san_check = False
-    user_check = False
-    pass_check = False
-    vbn_check = False
-    debug_check = False
-    defaults_check = False
+    conf = osconf.load(ETC)
+    if not conf.has_section(osconf.DEFAULT):
+        ff("[DEFAULT] section missing from /etc/cinder/cinder.conf",
+           "7B98CFA1")
+    backends = datera_backends(conf)
+    enabled = [name for name, _ in conf.enabled_backends()]
+    if enabled and not any(name in enabled for name, _ in backends):
+        ff("datera is not set under enabled_backends "
+           "in /etc/cinder/cinder.conf", "A4402034")
+    vtype = conf.get(osconf.DEFAULT, "default_volume_type")
+    if vtype is not None and "datera" not in vtype:
+        wf("datera is not set as default_volume_type in"
+           " /etc/cinder/cinder.conf", "C2B8C696")
+    if not backends:
+        return ff("[datera] section missing from "
+                  "/etc/cinder/cinder.conf", "525BAAB0")
 
     ip = config['mgmt_ip']
     user = config['username']
     passwd = config['password']
 
-    for line in dsection:
-        if 'san_ip' in line and ip in line:
-            san_check = True
-        if 'san_login' in line and user in line:
-            user_check = True
-        if 'san_password' in line and passwd in line:
-            pass_check = True
-        if 'volume_backend_name' in line and 'datera' in line:
-            vbn_check = True
-        if 'datera_debug' in line and 'True' in line:
-            debug_check = True
-        if 'datera_volume_type_defaults' in line:
-            defaults_check = True
-
-    if not san_check:
+    # With several Datera backends only the ones pointing at this cluster
+    # have to match its credentials
+    targets = [(name, section) for name, section in backends
+               if section.get("san_ip") == ip]
+    if not targets:
         ff("san_ip line is missing or not matching ip address:"
            " {}".format(ip), "8208B9E7")
-    if not user_check:
-        ff("san_login line is missing or not matching username:"
-           " {}".format(user), "3A6A78D1")
-    if not pass_check:
-        ff("san_password line is missing or not matching "
-           "password: {}".format(passwd), "8DBC87E8")
-    if not vbn_check:
-        ff("volume_backend_name is not set", "5FEC0454")
-    if not debug_check:
-        wf("datera_debug is not enabled")
-    if not defaults_check:
-        wf("datera_volume_type_defaults is not set, consider setting "
-           "minimum QoS values here", "B5D29621")
+        targets = backends
+
+    for name, section in targets:
+        if section.get("san_login") != user:
+            ff("san_login line is missing or not matching username:"
+               " {} in [{}]".format(user, name), "3A6A78D1")
+        if section.get("san_password") != passwd:
+            ff("san_password line is missing or not matching "
+               "password: {} in [{}]".format(passwd, name), "8DBC87E8")
+        if not section.get("volume_backend_name"):
+            ff("volume_backend_name is not set in [{}]".format(name),
+               "5FEC0454")
+        if not conf.getbool(name, "datera_debug"):
+            wf("datera_debug is not enabled in [{}]".format(name),
+               "0F6B2D94")
+        if not section.get("datera_volume_type_defaults"):
+            wf("datera_volume_type_defaults is not set in [{}], consider "
+               "setting minimum QoS values here".format(name), "B5D29621")
 
 
 def load_checks():
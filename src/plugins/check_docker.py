@@ -4,26 +4,31 @@ from __future__ import (print_function, unicode_literals, division,
 import io
 import json
 import os
+import re
+import subprocess
 
 
 from dfs_sdk import ApiNotFoundError
 
-from common import vprint, exe, exe_check, wf, ff, check
+from common import vprint, exe_grep, exe_check, wf, ff, check
 
 CONFIG_FILE = "/root/.datera-config-file"
 PLUGIN = "dateraiodev/docker-driver"
 
 
-@check("Docker Volume", "driver", "plugin", "local")
+@check("Docker Volume", "driver", "plugin", "local", cluster=True)
 def check_docker_volume(config):
     vprint("Checking docker volume driver")
-    if not exe_check("docker ps >/dev/null 2>&1"):
+    if not exe_check(["docker", "ps"]):
         return ff("Docker is not installed", "42BAAC76")
-    if exe_check("docker plugin ls | grep {}".format(PLUGIN)):
+    try:
+        plugins = exe_grep(["docker", "plugin", "ls"], re.escape(PLUGIN))
+    except subprocess.CalledProcessError:
+        plugins = []
+    if not plugins:
         return ff("Datera Docker plugin is not installed", "6C531C5D")
-    plugin = exe("docker plugin ls | grev -v DESCRIPTION | "
-                 "grep {}".format(PLUGIN))
-    if len(plugin.strip().split('\n')) > 1:
+    plugin = "\n".join(plugins)
+    if len(plugins) > 1:
         wf("More than one version of Datera docker driver installed",
            "B3BF691D")
     if 'enabled' not in plugin or 'disabled' in plugin:
@@ -36,7 +41,7 @@ def check_docker_volume(config):
                   "621A6F51")
     api = config['api']
     try:
-        api.app_instances.get(test_name)
+        api.uncached.app_instances.get(test_name)
     except ApiNotFoundError:
         return ff("Docker volume {} did not create on the Datera backend"
                   "".format(test_name), "B106D1CD")
@@ -72,6 +72,14 @@ The "config" parameter passed each decorated "check" function is a UDC
 dictionary with 'vip1_ip' key representing the first access VIP on the Datera
 box and a potential 'vip2_ip' key which is only present if the Datera box is
 configured with a second access VIP.
+
+The cluster connection behind 'api', 'vip1_ip' and 'vip2_ip' is only made
+when one of them is first read.  Checks that use them should say so with
+cluster=True so the connection is set up before the checks start:
+
+    @check("MY CLUSTER TEST", "tag1", cluster=True)
+    def check_cluster_stuff(config):
+        api = config['api']
 """
 
 from common import exe_check, exe, wf, ff, check
@@ -4,9 +4,10 @@ from __future__ import (print_function, unicode_literals, division,
 import io
 import os
 import re
-import subprocess
 
-from common import vprint, exe, ff, wf, check, get_latest_driver_version
+from common import vprint, ff, wf, check, get_latest_driver_version
+from locator import locate_package, find_distributions
+import osconf
 
 ETC = "/etc/glance/glance-api.conf"
 PACKAGE_INSTALL = "/usr/lib/python2.7/dist-packages/glance_store"
@@ -15,11 +16,14 @@ SITE_PACKAGE_INSTALL = "/usr/lib/python2.7/site-packages/glance_store"
 SITE_PACKAGE_INSTALL_2 = "/usr/local/lib/python2.7/site-packages/glance_store"
 DEVSTACK_INSTALL = "/usr/local/lib/python2.7/site-packages/glance_store"
 TAGS = "https://api.github.com/repos/Datera/glance-driver/tags"
+MANIFEST_FIX = ("Allow access to api.github.com or pass a pinned release "
+                "manifest with --release-manifest")
 
 VERSION_RE = re.compile(r"^\s+VERSION = ['\"]v([\d\.]+)['\"]\s*$")
 
-ETC_DEFAULT_RE = re.compile(r"^\[DEFAULT\]\s*$")
-ETC_SECTION_RE = re.compile(r"^\[glance_store\]\s*$")
+# Datera driver, relative to the glance_store package
+DRIVER = "_drivers/datera.py"
+ENTRY_POINT = "glance_store._drivers.datera:Store"
 LOCATIONS = [PACKAGE_INSTALL, PACKAGE_INSTALL_2, SITE_PACKAGE_INSTALL,
              SITE_PACKAGE_INSTALL_2, DEVSTACK_INSTALL]
 
@@ -28,34 +32,42 @@ def detect_glance_install():
     for path in LOCATIONS:
         if os.path.isdir(path):
             return path
-    else:
-        result = None
-        try:
-            vprint("Normal cinder install not found, searching for driver")
-            result = exe("sudo find / -name datera.py")
-            if not result or result.isspace() or "glance-driver" in result:
-                return None
-            return result.strip().replace(
-                "/_drivers/datera.py", "")
-        except (subprocess.CalledProcessError, ValueError):
-            return None
-
-
-def find_entry_points_file():
-    result = exe("find /usr/ -name 'entry_points.txt' | grep glance_store")
-    if not result:
-        return None
-    return result.strip()
+    vprint("Normal glance install not found, searching for driver")
+    return locate_package("glance_store", DRIVER, binaries=("glance-api",),
+                          exclude=("glance-driver",))
+
+
+def find_datera_entry_point(loc):
+    """
+    Returns (distribution, entry point) for 'datera' from the glance_store
+    metadata installed alongside loc.  The entry point is None if it isn't
+    registered and both are None if there is no metadata
+    """
+    dists = find_distributions(loc, "glance_store")
+    if not dists:
+        return None, None
+    dist = dists[0]
+    if len(dists) > 1:
+        vprint("Multiple glance_store versions installed at {}, using "
+               "{}".format(os.path.dirname(loc), dist.version))
+    for group in dist.entry_points().values():
+        if "datera" in group:
+            return dist, group["datera"]
+    return dist, None
 
 
 @check("Glance", "driver", "plugin", "image", "local")
 def check_glance_driver(config):
-    version = get_latest_driver_version(TAGS)
+    try:
+        version = get_latest_driver_version(TAGS)
+    except EnvironmentError as e:
+        return wf("Could not determine the latest driver version: {}"
+                  "".format(e), "B7E3052F", fix=MANIFEST_FIX)
     need_version = version.strip("v")
     loc = detect_glance_install()
     if not loc:
         return ff("Could not detect Glance install location", "6515ADB8")
-    dfile = os.path.join(loc, "_drivers/datera.py")
+    dfile = os.path.join(loc, DRIVER)
     if not os.path.exists(dfile):
         errloc = os.path.join(loc, "_drivers")
         return ff("Couldn't detect Datera Glance driver install at "
@@ -73,23 +85,14 @@ def check_glance_driver(config):
     if version != need_version:
         return ff("Glance Driver version mismatch, have: {}, want: "
                   "{}".format(version, need_version), "B65FD598")
-    entry = find_entry_points_file()
+    dist, entry = find_datera_entry_point(loc)
+    if not dist:
+        return ff("Could not find glance_store package metadata next to "
+                  "{}".format(loc), "842A4DB1")
     if not entry:
-        return ff("Could not find entry_points.txt file for glance_store",
-                  "842A4DB1")
-    efound = None
-    with io.open(entry) as f:
-        for line in f:
-            if 'datera' in line:
-                efound = line
-                break
-    if not efound:
-        return ff("Could not find 'datera' entry in {}".format(entry),
-                  "22DC6275")
-    k, v = efound.split("=")
-    if k.strip() != 'datera':
-        return ff("entry_points.txt entry malformed", "3F9F67BF")
-    if v.strip() != 'glance_store._drivers.datera:Store':
+        return ff("Could not find 'datera' entry in {}".format(
+            os.path.join(dist.path, "entry_points.txt")), "22DC6275")
+    if entry != ENTRY_POINT:
         return ff("entry_points.txt entry malformed", "3F9F67BF")
 
     backend = os.path.join(loc, "backend.py")
@@ -106,81 +109,68 @@ def check_glance_driver(config):
            "'choices' parameter", "C521E039")
 
 
+def datera_stores(conf):
+    """
+    (name, section) of every Datera store.  Multi-store setups map names
+    to types in [DEFAULT] enabled_backends with one section per store,
+    otherwise the options live under [glance_store]
+    """
+    if conf.enabled_backends():
+        return conf.backends(
+            lambda name, btype, section: btype == "datera")
+    if "datera" in conf.getlist("glance_store", "stores"):
+        return [("glance_store", conf.section("glance_store"))]
+    return []
+
+
 @check("Glance Conf", "driver", "plugin", "config", "image", "local")
 def check_glance_conf(config):
-    pass
-    section = None
-    with io.open(ETC, 'r') as f:
-        for line in f:
-            default = ETC_DEFAULT_RE.match(line)
-            if default:
-                break
-        if not default:
-            ff("[DEFAULT] section missing from {}".format(ETC), "228241A8")
-        for line in f:
-            section = ETC_SECTION_RE.match(line)
-            if section:
-                break
-        if not section:
-            return ff("[glance_store] section missing from {}".format(ETC),
-                      "AFCBBDD7")
-        dsection = []
-        section_match = re.compile(r"^\[.*\]")
-        for line in f:
-            if section_match.match(line):
-                break
-            dsection.append(line)
-
-        ip = config['mgmt_ip']
-        user = config['username']
-        passwd = config['password']
-
-        san_check = False
-        user_check = False
-        pass_check = False
-        stores_check = False
-        default_check = False
-
-        for line in dsection:
-            if line.startswith("stores"):
-                stores_check = True
-                if "datera" not in line:
-                    ff("datera is not set under 'stores' in {}".format(ETC),
-                       "0D862946")
-            if line.startswith("default_store"):
-                default_check = True
-                if "datera" not in line:
-                    wf("datera is not set as default_store in {}".format(ETC),
-                       "B74CEBC3")
-            if line.startswith("datera_san_ip"):
-                san_check = True
-                if line.split("=")[-1].strip() != ip:
-                    ff("datera_san_ip doesn't match mgmt ip", "2330CACB")
-            if line.startswith("datera_san_login"):
-                user_check = True
-                if line.split("=")[-1].strip() != user:
-                    ff("datera_san_login doesn't match username",
-                       "E9F02293")
-            if line.startswith("datera_san_password"):
-                pass_check = True
-                if line.split("=")[-1].strip() != passwd:
-                    ff("datera_san_password doesn't match password",
-                       "4B16C4F7")
-
-        if not stores_check:
-            ff("'stores' entry not found under [glance_store]", "11F30DCF")
-        if not default_check:
-            ff("'default_store' entry not found under [glance_store]",
-               "540C3008")
-        if not san_check:
-            ff("'datera_san_ip' entry not found under [glance_store]",
+    conf = osconf.load(ETC)
+    if not conf.has_section(osconf.DEFAULT):
+        ff("[DEFAULT] section missing from {}".format(ETC), "228241A8")
+    if not conf.has_section("glance_store"):
+        return ff("[glance_store] section missing from {}".format(ETC),
+                  "AFCBBDD7")
+
+    multi = bool(conf.enabled_backends())
+    stores = datera_stores(conf)
+    if not multi and conf.get("glance_store", "stores") is None:
+        ff("'stores' entry not found under [glance_store]", "11F30DCF")
+    elif not stores:
+        ff("datera is not set under 'stores' in {}".format(ETC),
+           "0D862946")
+
+    # default_backend names a multi-store backend, default_store a type
+    default_key = "default_backend" if multi else "default_store"
+    default = conf.get("glance_store", default_key)
+    if default is None:
+        ff("'{}' entry not found under [glance_store]".format(default_key),
+           "540C3008")
+    elif default not in ([name for name, _ in stores] if multi else
+                         ["datera"]):
+        wf("datera is not set as {} in {}".format(default_key, ETC),
+           "B74CEBC3")
+
+    ip = config['mgmt_ip']
+    user = config['username']
+    passwd = config['password']
+
+    for name, section in stores:
+        if "datera_san_ip" not in section:
+            ff("'datera_san_ip' entry not found under [{}]".format(name),
                "42481C71")
-        if not user_check:
-            ff("'datera_san_login' entry not found under [glance_store]",
+        elif section["datera_san_ip"] != ip:
+            ff("datera_san_ip doesn't match mgmt ip", "2330CACB")
+        if "datera_san_login" not in section:
+            ff("'datera_san_login' entry not found under [{}]".format(name),
                "6E281004")
-        if not pass_check:
-            ff("'datera_san_password' entry not found under [glance_store]",
-               "F5DEC8B1")
+        elif section["datera_san_login"] != user:
+            ff("datera_san_login doesn't match username", "E9F02293")
+        if "datera_san_password" not in section:
+            ff("'datera_san_password' entry not found under [{}]".format(
+                name), "F5DEC8B1")
+        elif section["datera_san_password"] != passwd:
+            ff("datera_san_password doesn't match password", "4B16C4F7")
 
 
 def load_checks():
@@ -2,49 +2,80 @@ from __future__ import (print_function, unicode_literals, division,
                         absolute_import)
 
 import re
+import subprocess
 
-from common import exe_check, exe, ff, check
+from common import exe_check, ff, check
+from facts import fact, which, unit
+from facts import BINARIES, PROCESSES, UNITS, K8S
+from k8s import DAEMONSET, STATEFULSET
 from k8s_yaml import get_k8s_yaml
 
 
-KCTL_MA_RE = re.compile(r"Major:\"(\d+)\",")
-KCTL_MI_RE = re.compile(r"Minor:\"(\d+)\",")
 KPATH_RE = re.compile(r"path=(.*?) ;")
 
-SUPPORTED_MAJOR = 1
-SUPPORTED_MINOR = 13
-
-
-def calc_version(m1, m2):
-    return int(m1) * 100 + int(m2)
-
-
-@check("K8S CSI", "driver", "plugin", "local", "csi")
-def check_kubernetes_driver_csi(config):
+SUPPORTED_VERSION = (1, 13)
+NAMESPACE = "kube-system"
+CONTROLLER = "csi-provisioner"
+NODE = "csi-node"
+
+
+def k8s_snapshot(supported):
+    """
+    Returns the KubeSnapshot after checking the client and server versions
+    against supported, a (major, minor) tuple.  Returns None if the checks
+    can't go on
+    """
+    try:
+        snap = fact(K8S)
+    except (subprocess.CalledProcessError, EnvironmentError,
+            ValueError) as e:
+        return ff("Could not read cluster state with kubectl: {}".format(e),
+                  "E4C1A07B")
     # Is kubectl present?
-    if not exe_check("which kubectl"):
+    if snap is None:
         return ff("Could not detect kubectl installation", "572B0511")
     # Does kubectl have a supported version?
-    kversion = exe("kubectl version").strip().split("\n")
-    for line in kversion:
-        m1 = KCTL_MA_RE.search(line)
-        m2 = KCTL_MI_RE.search(line)
-        if not m1 and m2:
-            return ff("Could not detect kubectl version", "C1802A6E")
-        supported = calc_version(SUPPORTED_MAJOR, SUPPORTED_MINOR)
-        major = m1.group(1)
-        minor = m2.group(1)
-        found = calc_version(major, minor)
-        if found < supported:
+    versions = [v for v in (snap.client_version, snap.server_version) if v]
+    if not versions:
+        return ff("Could not detect kubectl version", "C1802A6E")
+    for version in versions:
+        if version < supported:
             return ff("Kubectl has version {}, which is lower than supported "
-                      "version {}".format(found, supported), "D2DA6596")
+                      "version {}".format(
+                          "{}.{}".format(*version),
+                          "{}.{}".format(*supported)), "D2DA6596")
+    return snap
+
+
+def check_daemonset_pods(snap, daemonset, not_ready_uid, local_uid):
+    """Every pod of daemonset is ready and one is running on this node"""
+    pods = snap.find_pods(owner=daemonset)
+    not_ready = sorted("{} ({})".format(pod.name, pod.node)
+                       for pod in pods if not pod.ready)
+    if not_ready or not daemonset.healthy:
+        ff("{} has {}/{} pods ready. Not ready: {}".format(
+            daemonset.name, daemonset.ready, daemonset.desired,
+            ", ".join(not_ready) or "none scheduled"), not_ready_uid)
+    node = snap.local_node()
+    if node and not any(pod.node == node for pod in pods):
+        ff("No {} pod is scheduled on this node ({})".format(
+            daemonset.name, node), local_uid)
+
+
+@check("K8S CSI", "driver", "plugin", "local", "csi",
+       facts=(BINARIES, PROCESSES, UNITS, K8S))
+def check_kubernetes_driver_csi(config):
+    snap = k8s_snapshot(SUPPORTED_VERSION)
+    if not snap:
+        return
     # Are dependencies installed?
-    if not exe_check("which iscsiadm"):
+    if not which("iscsiadm"):
         ff("open-iscsi does not appear to be installed", "94BF0B77")
     # Is attach-detach disabled in kubelet?
-    exstart = exe("systemctl show kubelet.service | grep ExecStart")
+    kubelet = unit("kubelet")
+    exstart = kubelet.exec_start
     if not exstart:
-        if exe_check("microk8s.kubectl"):
+        if exe_check(["microk8s.kubectl"]):
             ff("kubelet service not detected.  microk8s is not currently "
                "supported", "995EA49E")
             return
@@ -55,9 +86,10 @@ def check_kubernetes_driver_csi(config):
         ff("--allow-privileged is not enabled in kublet's systemctl entry.  "
            "Run --allow-privileged=true when starting kubelet "
            "to enable", "7475B000")
-    if "Active: active" in exe("systemctl status kubelet"):
+    if kubelet.active:
         kpath = KPATH_RE.search(exstart).group(1)
-        exstart = exe("ps -ef | grep {} | grep -v grep".format(kpath))
+        exstart = "\n".join(
+            proc.cmdline for proc in fact(PROCESSES).find(kpath))
         if "--enable-controller-attach-detach=false" in exstart:
             ff("Attach-detach is disabled in kublet.  Run "
                "--enable-controller-attach-detach=true when starting kubelet "
@@ -65,27 +97,26 @@ def check_kubernetes_driver_csi(config):
     else:
         ff("The kubelet service is not running", "0762A89B")
     # iscsi-recv is running?
-    if not exe_check("ps -ef | grep iscsi-recv | grep -v grep"):
+    if not fact(PROCESSES).by_name("iscsi-recv"):
         fix = "Run ./setup_iscsi.sh from the datera-csi repository"
         ff("iscsi-recv binary is not running.", "A8B6BA35", fix=fix)
 
     # Agents are running?
-    pods = exe("kubectl --namespace=kube-system get pods").strip()
-    if not pods:
+    controller = snap.workload(STATEFULSET, NAMESPACE, CONTROLLER)
+    nodes = snap.workload(DAEMONSET, NAMESPACE, NODE)
+    if not controller and not nodes:
         return ff("CSI plugin pods are not running.", "49BDC893",
                   fix="Install the CSI plugin deployment yaml.  "
                       "'kubectl create -f csi.yaml'")
-    controller_pod = False
-    node_pods = False
-    for line in pods.split("\n"):
-        if "csi-provisioner-0" in line:
-            controller_pod = True
-        if "csi-node-" in line:
-            node_pods = True
-    if not controller_pod:
+    if not controller:
         ff("Controller pod not found", "17FF7B78")
-    if not node_pods:
+    elif not controller.healthy:
+        ff("Controller has {}/{} pods ready".format(
+            controller.ready, controller.desired), "5A0C93D1")
+    if not nodes:
         ff("At least one Node pod not found", "2FD6A7B4")
+    else:
+        check_daemonset_pods(snap, nodes, "C7E2B845", "0B9F6D3A")
 
 
 @check("K8S CSI YAML", "driver", "plugin", "local", "csi", "config")
@@ -95,22 +126,31 @@ def check_csi_yaml(config):
         ff("In order to perform the CSI yaml check you must provide the yaml"
            " file location with the '--csi-yaml' argument", "1C84788A")
         return
-    entries = get_k8s_yaml(yml)
-    nodes = entries['nodes']
-    controller = entries['controller']
+    entries, errors = get_k8s_yaml(yml)
+    for error in errors:
+        ff(error, "93D4E1A6",
+           fix="Create the secret or fix its name in {}".format(yml))
+    nodes = entries.get('nodes')
+    controller = entries.get('controller')
+    if nodes is None:
+        ff("No DaemonSet with a 'dat-csi-plugin-node' container found in "
+           "{}".format(yml), "5C8E2F17")
+    if controller is None:
+        ff("No StatefulSet with a 'dat-csi-plugin-controller' container "
+           "found in {}".format(yml), "E36B90A4")
 
     for k1, k2, fc1, fc2 in (('DAT_MGMT', 'mgmt_ip', "A4CEE995", "D520EF2E"),
                              ('DAT_USER', 'username', "4FAC9E6F", "FA4AD639"),
                              ('DAT_PASS', 'password', "3F37E06E", "F6B7A8FE")):
 
-        if nodes[k1] != config[k2]:
+        if nodes is not None and nodes.get(k1) != config[k2]:
             ff("CSI 'node' service environment variable {} does not match "
                "UDC config.  [{} != {}]".format(
-                   k1, nodes[k1], config[k2]), fc1)
-        if controller[k1] != config[k2]:
-            ff("CSI 'controller' service environment variable DAT_MGMT does "
+                   k1, nodes.get(k1), config[k2]), fc1)
+        if controller is not None and controller.get(k1) != config[k2]:
+            ff("CSI 'controller' service environment variable {} does "
                "not match UDC config.  [{} != {}]".format(
-                   k1, controller[k1], config[k2]), fc2)
+                   k1, controller.get(k1), config[k2]), fc2)
 
 
 def load_checks():
@@ -3,54 +3,43 @@ from __future__ import (print_function, unicode_literals, division,
 
 import re
 
-from common import exe_check, exe, ff, wf, check
+from common import ff, wf, check
+from facts import fact, which, unit
+from facts import BINARIES, PROCESSES, UNITS, K8S
+from k8s import DAEMONSET
+from plugins.check_k8s_csi import k8s_snapshot, check_daemonset_pods
 
 
-KCTL_MA_RE = re.compile(r'Major:"(\d+)",')
-KCTL_MI_RE = re.compile(r'Minor:"(\d+)",')
 KPATH_RE = re.compile(r"path=(.*?) ;")
 
-SUPPORTED_MAJOR = 1
-SUPPORTED_MINOR = 6
+SUPPORTED_VERSION = (1, 6)
+NAMESPACE = "datera"
+INSTALLER = "datera-installer-agent"
+PROVISIONER = "datera-provisioner-agent"
 
 
-def calc_version(m1, m2):
-    return int(m1) * 100 + int(m2)
-
-
-@check("K8S FLEX", "driver", "plugin", "local", "flex")
+@check("K8S FLEX", "driver", "plugin", "local", "flex",
+       facts=(BINARIES, PROCESSES, UNITS, K8S))
 def check_kubernetes_driver_flex(config):
-    # Is kubectl present?
-    if not exe_check("which kubectl"):
-        return ff("Could not detect kubectl installation", "572B0511")
-    # Does kubectl have a supported version?
-    kversion = exe("kubectl version").strip().split("\n")
-    for line in kversion:
-        m1 = KCTL_MA_RE.search(line)
-        m2 = KCTL_MI_RE.search(line)
-        if not m1 and m2:
-            return ff("Could not detect kubectl version", "C1802A6E")
-        supported = calc_version(SUPPORTED_MAJOR, SUPPORTED_MINOR)
-        major = m1.group(1)
-        minor = m2.group(1)
-        found = calc_version(major, minor)
-        if found < supported:
-            return ff("Kubectl has version {}, which is lower than supported "
-                      "version {}".format(found, supported), "D2DA6596")
+    snap = k8s_snapshot(SUPPORTED_VERSION)
+    if not snap:
+        return
     # Are dependencies installed?
-    if not exe_check("which mkfs"):
+    if not which("mkfs"):
         ff("mkfs is not installed", "FE13A328")
-    if not exe_check("which iscsiadm"):
+    if not which("iscsiadm"):
         ff("sg3_utils does not appear to be installed", "94BF0B77")
     # Is attach-detach disabled in kubelet?
-    exstart = exe("systemctl show kubelet.service | grep ExecStart")
+    kubelet = unit("kubelet")
+    exstart = kubelet.exec_start
     if "--enable-controller-attach-detach=false" not in exstart:
         wf("Attach-detach is enabled in kublet's systemctl entry.  Run "
            "--enable-controller-attach-detach=false when starting kubelet "
            "to disable", "5B3729F2")
-    if "Active: active" in exe("systemctl status kubelet"):
+    if kubelet.active:
         kpath = KPATH_RE.search(exstart).group(1)
-        exstart = exe("ps -ef | grep {} | grep -v grep".format(kpath))
+        exstart = "\n".join(
+            proc.cmdline for proc in fact(PROCESSES).find(kpath))
         if "--enable-controller-attach-detach=false" not in exstart:
             ff("Attach-detach is enabled in kublet.  Run "
                "--enable-controller-attach-detach=false when starting kubelet "
@@ -58,21 +47,20 @@ def check_kubernetes_driver_flex(config):
     else:
         ff("The kubelet service is not running", "0762A89B")
     # Agents are running?
-    pods = exe("kubectl --namespace=datera get pods").strip()
-    if not pods:
+    if not snap.find_pods(namespace=NAMESPACE):
         return ff("Installer agents and provisioner agents are not running",
                   "244C0B34")
-    installer_agent = False
-    provisioner_agent = False
-    for line in pods.split("\n"):
-        if "datera-installer-agent" in line:
-            installer_agent = True
-        if "datera-provisioner-agent" in line:
-            provisioner_agent = True
-    if not installer_agent:
+    installer = snap.workload(DAEMONSET, NAMESPACE, INSTALLER)
+    if installer:
+        check_daemonset_pods(snap, installer, "6D2E81F0", "A14B7C59")
+    elif not snap.find_pods(namespace=NAMESPACE, prefix=INSTALLER):
         ff("Installer agents not found", "08193032")
-    if not provisioner_agent:
+    provisioners = snap.find_pods(namespace=NAMESPACE, prefix=PROVISIONER)
+    if not provisioners:
         ff("Provisioner agents not found", "3AAF82CA")
+    elif not any(pod.ready for pod in provisioners):
+        ff("No provisioner agent pod is ready: {}".format(
+            ", ".join(sorted(pod.name for pod in provisioners))), "F08C3E27")
 
 
 def load_checks():
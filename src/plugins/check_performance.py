@@ -8,15 +8,17 @@ from __future__ import (print_function, unicode_literals, division,
 
 # from dfs_sdk import ApiNotFoundError
 
-from common import vprint, check, exe_check, ff
+from common import vprint, check, ff
+from facts import which, BINARIES
 
 CONFIG_FILE = "/root/.datera-config-file"
 
 
-@check("Performance", "plugin", "perf", "fio", "4k")
+@check("Performance", "plugin", "perf", "fio", "4k", facts=(BINARIES,),
+       cluster=True)
 def check_single_volume_performance_fio_4k(config):
     vprint("Checking FIO performance, single volume")
-    if not exe_check("which fio"):
+    if not which("fio"):
         ff("FIO is not installed", "0BB2848F")
     api = config['api']
 
@@ -0,0 +1,550 @@
+from __future__ import (print_function, unicode_literals, division,
+                        absolute_import)
+
+import errno
+import itertools
+import os
+import re
+import select
+import socket
+import struct
+import subprocess
+import threading
+import time
+
+from common import vprint, exe, ps, in_check_context
+from routes import resolve
+
+DEFAULT_COUNT = 5
+DEFAULT_SIZE = 56
+# Seconds between probe rounds and to wait for replies after the last round
+INTERVAL = 0.2
+REPLY_TIMEOUT = 1
+# Latency (ms) above which connection checks warn
+LATENCY_WARNING = 10
+
+CLUSTER_IPS = ("mgmt_ip", "vip1_ip", "vip2_ip")
+
+# Largest MTU path MTU discovery searches up to (jumbo frames)
+MAX_MTU = 9000
+# Copies of each DF probe size sent, so one lost packet isn't mistaken for
+# a size that doesn't fit
+PMTU_ATTEMPTS = 2
+PMTU_TIMEOUT = 0.5
+# IP + ICMP header bytes on top of the probe payload
+HEADER_OVERHEAD = {socket.AF_INET: 28, socket.AF_INET6: 48}
+# Not every python exposes these, values are from linux/in.h and in6.h
+IP_MTU_DISCOVER = getattr(socket, "IP_MTU_DISCOVER", 10)
+IPV6_MTU_DISCOVER = getattr(socket, "IPV6_MTU_DISCOVER", 23)
+# Set DF and ignore the kernel's cached path MTU, same as 'ping -M probe'
+PMTUDISC_PROBE = 3
+
+ICMP_HDR = struct.Struct("!BBHHH")
+# family --> (protocol, echo request type, echo reply type)
+ICMP_TYPES = {socket.AF_INET: (socket.IPPROTO_ICMP, 8, 0),
+              socket.AF_INET6: (socket.IPPROTO_ICMPV6, 128, 129)}
+# ICMP "fragmentation needed" (type 3 code 4) and ICMPv6 "packet too big"
+# (type 2) errors, which carry the next-hop MTU of the reporting router
+TOO_BIG = {socket.AF_INET: (3, 4), socket.AF_INET6: (2, 0)}
+PING_RE = re.compile(r"icmp_seq=(\d+) .*time=([\d.]+) ms")
+PING_TOO_BIG_RE = re.compile(r"^From (\S+) .*mtu = (\d+)")
+
+
+class ProbeResult(object):
+
+    def __init__(self, ip, size, sent, rtts):
+        self.ip = ip
+        self.size = size
+        self.sent = sent
+        # Round trip times in ms, in send order
+        self.rtts = rtts
+        self.received = len(rtts)
+
+    @property
+    def reachable(self):
+        return self.received > 0
+
+    @property
+    def loss(self):
+        if not self.sent:
+            return 100.0
+        return round(100.0 * (self.sent - self.received) / self.sent, 1)
+
+    @property
+    def min(self):
+        return min(self.rtts) if self.rtts else None
+
+    @property
+    def avg(self):
+        if not self.rtts:
+            return None
+        return sum(self.rtts) / len(self.rtts)
+
+    @property
+    def p99(self):
+        if not self.rtts:
+            return None
+        ordered = sorted(self.rtts)
+        return ordered[max(0, -(-99 * len(ordered) // 100) - 1)]
+
+    @property
+    def jitter(self):
+        if len(self.rtts) < 2:
+            return None
+        diffs = [abs(b - a) for a, b in zip(self.rtts, self.rtts[1:])]
+        return sum(diffs) / len(diffs)
+
+    def as_dict(self):
+        def _ms(value):
+            return None if value is None else round(value, 3)
+        return {"ip": self.ip,
+                "size": self.size,
+                "sent": self.sent,
+                "received": self.received,
+                "loss": self.loss,
+                "min": _ms(self.min),
+                "avg": _ms(self.avg),
+                "p99": _ms(self.p99),
+                "jitter": _ms(self.jitter)}
+
+    def __repr__(self):
+        return "ProbeResult({}, {}/{}, avg={})".format(
+            self.ip, self.received, self.sent, self.avg)
+
+
+def _checksum(data):
+    if len(data) % 2:
+        data += b"\x00"
+    total = sum(struct.unpack("!{}H".format(len(data) // 2), data))
+    total = (total >> 16) + (total & 0xffff)
+    total += total >> 16
+    return ~total & 0xffff
+
+
+def _echo_request(family, ident, seq, payload):
+    rtype = ICMP_TYPES[family][1]
+    header = ICMP_HDR.pack(rtype, 0, 0, ident, seq)
+    checksum = _checksum(header + payload)
+    return ICMP_HDR.pack(rtype, 0, checksum, ident, seq) + payload
+
+
+def _open_socket(family):
+    """
+    Raw ICMP socket when privileged, otherwise an unprivileged ping socket
+    (net.ipv4.ping_group_range).  Returns (socket, raw) or (None, False)
+    """
+    proto = ICMP_TYPES[family][0]
+    for kind in (socket.SOCK_RAW, socket.SOCK_DGRAM):
+        try:
+            sock = socket.socket(family, kind, proto)
+        except (IOError, OSError) as e:
+            if e.errno not in (errno.EPERM, errno.EACCES,
+                               errno.EPROTONOSUPPORT, errno.EAFNOSUPPORT):
+                raise
+            continue
+        try:
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 1 << 20)
+        except (IOError, OSError):
+            pass
+        return sock, kind == socket.SOCK_RAW
+    return None, False
+
+
+# Raw ICMP sockets see every echo reply on the host, each batch of probes
+# gets its own id so concurrent batches don't match each other's replies
+_idents = itertools.count(1)
+
+
+def _next_ident():
+    return (os.getpid() + next(_idents)) & 0xffff
+
+
+def _ip_header_len(data, offset=0):
+    return (struct.unpack_from("!B", data, offset)[0] & 0x0f) * 4
+
+
+def _parse_reply(family, raw, data):
+    # Raw IPv4 sockets hand back the IP header as well
+    offset = _ip_header_len(data) if (
+        raw and family == socket.AF_INET) else 0
+    if len(data) < offset + ICMP_HDR.size:
+        return None
+    rtype, _, _, ident, seq = ICMP_HDR.unpack_from(data, offset)
+    if rtype != ICMP_TYPES[family][2]:
+        return None
+    return ident, seq, len(data) - offset - ICMP_HDR.size
+
+
+def _probe_sockets(family, targets, size, count):
+    """
+    Probes every target address of one family from a single socket.
+    Returns a dict of address --> list of rtts or None if no ICMP socket
+    could be opened
+    """
+    sock, raw = _open_socket(family)
+    if sock is None:
+        return None
+    # Ping sockets rewrite the id, so replies are matched on address + seq
+    ident = _next_ident()
+    payload = b"\x00" * size
+    sent = {}
+    replies = {}
+    seq = 0
+    next_round = time.time()
+    deadline = None
+    try:
+        while True:
+            now = time.time()
+            if seq < count and now >= next_round:
+                for addr in targets:
+                    packet = _echo_request(family, ident, seq, payload)
+                    try:
+                        sock.sendto(packet, (addr, 0))
+                        sent[(addr, seq)] = time.time()
+                    except (IOError, OSError) as e:
+                        vprint("Could not send probe to {}: {}".format(
+                            addr, e))
+                seq += 1
+                next_round = now + INTERVAL
+                if seq == count:
+                    deadline = now + REPLY_TIMEOUT
+            if deadline is not None and (now >= deadline or
+                                         len(replies) == len(sent)):
+                break
+            wake = next_round if seq < count else deadline
+            ready, _, _ = select.select([sock], [], [], max(0, wake - now))
+            if not ready:
+                continue
+            data, peer = sock.recvfrom(65536)
+            received = time.time()
+            reply = _parse_reply(family, raw, data)
+            if reply is None or (raw and reply[0] != ident) or (
+                    reply[2] != size):
+                continue
+            key = (peer[0], reply[1])
+            if key in sent and key not in replies:
+                replies[key] = (received - sent[key]) * 1000
+    finally:
+        sock.close()
+    return {addr: [replies[(addr, s)] for s in range(count)
+                   if (addr, s) in replies]
+            for addr in targets}
+
+
+def _probe_ping(addr, size, count):
+    cmd = ["ping", "-n", "-c", str(count), "-i", str(INTERVAL),
+           "-W", str(REPLY_TIMEOUT), "-s", str(size), addr]
+    try:
+        out = exe(cmd)
+    except subprocess.CalledProcessError as e:
+        # Exits non-zero when no replies come back
+        out = (e.output or b"").decode("utf-8", "replace")
+    rtts = {}
+    for line in out.splitlines():
+        match = PING_RE.search(line)
+        if match:
+            rtts[int(match.group(1))] = float(match.group(2))
+    return [rtts[s] for s in sorted(rtts)]
+
+
+def _concurrently(func, arglist):
+    threads = [threading.Thread(target=in_check_context(func), args=args)
+               for args in arglist]
+    for thread in threads:
+        thread.daemon = True
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+
+def _resolve(host):
+    addr = resolve(host)
+    if addr is None:
+        return None, None
+    family = socket.AF_INET if addr.version == 4 else socket.AF_INET6
+    return family, str(addr)
+
+
+def probe(hosts, size=DEFAULT_SIZE, count=DEFAULT_COUNT):
+    """
+    Sends count ICMP echo requests of size bytes to every host at once.
+
+    Uses one ICMP socket per address family, falling back to one 'ping'
+    process per host run in parallel when ICMP sockets aren't permitted.
+    Returns a dict of host --> ProbeResult
+    """
+    resolved = {}
+    by_family = {}
+    for host in hosts:
+        family, addr = _resolve(host)
+        resolved[host] = addr
+        if addr is not None:
+            by_family.setdefault(family, []).append(addr)
+    rtts = {}
+
+    def _ping(addr):
+        rtts[addr] = _probe_ping(addr, size, count)
+
+    def _probe_family(family, addrs):
+        found = _probe_sockets(family, addrs, size, count)
+        if found is not None:
+            rtts.update(found)
+            return
+        vprint("No ICMP socket available, probing with ping")
+        _concurrently(_ping, [(addr,) for addr in addrs])
+
+    _concurrently(_probe_family, by_family.items())
+    return {host: ProbeResult(host, size, count if addr else 0,
+                              rtts.get(addr, []))
+            for host, addr in resolved.items()}
+
+
+class PmtuResult(object):
+
+    def __init__(self, ip, mtu, hop=None):
+        self.ip = ip
+        # Largest packet, headers included, that reached ip with DF set.
+        # None when nothing got through
+        self.mtu = mtu
+        # (router, next-hop MTU) from a fragmentation needed error
+        self.hop = hop
+
+    def __repr__(self):
+        return "PmtuResult({}, {})".format(self.ip, self.mtu)
+
+
+def _parse_too_big(family, raw, data):
+    """
+    Returns (ident, seq, mtu) when data is a fragmentation needed / packet
+    too big error about one of our echo requests, otherwise None
+    """
+    offset = _ip_header_len(data) if (
+        raw and family == socket.AF_INET) else 0
+    if len(data) < offset + 8:
+        return None
+    if struct.unpack_from("!BB", data, offset) != TOO_BIG[family]:
+        return None
+    # The error quotes the IP header and start of the packet it refers to
+    if family == socket.AF_INET:
+        mtu = struct.unpack_from("!H", data, offset + 6)[0]
+        inner = offset + 8
+        if len(data) <= inner:
+            return None
+        inner += _ip_header_len(data, inner)
+    else:
+        mtu = struct.unpack_from("!I", data, offset + 4)[0]
+        inner = offset + 48
+    if len(data) < inner + ICMP_HDR.size:
+        return None
+    rtype, _, _, ident, seq = ICMP_HDR.unpack_from(data, inner)
+    if rtype != ICMP_TYPES[family][1]:
+        return None
+    return ident, seq, mtu
+
+
+class DfProber(object):
+    """
+    Sends echo requests with the don't fragment bit set to a single address
+    over an ICMP socket, or through 'ping -M do' when no ICMP socket is
+    available
+    """
+
+    def __init__(self, family, addr):
+        self.family = family
+        self.addr = addr
+        self.ident = _next_ident()
+        self.seq = 0
+        self.hop = None
+        self.sock, self.raw = _open_socket(family)
+        if self.sock is None:
+            return
+        if family == socket.AF_INET:
+            self.sock.setsockopt(socket.IPPROTO_IP, IP_MTU_DISCOVER,
+                                 PMTUDISC_PROBE)
+        else:
+            self.sock.setsockopt(socket.IPPROTO_IPV6, IPV6_MTU_DISCOVER,
+                                 PMTUDISC_PROBE)
+
+    def close(self):
+        if self.sock is not None:
+            self.sock.close()
+
+    def fits(self, size):
+        """True if a size byte payload gets through unfragmented"""
+        if self.sock is None:
+            return self._fits_ping(size)
+        payload = b"\x00" * size
+        seqs = set()
+        try:
+            for _ in range(PMTU_ATTEMPTS):
+                self.seq = (self.seq + 1) & 0xffff
+                self.sock.sendto(_echo_request(
+                    self.family, self.ident, self.seq, payload),
+                    (self.addr, 0))
+                seqs.add(self.seq)
+            deadline = time.time() + PMTU_TIMEOUT
+            while True:
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    return False
+                ready, _, _ = select.select([self.sock], [], [], remaining)
+                if not ready:
+                    return False
+                data, peer = self.sock.recvfrom(65536)
+                too_big = _parse_too_big(self.family, self.raw, data)
+                if too_big and too_big[1] in seqs and (
+                        not self.raw or too_big[0] == self.ident):
+                    self.hop = (peer[0], too_big[2])
+                    return False
+                reply = _parse_reply(self.family, self.raw, data)
+                if reply and peer[0] == self.addr and reply[1] in seqs and (
+                        not self.raw or reply[0] == self.ident):
+                    return True
+        except (IOError, OSError) as e:
+            # Bigger than the local interface MTU (or a cached path MTU
+            # reported back to a ping socket)
+            if e.errno == errno.EMSGSIZE:
+                return False
+            raise
+
+    def _fits_ping(self, size):
+        cmd = ["ping", "-n", "-M", "do", "-c", str(PMTU_ATTEMPTS),
+               "-i", str(INTERVAL), "-W", str(REPLY_TIMEOUT),
+               "-s", str(size), self.addr]
+        try:
+            exe(cmd)
+            return True
+        except subprocess.CalledProcessError as e:
+            out = (e.output or b"").decode("utf-8", "replace")
+            for line in out.splitlines():
+                match = PING_TOO_BIG_RE.match(line)
+                if match:
+                    self.hop = (match.group(1), int(match.group(2)))
+            return False
+
+
+def _search_pmtu(host, ceiling):
+    family, addr = _resolve(host)
+    if addr is None:
+        return PmtuResult(host, None)
+    overhead = HEADER_OVERHEAD[family]
+    prober = DfProber(family, addr)
+    try:
+        # Most paths either carry the full MTU or aren't up at all, try
+        # both ends before searching in between
+        if prober.fits(ceiling - overhead):
+            return PmtuResult(host, ceiling)
+        if not prober.fits(0):
+            return PmtuResult(host, None, prober.hop)
+        low, high, best = 1, ceiling - overhead - 1, 0
+        while low <= high:
+            if prober.hop:
+                high = min(high, prober.hop[1] - overhead)
+            mid = (low + high) // 2
+            if prober.fits(mid):
+                best = mid
+                low = mid + 1
+            else:
+                high = mid - 1
+        return PmtuResult(host, best + overhead, prober.hop)
+    finally:
+        prober.close()
+
+
+def discover_pmtu(hosts, ceiling=MAX_MTU):
+    """
+    Binary searches the largest packet that reaches each host with the
+    don't fragment bit set, all hosts at once.  Returns a dict of
+    host --> PmtuResult
+    """
+    results = {}
+
+    def _search(host):
+        results[host] = _search_pmtu(host, ceiling)
+
+    _concurrently(_search, [(host,) for host in hosts])
+    return results
+
+
+class ProbeCache(object):
+    """
+    Run-scoped probe results.
+
+    Each (host, size) is probed, and each host's path MTU discovered, at
+    most once per run.  The first caller probes every host it asks for in
+    one batch and callers asking for hosts already being probed wait for
+    that batch instead of sending their own.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._results = {}
+        self._pending = {}
+
+    def reset(self):
+        with self._lock:
+            self._results = {}
+
+    def probe(self, hosts, size=DEFAULT_SIZE, count=DEFAULT_COUNT):
+        def _probe(todo):
+            results = probe(todo, size=size, count=count)
+            for result in results.values():
+                ps(result.as_dict())
+            return results
+        return self._batch(hosts, size, _probe)
+
+    def pmtu(self, hosts, ceiling=MAX_MTU):
+        return self._batch(hosts, ("pmtu", ceiling),
+                           lambda todo: discover_pmtu(todo, ceiling))
+
+    def _batch(self, hosts, kind, run):
+        hosts = list(hosts)
+        while True:
+            todo, waits = [], []
+            with self._lock:
+                for host in hosts:
+                    key = (host, kind)
+                    if key in self._results:
+                        continue
+                    if key in self._pending:
+                        waits.append(self._pending[key])
+                    else:
+                        self._pending[key] = threading.Event()
+                        todo.append(host)
+            if not todo and not waits:
+                break
+            results = {}
+            try:
+                if todo:
+                    results = run(todo)
+            finally:
+                with self._lock:
+                    for host in todo:
+                        if host in results:
+                            self._results[(host, kind)] = results[host]
+                        self._pending.pop((host, kind)).set()
+            for event in waits:
+                event.wait()
+        with self._lock:
+            return {host: self._results[(host, kind)] for host in hosts}
+
+
+probes = ProbeCache()
+
+
+def probe_cluster(config, size=DEFAULT_SIZE):
+    """
+    Probes the management and access VIP ips together, returns a dict of
+    ip --> ProbeResult
+    """
+    return probes.probe([config[key] for key in CLUSTER_IPS
+                         if config.get(key)], size=size)
+
+
+def pmtu_cluster(config):
+    """
+    Discovers the path MTU to the management and access VIP ips together,
+    returns a dict of ip --> PmtuResult
+    """
+    return probes.pmtu([config[key] for key in CLUSTER_IPS
+                        if config.get(key)])
@@ -0,0 +1,82 @@
+from __future__ import (print_function, unicode_literals, division,
+                        absolute_import)
+
+import io
+import os
+
+PROC = "/proc"
+
+
+class Process(object):
+
+    def __init__(self, pid, ppid, comm, state, argv):
+        self.pid = pid
+        self.ppid = ppid
+        self.comm = comm
+        self.state = state
+        self.argv = argv
+        self.cmdline = " ".join(argv)
+        # Kernel threads have no argv, fall back to the name in stat
+        self.name = os.path.basename(argv[0]) if argv else comm
+
+    def __repr__(self):
+        return "Process({}, {})".format(self.pid, self.cmdline or self.comm)
+
+
+def _read_process(piddir):
+    try:
+        with io.open(os.path.join(piddir, "stat"), 'rb') as f:
+            stat = f.read().decode("utf-8", "replace")
+        with io.open(os.path.join(piddir, "cmdline"), 'rb') as f:
+            cmdline = f.read().decode("utf-8", "replace")
+    except (IOError, OSError):
+        # Process exited while we were scanning
+        return None
+    # comm is wrapped in parens and can itself contain spaces and parens
+    # "1234 (my proc) S 1 ..."
+    lparen = stat.find("(")
+    rparen = stat.rfind(")")
+    pid = int(stat[:lparen])
+    comm = stat[lparen + 1:rparen]
+    fields = stat[rparen + 2:].split()
+    argv = [arg for arg in cmdline.split("\x00") if arg]
+    return Process(pid, int(fields[1]), comm, fields[0], argv)
+
+
+class ProcessIndex(object):
+    """
+    Snapshot of the process table read from /proc/*/stat and
+    /proc/*/cmdline.  Replaces 'ps -ef | grep X | grep -v grep' pipelines,
+    which also can't match themselves here
+    """
+
+    def __init__(self, processes):
+        self.processes = processes
+        self._by_name = {}
+        for proc in processes:
+            self._by_name.setdefault(proc.name, []).append(proc)
+            if proc.comm != proc.name:
+                self._by_name.setdefault(proc.comm, []).append(proc)
+
+    @classmethod
+    def scan(cls, proc=PROC):
+        processes = []
+        me = os.getpid()
+        for entry in os.listdir(proc):
+            if not entry.isdigit() or int(entry) == me:
+                continue
+            process = _read_process(os.path.join(proc, entry))
+            if process is not None:
+                processes.append(process)
+        return cls(processes)
+
+    def by_name(self, name):
+        """Processes whose executable name or comm is exactly name"""
+        return list(self._by_name.get(name, []))
+
+    def find(self, substring):
+        """Processes whose command line contains substring"""
+        return [proc for proc in self.processes if substring in proc.cmdline]
+
+    def pids(self, name):
+        return [proc.pid for proc in self.by_name(name)]
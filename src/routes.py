@@ -0,0 +1,284 @@
+from __future__ import (print_function, unicode_literals, division,
+                        absolute_import)
+
+import os
+import socket
+import subprocess
+import threading
+
+import ipaddress
+
+from common import vprint, exe
+
+# Python 2/3 compatibility
+try:
+    str = unicode
+except NameError:
+    pass
+
+FAMILIES = (4, 6)
+
+# Route types that carry packets to an interface, the rest (unreachable,
+# blackhole, prohibit) end the lookup without a route
+FORWARDING_TYPES = ("unicast", "local", "broadcast", "multicast", "anycast")
+ROUTE_TYPES = FORWARDING_TYPES + ("unreachable", "blackhole", "prohibit",
+                                  "throw", "nat")
+
+# Used when 'ip rule' isn't available (no policy routing support)
+DEFAULT_RULES = ((0, {"lookup": "local"}),
+                 (32766, {"lookup": "main"}),
+                 (32767, {"lookup": "default"}))
+
+
+class Resolver(object):
+    """
+    Memoizes hostname --> ipaddress lookups.  Unresolvable hosts are
+    memoized as None
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._cache = {}
+
+    def reset(self):
+        with self._lock:
+            self._cache = {}
+
+    def resolve(self, host):
+        try:
+            return ipaddress.ip_address(str(host))
+        except ValueError:
+            pass
+        with self._lock:
+            if host in self._cache:
+                return self._cache[host]
+        try:
+            addr = ipaddress.ip_address(str(socket.getaddrinfo(
+                host, None, 0, socket.SOCK_RAW)[0][4][0]))
+        except socket.gaierror as e:
+            vprint("Could not resolve {}: {}".format(host, e))
+            addr = None
+        with self._lock:
+            self._cache[host] = addr
+        return addr
+
+
+resolver = Resolver()
+
+
+def resolve(host):
+    return resolver.resolve(host)
+
+
+class Route(object):
+
+    def __init__(self, net, rtype="unicast", iface=None, gateway=None,
+                 src=None, metric=0, table="main"):
+        self.net = net
+        self.type = rtype
+        self.iface = iface
+        self.gateway = gateway
+        self.src = src
+        self.metric = metric
+        self.table = table
+
+    def __repr__(self):
+        return "Route({} {} dev {} table {})".format(
+            self.type, self.net, self.iface, self.table)
+
+
+def parse_route(line, family):
+    """
+    Parses one line of 'ip route show table all'
+
+        default via 192.0.2.1 dev eth0 metric 100
+        local 192.0.2.2 dev eth0 table local proto kernel scope host
+    """
+    tokens = line.split()
+    if not tokens:
+        return None
+    rtype = "unicast"
+    if tokens[0] in ROUTE_TYPES:
+        rtype = tokens.pop(0)
+    if not tokens:
+        return None
+    dest = tokens.pop(0)
+    if dest == "default":
+        dest = "0.0.0.0/0" if family == 4 else "::/0"
+    try:
+        net = ipaddress.ip_network(str(dest), strict=False)
+    except ValueError:
+        return None
+    opts = dict(zip(tokens[::2], tokens[1::2]))
+    try:
+        metric = int(opts.get("metric", 0))
+    except ValueError:
+        metric = 0
+    return Route(net, rtype=rtype, iface=opts.get("dev"),
+                 gateway=opts.get("via"), src=opts.get("src"),
+                 metric=metric, table=opts.get("table", "main"))
+
+
+def parse_rule(line):
+    """
+    Parses one line of 'ip rule show' into (priority, selectors)
+
+        32765:  from all to 10.1.0.0/16 lookup 100
+    """
+    priority, _, rest = line.partition(":")
+    try:
+        priority = int(priority)
+    except ValueError:
+        return None
+    tokens = rest.split()
+    selectors = {}
+    if tokens[:1] == ["not"]:
+        selectors["not"] = True
+        tokens.pop(0)
+    while tokens:
+        key = tokens.pop(0)
+        # Flag style selectors don't take a value
+        if key in ("l3mdev", "unresolved"):
+            selectors[key] = True
+        elif tokens:
+            selectors[key] = tokens.pop(0)
+    return priority, selectors
+
+
+class _Table(object):
+    """
+    Routes of one table and family bucketed by prefix length, longest
+    prefix first, so a lookup costs one dict probe per prefix length
+    """
+
+    def __init__(self):
+        self.buckets = {}
+
+    def add(self, route):
+        bucket = self.buckets.setdefault(route.net.prefixlen, {})
+        key = int(route.net.network_address)
+        # Lowest metric wins between routes to the same network
+        if key not in bucket or route.metric < bucket[key].metric:
+            bucket[key] = route
+
+    def finish(self):
+        self.ordered = sorted(self.buckets.items(), reverse=True)
+
+    def lookup(self, addr, suppress=-1):
+        value = int(addr)
+        bits = addr.max_prefixlen
+        for prefixlen, bucket in self.ordered:
+            if prefixlen <= suppress:
+                break
+            mask = ((1 << prefixlen) - 1) << (bits - prefixlen)
+            route = bucket.get(value & mask)
+            if route is not None:
+                return route
+        return None
+
+
+class RouteIndex(object):
+    """
+    Longest prefix match over every routing table, following the policy
+    routing rules the way the kernel does for locally generated traffic.
+
+    Built once per run from 'ip route show table all' and 'ip rule show'
+    for both address families
+    """
+
+    def __init__(self, routes, rules=None):
+        self.tables = {}
+        for route in routes:
+            key = (route.table, route.net.version)
+            self.tables.setdefault(key, _Table()).add(route)
+        for table in self.tables.values():
+            table.finish()
+        self.rules = rules or {family: list(DEFAULT_RULES)
+                               for family in FAMILIES}
+
+    @classmethod
+    def scan(cls):
+        routes = []
+        rules = {}
+        for family in FAMILIES:
+            flag = "-{}".format(family)
+            try:
+                out = exe(["ip", flag, "route", "show", "table", "all"],
+                          cache=True)
+            except subprocess.CalledProcessError as e:
+                vprint("Could not read IPv{} routes: {}".format(family, e))
+                out = ""
+            for line in out.splitlines():
+                route = parse_route(line, family)
+                if route is not None:
+                    routes.append(route)
+            try:
+                out = exe(["ip", flag, "rule", "show"], cache=True)
+                rules[family] = sorted(
+                    rule for rule in map(parse_rule, out.splitlines())
+                    if rule is not None)
+            except subprocess.CalledProcessError:
+                rules[family] = list(DEFAULT_RULES)
+        return cls(routes, rules)
+
+    @staticmethod
+    def _rule_matches(selectors, addr):
+        for key, value in selectors.items():
+            if key in ("lookup", "table", "suppress_prefixlength", "pref",
+                       "priority", "proto", "goto", "realms", "not"):
+                continue
+            if key == "from":
+                # Locally generated packets are routed before they have a
+                # source address, only "from all" can match
+                if value != "all":
+                    return False
+            elif key == "to":
+                if value != "all" and addr not in ipaddress.ip_network(
+                        str(value), strict=False):
+                    return False
+            elif key == "iif":
+                if value != "lo":
+                    return False
+            elif key == "uidrange":
+                low, _, high = value.partition("-")
+                if not int(low) <= os.getuid() <= int(high):
+                    return False
+            else:
+                # fwmark, oif, ipproto, ports, etc. never match traffic
+                # the checks send
+                return False
+        return True
+
+    def lookup(self, host):
+        """
+        Returns the Route used to reach host, or None if there isn't one
+        """
+        addr = resolve(host)
+        if addr is None:
+            return None
+        for _, selectors in self.rules.get(addr.version, ()):
+            if "goto" in selectors or "lookup" not in selectors and (
+                    "table" not in selectors):
+                continue
+            matched = self._rule_matches(selectors, addr)
+            if selectors.get("not"):
+                matched = not matched
+            if not matched:
+                continue
+            table = self.tables.get(
+                (selectors.get("lookup", selectors.get("table")),
+                 addr.version))
+            if table is None:
+                continue
+            route = table.lookup(addr, suppress=int(
+                selectors.get("suppress_prefixlength", -1)))
+            if route is None or route.type == "throw":
+                continue
+            if route.type not in FORWARDING_TYPES:
+                return None
+            return route
+        return None
+
+    def interface(self, host):
+        route = self.lookup(host)
+        return route.iface if route else None
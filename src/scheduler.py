@@ -0,0 +1,147 @@
+from __future__ import (print_function, unicode_literals, division,
+                        absolute_import)
+
+import threading
+import time
+import traceback
+
+import common
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
+from common import vprint, tf, cf, CheckExecution, CheckTimeout, set_execution
+from common import DEFAULT_PRIORITY, DEFAULT_CHECK_TIMEOUT
+
+try:
+    from tabulate import tabulate
+except ImportError:
+    tabulate = None
+
+DEFAULT_JOBS = 8
+
+
+class Worker(threading.Thread):
+    """
+    Pulls checks off the shared priority queue until it is empty, keeping
+    track of how many checks it ran and how long it spent running them.
+
+    Each check is run in its own thread so the worker can give up on it
+    once its deadline passes.  Any processes the check started are killed
+    and the check is reported as TIMEOUT.
+    """
+
+    def __init__(self, wid, tasks, config, timeout=None):
+        super(Worker, self).__init__(name="ddct-worker-{}".format(wid))
+        self.daemon = True
+        self.wid = wid
+        self.tasks = tasks
+        self.config = config
+        self.timeout = timeout
+        self.completed = 0
+        self.timeouts = 0
+        self.busy = 0.0
+        self.checks = []
+
+    def run(self):
+        while True:
+            try:
+                _, _, ck = self.tasks.get_nowait()
+            except queue.Empty:
+                return
+            start = time.time()
+            try:
+                self.run_check(ck)
+            finally:
+                self.busy += time.time() - start
+                self.completed += 1
+                self.checks.append(ck.__name__)
+                self.tasks.task_done()
+
+    def run_check(self, ck):
+        timeout = self.timeout
+        if timeout is None:
+            timeout = getattr(ck, '_timeout', DEFAULT_CHECK_TIMEOUT)
+        execution = CheckExecution(timeout=timeout)
+        runner = threading.Thread(
+            target=_run_check,
+            args=(ck, self.config, execution),
+            name="{}-{}".format(self.name, ck.__name__))
+        runner.daemon = True
+        runner.start()
+        runner.join(timeout)
+        if runner.is_alive():
+            vprint("Check {} timed out after {}s, cancelling".format(
+                ck.__name__, timeout))
+            execution.cancel()
+            tf(ck._name, ck._tags, timeout)
+            self.timeouts += 1
+
+
+def _run_check(ck, config, execution):
+    set_execution(execution)
+    try:
+        ck(config)
+    except CheckTimeout:
+        pass
+    except Exception as e:
+        if execution.cancelled:
+            return
+        if ck._cluster and e is getattr(config, "error", None):
+            # The run's failed cluster connection, re-raised by LazyConfig
+            cf(ck._name, ck._tags, e)
+        else:
+            traceback.print_exc()
+
+
+class CheckScheduler(object):
+    """
+    Runs checks on a fixed size pool of worker threads.
+
+    Checks are queued by their "_priority" attribute (set via the @check
+    decorator) and then by the order they were given in, so the pool never
+    runs more than "jobs" checks at the same time.  If "timeout" is given it
+    replaces the per-check timeout set via the @check decorator.
+    """
+
+    def __init__(self, jobs=DEFAULT_JOBS, timeout=None):
+        if jobs < 1:
+            raise ValueError("jobs must be at least 1, got {}".format(jobs))
+        self.jobs = jobs
+        self.timeout = timeout
+        self.workers = []
+        self.elapsed = 0.0
+
+    def run(self, checks, config):
+        tasks = queue.PriorityQueue()
+        for seq, ck in enumerate(checks):
+            tasks.put((getattr(ck, '_priority', DEFAULT_PRIORITY), seq, ck))
+        self.workers = [Worker(wid, tasks, config, timeout=self.timeout)
+                        for wid in range(min(self.jobs, tasks.qsize()))]
+        start = time.time()
+        for worker in self.workers:
+            worker.start()
+        for worker in self.workers:
+            worker.join()
+        self.elapsed = time.time() - start
+        if common.VERBOSE:
+            vprint(self.summary())
+
+    def summary(self):
+        headers = ["Worker", "Checks", "Timeouts", "Busy (s)", "Ran"]
+        if tabulate is None:
+            rows = ["{}\t{}\t{}\t{}\t{}".format(
+                worker.wid, worker.completed, worker.timeouts,
+                round(worker.busy, 2), ", ".join(worker.checks))
+                for worker in self.workers]
+            table = "\n".join(["\t".join(headers)] + rows)
+        else:
+            rows = [[worker.wid,
+                     worker.completed,
+                     worker.timeouts,
+                     round(worker.busy, 2),
+                     "\n".join(worker.checks)] for worker in self.workers]
+            table = tabulate(rows, headers=headers, tablefmt="grid")
+        return "Ran checks with {} workers in {}s\n{}".format(
+            len(self.workers), round(self.elapsed, 2), table)
@@ -5,6 +5,7 @@ import distro
 import psutil
 
 from common import hs
+from facts import fact, PROCESSES, NETWORK
 
 
 GBi = (1024 * 1024 * 1024.0)
@@ -23,16 +24,18 @@ def get_host_state(config):
     hs("swap_free", str(round(
         psutil.swap_memory().free / GBi, 2)) + " GBi")
     infs = {}
-    stats = psutil.net_if_stats()
-    for name, inf in psutil.net_if_addrs().items():
+    for name, inf in fact(NETWORK).interfaces.items():
         inf_info = {}
-        inf_info['address'] = "/".join((str(inf[0].address),
-                                        str(inf[0].netmask)))
-        inf_info['status'] = 'up' if stats[name].isup else 'down'
-        inf_info['mtu'] = stats[name].mtu
+        if inf.addresses:
+            inf_info['address'] = "/".join(
+                (str(inf.addresses[0][0]), str(inf.addresses[0][1])))
+        inf_info['status'] = 'up' if inf.up else 'down'
+        inf_info['mtu'] = inf.mtu
+        inf_info['type'] = inf.kind
+        if inf.speed:
+            inf_info['speed'] = "{}Mb/s {}".format(inf.speed, inf.duplex)
+        if inf.lower:
+            inf_info['lower'] = ", ".join(inf.lower)
         infs[name] = inf_info
     hs("interfaces", infs)
-    pids = map(lambda x: x.pid,
-               filter(lambda x: 'iscsid' in x.info['name'],
-                      psutil.process_iter(attrs=['pid', 'name'])))
-    hs("iscsid_pids", pids)
+    hs("iscsid_pids", fact(PROCESSES).pids("iscsid"))
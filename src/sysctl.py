@@ -0,0 +1,78 @@
+from __future__ import (print_function, unicode_literals, division,
+                        absolute_import)
+
+import io
+import os
+
+PROC_SYS = "/proc/sys"
+
+
+def parse_value(value):
+    """
+    Normalizes a sysctl value so values read from /proc/sys compare equal to
+    the ones written in checks
+
+        "1"                     --> 1
+        "4096\\t87380\\t16777216" --> (4096, 87380, 16777216)
+        "\\"4096 87380 16777216\\"" --> (4096, 87380, 16777216)
+        "cubic"                 --> "cubic"
+    """
+    parts = value.strip().strip("\"").split()
+    try:
+        parts = tuple(int(part) for part in parts)
+    except ValueError:
+        return " ".join(parts)
+    if len(parts) == 1:
+        return parts[0]
+    return parts
+
+
+def format_value(value):
+    if isinstance(value, tuple):
+        return " ".join(str(v) for v in value)
+    return str(value)
+
+
+def key_to_path(key):
+    # Dots inside a component (eg. vlan interface "eth0.100") are written
+    # as slashes in sysctl keys: net.ipv4.conf.eth0/100.rp_filter
+    parts = [part.replace("/", ".") for part in key.split(".")]
+    return os.path.join(PROC_SYS, *parts)
+
+
+def path_to_key(path):
+    parts = os.path.relpath(path, PROC_SYS).split(os.sep)
+    return ".".join(part.replace(".", "/") for part in parts)
+
+
+def _read(path):
+    try:
+        with io.open(path, 'rb') as f:
+            return f.read().decode("utf-8", "replace")
+    except (IOError, OSError):
+        # Write-only and permission restricted entries
+        return None
+
+
+def read_sysctl(keys=None):
+    """
+    Reads sysctl values directly from /proc/sys without spawning 'sysctl'.
+
+    When keys is None the whole tree is walked once, otherwise only the
+    requested keys are read.  Returns a dict of key --> normalized value
+    (see parse_value).  Keys that can't be read are left out
+    """
+    result = {}
+    if keys is not None:
+        for key in keys:
+            value = _read(key_to_path(key))
+            if value is not None:
+                result[key] = parse_value(value)
+        return result
+    for root, _, files in os.walk(PROC_SYS):
+        for name in files:
+            path = os.path.join(root, name)
+            value = _read(path)
+            if value is not None:
+                result[path_to_key(path)] = parse_value(value)
+    return result
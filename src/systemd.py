@@ -0,0 +1,164 @@
+from __future__ import (print_function, unicode_literals, division,
+                        absolute_import)
+
+import re
+import subprocess
+
+from common import vprint, exe
+
+try:
+    import dbus
+except ImportError:
+    dbus = None
+
+PROPERTIES = ("Id", "LoadState", "ActiveState", "SubState", "UnitFileState",
+              "ExecStart")
+
+SYSTEMD_BUS = "org.freedesktop.systemd1"
+SYSTEMD_PATH = "/org/freedesktop/systemd1"
+UNIT_IFACE = "org.freedesktop.systemd1.Unit"
+SERVICE_IFACE = "org.freedesktop.systemd1.Service"
+MANAGER_IFACE = "org.freedesktop.systemd1.Manager"
+PROPS_IFACE = "org.freedesktop.DBus.Properties"
+
+# Debian style: " [ + ]  irqbalance"
+SYSV_DEB_RE = re.compile(r"^\s*\[\s*([+\-?])\s*\]\s+(\S+)\s*$")
+# RHEL style: "irqbalance (pid  1234) is running..."
+SYSV_RHEL_RE = re.compile(r"^(\S+)\s.*\b(is running|is stopped)")
+
+
+class UnitState(object):
+
+    def __init__(self, name, load_state=None, active_state=None,
+                 sub_state=None, unit_file_state=None, exec_start=""):
+        self.name = name
+        self.load_state = load_state
+        self.active_state = active_state
+        self.sub_state = sub_state
+        self.unit_file_state = unit_file_state
+        self.exec_start = exec_start
+
+    @property
+    def active(self):
+        return self.active_state == "active"
+
+    @property
+    def found(self):
+        return self.load_state not in (None, "not-found")
+
+    def __repr__(self):
+        return "UnitState({}, {}/{})".format(
+            self.name, self.active_state, self.sub_state)
+
+
+def _unit_name(name):
+    if "." in name:
+        return name
+    return name + ".service"
+
+
+def _query_dbus(units):
+    bus = dbus.SystemBus()
+    systemd = bus.get_object(SYSTEMD_BUS, SYSTEMD_PATH)
+    manager = dbus.Interface(systemd, MANAGER_IFACE)
+    result = {}
+    for name in units:
+        path = manager.LoadUnit(_unit_name(name))
+        props = dbus.Interface(bus.get_object(SYSTEMD_BUS, path),
+                               PROPS_IFACE)
+        unit = props.GetAll(UNIT_IFACE)
+        exec_start = ""
+        if (unit["LoadState"] != "not-found" and
+                _unit_name(name).endswith(".service")):
+            # ExecStart is a list of (path, argv, ignore_errors, ...),
+            # format it the same way 'systemctl show' does
+            exec_start = " ".join(
+                "{{ path={} ; argv[]={} ; }}".format(
+                    entry[0], " ".join(entry[1]))
+                for entry in props.Get(SERVICE_IFACE, "ExecStart"))
+        result[name] = UnitState(name,
+                                 load_state=str(unit["LoadState"]),
+                                 active_state=str(unit["ActiveState"]),
+                                 sub_state=str(unit["SubState"]),
+                                 unit_file_state=str(unit["UnitFileState"]),
+                                 exec_start=exec_start)
+    return result
+
+
+def _query_systemctl(units):
+    # 'systemctl show' prints one block of properties per unit, in the order
+    # requested, separated by blank lines
+    out = exe(["systemctl", "show", "--no-pager",
+               "--property={}".format(",".join(PROPERTIES))] +
+              [_unit_name(u) for u in units])
+    blocks = [{}]
+    for line in out.splitlines():
+        if not line.strip():
+            if blocks[-1]:
+                blocks.append({})
+            continue
+        key, _, value = line.partition("=")
+        blocks[-1][key] = value
+    result = {}
+    for name, props in zip(units, blocks):
+        result[name] = UnitState(name,
+                                 load_state=props.get("LoadState"),
+                                 active_state=props.get("ActiveState"),
+                                 sub_state=props.get("SubState"),
+                                 unit_file_state=props.get("UnitFileState"),
+                                 exec_start=props.get("ExecStart", ""))
+    return result
+
+
+def _query_sysv(units):
+    try:
+        out = exe("service --status-all 2>&1")
+    except subprocess.CalledProcessError as e:
+        # Exits non-zero if any service is stopped
+        out = e.output.decode("utf-8")
+    found = {}
+    for line in out.splitlines():
+        match = SYSV_DEB_RE.match(line)
+        if match:
+            status, name = match.groups()
+            found[name] = {"+": "active", "-": "inactive"}.get(status)
+            continue
+        match = SYSV_RHEL_RE.match(line)
+        if match:
+            name, status = match.groups()
+            found[name] = "active" if status == "is running" else "inactive"
+    result = {}
+    for name in units:
+        state = found.get(name)
+        result[name] = UnitState(
+            name,
+            load_state="loaded" if name in found else "not-found",
+            active_state=state or "unknown")
+    return result
+
+
+def query_units(units, systemctl=True):
+    """
+    Fetches the state of all the given units at once.  Uses the systemd
+    D-Bus API when dbus-python is available, otherwise a single
+    'systemctl show' for every unit.  Hosts without systemd, or where
+    systemd can't be reached, fall back to a single 'service --status-all'.
+
+    Returns a dict of unit name --> UnitState
+    """
+    units = list(units)
+    if not units:
+        return {}
+    if not systemctl:
+        return _query_sysv(units)
+    if dbus is not None:
+        try:
+            return _query_dbus(units)
+        except dbus.DBusException as e:
+            vprint("Could not query systemd over D-Bus: {}".format(e))
+    try:
+        return _query_systemctl(units)
+    except subprocess.CalledProcessError as e:
+        # systemctl is installed but systemd isn't running (eg. containers)
+        vprint("Could not query systemd: {}".format(e))
+        return _query_sysv(units)
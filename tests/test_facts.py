@@ -0,0 +1,61 @@
+from __future__ import (print_function, unicode_literals, division,
+                        absolute_import)
+
+import os
+import sys
+import threading
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                "..", "src"))
+
+import facts  # noqa: E402
+from systemd import UnitState  # noqa: E402
+
+
+class HostFactsTest(unittest.TestCase):
+    """Lookups that aren't covered by the facts collected up front"""
+
+    def setUp(self):
+        self.queried = []
+        self.query_units = facts.query_units
+        facts.query_units = self._query_units
+        self.facts = facts.HostFacts()
+
+    def tearDown(self):
+        facts.query_units = self.query_units
+
+    def _query_units(self, units, systemctl=True):
+        self.queried.append(list(units))
+        return {name: UnitState(name, load_state="loaded",
+                                active_state="active")
+                for name in units}
+
+    def _call(self, func, *args):
+        # A deadlock would hang the test run instead of failing it
+        result = []
+        thread = threading.Thread(target=lambda: result.append(func(*args)))
+        thread.daemon = True
+        thread.start()
+        thread.join(5)
+        self.assertFalse(thread.is_alive(), "lookup did not return")
+        return result[0]
+
+    def test_unit_not_prefetched(self):
+        state = self._call(self.facts.unit, "docker")
+        self.assertEqual(state.name, "docker")
+        self.assertTrue(state.active)
+        self.assertIs(self._call(self.facts.unit, "docker"), state)
+        self.assertEqual(self.queried, [list(facts.SERVICES), ["docker"]])
+
+    def test_unit_prefetched(self):
+        self._call(self.facts.unit, "iscsid")
+        self.assertEqual(self.queried, [list(facts.SERVICES)])
+
+    def test_which_not_prefetched(self):
+        self.assertIsNone(self._call(self.facts.which, "ddct-no-such-bin"))
+        self.assertIn("ddct-no-such-bin", self.facts._binaries)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,164 @@
+from __future__ import (print_function, unicode_literals, division,
+                        absolute_import)
+
+import base64
+import json
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import unittest
+
+try:
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+except ImportError:
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                "..", "src"))
+
+import k8s  # noqa: E402
+import k8s_client  # noqa: E402
+import k8s_yaml  # noqa: E402
+
+TOKEN = "test-token"
+
+RESPONSES = {
+    "/version": {"major": "1", "minor": "16+"},
+    "/api/v1/pods": {"kind": "PodList", "items": [
+        {"metadata": {"name": "csi-node-a", "namespace": "kube-system",
+                      "ownerReferences": [{"kind": "DaemonSet",
+                                           "name": "csi-node",
+                                           "controller": True}]},
+         "spec": {"nodeName": "node-a"},
+         "status": {"phase": "Running",
+                    "conditions": [{"type": "Ready", "status": "True"}]}}]},
+    "/apis/apps/v1/daemonsets": {"kind": "DaemonSetList", "items": [
+        {"metadata": {"name": "csi-node", "namespace": "kube-system"},
+         "status": {"desiredNumberScheduled": 1, "numberReady": 1}}]},
+    "/apis/apps/v1/statefulsets": {"kind": "StatefulSetList", "items": [
+        {"metadata": {"name": "csi-provisioner",
+                      "namespace": "kube-system"},
+         "spec": {"replicas": 1}, "status": {"readyReplicas": 0}}]},
+    "/api/v1/namespaces/kube-system/secrets/datera-secret": {
+        "kind": "Secret",
+        "data": {"username": base64.b64encode(b"admin").decode("ascii"),
+                 "password": base64.b64encode(b"secret").decode("ascii")}},
+}
+
+KUBECONFIG = """
+apiVersion: v1
+kind: Config
+current-context: test
+contexts:
+- name: test
+  context: {{cluster: test, user: test}}
+clusters:
+- name: test
+  cluster: {{server: "http://127.0.0.1:{port}"}}
+users:
+- name: test
+  user: {{token: {token}}}
+"""
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    # Don't let a kept alive connection hang the server on shutdown
+    timeout = 5
+
+    def setup(self):
+        # One handler per TCP connection
+        self.server.connections += 1
+        BaseHTTPRequestHandler.setup(self)
+
+    def do_GET(self):
+        self.server.requests.append(self.path)
+        if self.headers.get("Authorization") != "Bearer " + TOKEN:
+            code, body = 401, {"kind": "Status", "code": 401}
+        elif self.path in RESPONSES:
+            code, body = 200, RESPONSES[self.path]
+        else:
+            code, body = 404, {"kind": "Status", "code": 404}
+        data = json.dumps(body).encode("utf-8")
+        self.send_response(code)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, *args):
+        pass
+
+
+class KubeClientTest(unittest.TestCase):
+    """Runs the snapshot and secret queries against a stand-in API server"""
+
+    def setUp(self):
+        self.server = HTTPServer(("127.0.0.1", 0), _Handler)
+        self.server.requests = []
+        self.server.connections = 0
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+        self.tmp = tempfile.mkdtemp()
+        path = os.path.join(self.tmp, "config")
+        with open(path, "w") as f:
+            f.write(KUBECONFIG.format(port=self.server.server_address[1],
+                                      token=TOKEN))
+        self.env = os.environ.get("KUBECONFIG")
+        os.environ["KUBECONFIG"] = path
+        k8s_client.ENABLED = True
+        k8s_client._client = None
+        k8s_client._loaded = False
+
+    def tearDown(self):
+        if k8s_client._client is not None:
+            # Releases the kept alive connection the server is serving
+            k8s_client._client.session.close()
+        self.server.shutdown()
+        self.server.server_close()
+        shutil.rmtree(self.tmp)
+        if self.env is None:
+            del os.environ["KUBECONFIG"]
+        else:
+            os.environ["KUBECONFIG"] = self.env
+        k8s_client._client = None
+        k8s_client._loaded = False
+
+    def test_client_from_kubeconfig(self):
+        client = k8s_client.get_client()
+        self.assertIsNotNone(client)
+        self.assertIs(client, k8s_client.get_client())
+
+    def test_snapshot(self):
+        snap = k8s.KubeSnapshot.scan()
+        self.assertEqual(snap.server_version, (1, 16))
+        self.assertIsNone(snap.client_version)
+        nodes = snap.workload(k8s.DAEMONSET, "kube-system", "csi-node")
+        self.assertTrue(nodes.healthy)
+        pods = snap.find_pods(owner=nodes)
+        self.assertEqual([pod.name for pod in pods], ["csi-node-a"])
+        self.assertTrue(pods[0].ready)
+        controller = snap.workload(k8s.STATEFULSET, "kube-system",
+                                   "csi-provisioner")
+        self.assertFalse(controller.healthy)
+
+    def test_secrets(self):
+        secrets, errors = k8s_yaml._get_secrets(
+            {("kube-system", "datera-secret"): {"username", "password"}})
+        self.assertEqual(errors, [])
+        self.assertEqual(secrets[("kube-system", "datera-secret")],
+                         {"username": "admin", "password": "secret"})
+
+    def test_connection_reused(self):
+        k8s.KubeSnapshot.scan()
+        k8s.KubeSnapshot.scan()
+        # 3 lists and /version per scan over one kept alive connection
+        self.assertEqual(len(self.server.requests), 8)
+        self.assertEqual(self.server.connections, 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
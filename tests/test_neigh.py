@@ -0,0 +1,56 @@
+from __future__ import (print_function, unicode_literals, division,
+                        absolute_import)
+
+import os
+import sys
+import time
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                "..", "src"))
+
+import neigh  # noqa: E402
+
+STALE = "10.0.0.1"
+REACHABLE = "10.0.0.2"
+
+
+class NeighborWatcherTest(unittest.TestCase):
+    """Waits against a neighbor table that is only changed by the test"""
+
+    def setUp(self):
+        self.table = {STALE: "STALE", REACHABLE: neigh.REACHABLE}
+        self.read_neighbors = neigh.read_neighbors
+        self.normalize = neigh.normalize
+        neigh.read_neighbors = lambda: dict(self.table)
+        neigh.normalize = lambda ip: ip
+        self.watcher = neigh.NeighborWatcher(timeout=0.5, interval=0.05)
+
+    def tearDown(self):
+        neigh.read_neighbors = self.read_neighbors
+        neigh.normalize = self.normalize
+
+    def test_shared_deadline(self):
+        start = time.time()
+        self.watcher.watch([STALE, REACHABLE])
+        self.assertFalse(self.watcher.wait(STALE))
+        self.assertTrue(self.watcher.wait(REACHABLE))
+        self.assertFalse(self.watcher.wait(STALE))
+        # Waits one after another still share the one deadline
+        self.assertLess(time.time() - start, 0.9)
+
+    def test_fresh_read_after_deadline(self):
+        self.watcher.watch([STALE])
+        self.assertFalse(self.watcher.wait(STALE))
+        self.table[STALE] = neigh.REACHABLE
+        self.assertTrue(self.watcher.wait(STALE))
+
+    def test_resolves_when_reachable(self):
+        start = time.time()
+        self.watcher.watch([REACHABLE])
+        self.assertTrue(self.watcher.wait(REACHABLE))
+        self.assertLess(time.time() - start, 0.4)
+
+
+if __name__ == "__main__":
+    unittest.main()